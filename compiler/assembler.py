@@ -1,16 +1,25 @@
 from compilerenums import *
 import struct
+import tempfile
+import shutil
 
 class AssemblerError(SyntaxError):
     pass
 
 class Assembler():
 
-    def __init__(self, constants, main, procedures):
+    def __init__(self, constants, main, procedures, strip_labels=False, global_names=[], profile_table=False):
         self.constants = constants
+        # The name of every global variable, in the order of their indices
+        self.global_names = global_names
         self.main = main
         self.procedures = procedures
+        # Labels only mark an address, when stripped they are not written out at all
+        self.strip_labels = strip_labels
         self.assembled = []
+        # When writing the profile table, the (ProfileKinds, address, id) of every profile point assembled so far
+        self.profile_table = profile_table
+        self.profile_points = []
         
     def enum_to_byte(self, oppcode):
         return bytearray(oppcode.value.to_bytes(1, byteorder = "little"))
@@ -29,164 +38,314 @@ class Assembler():
         return bytearray(str, "ascii") + bytearray(1)
 
     def assemble_constant(self, constant):
+        # The uid is not written out, constants are written in the order of their uids
         output = bytearray()
-        uid = constant[0]
         typ = constant[1][0]
         values = constant[1][1]
         if(typ ==  Types.number):
             output += self.enum_to_byte(OppCodes.const_data)
-            output += self.uid_to_4_bytes(uid)
             output += self.enum_to_byte(Types.number)
             output += self.double_to_8_bytes(values[0])
             return output
         elif(typ == Types.string):
             output += self.enum_to_byte(OppCodes.const_data)
-            output += self.uid_to_4_bytes(uid)
             output += self.enum_to_byte(Types.string)
             output += self.string_to_byes(values[0])
             return output
         elif(typ == Types.symbol):
             output += self.enum_to_byte(OppCodes.const_data)
-            output += self.uid_to_4_bytes(uid)
             output += self.enum_to_byte(Types.symbol)
             output += self.string_to_byes(values[0])
             return output
         elif(typ == Types.list):
             output += self.enum_to_byte(OppCodes.const_data)
-            output += self.uid_to_4_bytes(uid)
             output += self.enum_to_byte(Types.list)
             output += self.uid_to_4_bytes(len(values))
             for val in values:
                 output += self.uid_to_4_bytes(val)
             return output
+        elif(typ == Types.pair):
+            output += self.enum_to_byte(OppCodes.const_data)
+            output += self.enum_to_byte(Types.pair)
+            output += self.uid_to_4_bytes(values[0])
+            output += self.uid_to_4_bytes(values[1])
+            return output
         else:
             raise str(type(typ)) + " can't be processed in assemble_constant"
     
+    def check_constant_uid(self, constant, index):
+        # The VM stores the constants in a vector after the defaults, so the uids have to be dense
+        if(constant[0] != len(Defaults) + index):
+            raise AssemblerError("constant uid " + str(constant[0]) + " is out of order, expected " + str(len(Defaults) + index))
+
     def assemble_constants(self):
         output = []
-        output.append(self.enum_to_byte(OppCodes.data_start))
-        for const in self.constants:
+        output.append(self.enum_to_byte(OppCodes.data_start) + self.uid_to_4_bytes(len(self.constants)))
+        for (index, const) in enumerate(self.constants):
+            self.check_constant_uid(const, index)
             output.append(self.assemble_constant(const))
+        output.append(self.assemble_global_names(self.global_names))
+        if(self.profile_table):
+            # The table is placed after the code, its address is filled in once that is assembled
+            output.append(self.enum_to_byte(OppCodes.profile_table) + self.uid_to_4_bytes(0))
         output.append(self.enum_to_byte(OppCodes.data_end))
         return output
+
+    def assemble_global_names(self, global_names):
+        # The VM keeps the globals in a vector, the names are only needed to report errors and to link the
+        # built ins to their slots
+        output = self.enum_to_byte(OppCodes.global_names) + self.uid_to_4_bytes(len(global_names))
+        for name in global_names:
+            output += self.string_to_byes(name)
+        return output
         
+    def assemble_profile_table(self):
+        # The number of points, then the kind, address and id of every one. The VM only reads it when profiling
+        output = self.uid_to_4_bytes(len(self.profile_points))
+        for (kind, address, point_id) in self.profile_points:
+            output += self.num_to_byte(kind.value) + self.uid_to_4_bytes(address) + self.uid_to_4_bytes(point_id)
+        return output
+
     def no_of_bytes_in_a_body(self, lst):
         return sum(map(len, lst))
     def no_of_bytes_in_list_body(self, lst_bodies):
         return sum(map(self.no_of_bytes_in_a_body, lst_bodies))
     
+    def opp_byte(self, opp_code):
+        return bytearray((self.opp_values[opp_code],))
+
+    def need_label(self, label, line, fixups):
+        fixups["labels"].setdefault(label, []).append(line)
+
+    # The encoders of the instructions, one for every layout of the input. Each one takes the OppCode, the input,
+    # the index of the line the instruction will be in and the addresses to fill in once they are known. It
+    # returns the assembled line, None if nothing is written out. The addresses are zeroed until then
+
+    def encode_no_input(self, opp_code, operand, line, fixups):
+        return self.opp_byte(opp_code)
+
+    def encode_4_bytes(self, opp_code, operand, line, fixups):
+        # The index of a global variable or the uid of a constant
+        if(type(operand) != int):
+            raise AssemblerError(str(type(operand)) + " not of type int")
+        return self.opp_byte(opp_code) + self.uid_to_4_bytes(operand)
+
+    def encode_local(self, opp_code, operand, line, fixups):
+        # The operand is (depth, index) of the variable's frame and slot
+        (depth, index) = operand
+        return self.opp_byte(opp_code) + self.uid_to_4_bytes(depth) + self.uid_to_4_bytes(index)
+
+    def encode_byte(self, opp_code, operand, line, fixups):
+        # The number of slots in the frame, or the slot to box
+        return self.opp_byte(opp_code) + self.num_to_byte(operand)
+
+    def encode_primitive(self, opp_code, operand, line, fixups):
+        # The arithmetic operations take the number of arguments
+        if(operand == None):
+            return self.opp_byte(opp_code)
+        return self.opp_byte(opp_code) + self.num_to_byte(operand)
+
+    def encode_jump(self, opp_code, operand, line, fixups):
+        # The operand is a label
+        self.need_label(operand, line, fixups)
+        return self.opp_byte(opp_code) + self.uid_to_4_bytes(0)
+
+    def encode_fused_jump(self, opp_code, operand, line, fixups):
+        # The operand is (number_of_slots, label) or (test_opp, label), the address comes first so that it is
+        # filled in like the one of a branch
+        (first, label) = operand
+        self.need_label(label, line, fixups)
+        first = self.opp_values[first] if opp_code == OppCodes.branch_if_not else first
+        return self.opp_byte(opp_code) + self.uid_to_4_bytes(0) + self.num_to_byte(first)
+
+    def encode_make_closure(self, opp_code, operand, line, fixups):
+        # The operand is (procedure_uid, number_of_captured_variables)
+        (uid, no_captured) = operand
+        if(uid in fixups["lambdas"]):
+            raise AssemblerError("make_closure uid not unique")
+        fixups["lambdas"][uid] = line
+        return self.opp_byte(opp_code) + self.uid_to_4_bytes(0) + self.uid_to_4_bytes(no_captured)
+
+    def encode_call_direct(self, opp_code, operand, line, fixups):
+        # The operand is (global_index, procedure_uid), the address of the procedure is added later
+        (index, uid) = operand
+        fixups["calls"].setdefault(uid, []).append(line)
+        return self.opp_byte(opp_code) + self.uid_to_4_bytes(index) + self.uid_to_4_bytes(0)
+
+    # The register instructions. Registers are one byte, a list of them is written out as its length and the
+    # registers. The address of a jump, a closure or a direct call is in the same place as in the stack instructions
+
+    def register_list(self, registers):
+        return self.num_to_byte(len(registers)) + bytearray(registers)
+
+    def encode_enter(self, opp_code, operand, line, fixups):
+        # The operand is (frame_size, number_of_parameters), a frame can have 256 registers
+        (frame_size, parameters) = operand
+        return self.opp_byte(opp_code) + self.uid_to_4_bytes(frame_size) + self.uid_to_4_bytes(parameters)
+
+    def encode_registers(self, opp_code, operand, line, fixups):
+        # The operand is (register, register), the destination first
+        return self.opp_byte(opp_code) + bytearray(operand)
+
+    def encode_register_4_bytes(self, opp_code, operand, line, fixups):
+        # The operand is (register, global_index) or (register, constant_uid)
+        (register, index) = operand
+        return self.opp_byte(opp_code) + self.num_to_byte(register) + self.uid_to_4_bytes(index)
+
+    def encode_register_primitive(self, opp_code, operand, line, fixups):
+        # The operand is (primitive_opp, destination, registers)
+        (primitive, destination, registers) = operand
+        return self.opp_byte(opp_code) + bytearray((self.opp_values[primitive], destination)) + self.register_list(registers)
+
+    def encode_register_jump(self, opp_code, operand, line, fixups):
+        # The operand is (register, label) or (base_register, registers, label) of a reg_loop
+        self.need_label(operand[-1], line, fixups)
+        output = self.opp_byte(opp_code) + self.uid_to_4_bytes(0) + self.num_to_byte(operand[0])
+        if(opp_code == OppCodes.reg_loop):
+            output += self.register_list(operand[1])
+        return output
+
+    def encode_register_test(self, opp_code, operand, line, fixups):
+        # The operand is (test_opp, registers, label)
+        (test, registers, label) = operand
+        self.need_label(label, line, fixups)
+        return self.opp_byte(opp_code) + self.uid_to_4_bytes(0) + self.num_to_byte(self.opp_values[test]) + self.register_list(registers)
+
+    def encode_register_call(self, opp_code, operand, line, fixups):
+        # The operand is (procedure_register, destination, registers), there is no destination in tail position.
+        # The calls to globals have the index of the global instead of the register
+        output = self.opp_byte(opp_code)
+        if(opp_code in [OppCodes.reg_call, OppCodes.reg_tail_call]):
+            output += self.num_to_byte(operand[0])
+        else:
+            output += self.uid_to_4_bytes(operand[0])
+        if(opp_code in [OppCodes.reg_call, OppCodes.reg_call_global]):
+            output += self.num_to_byte(operand[1])
+        return output + self.register_list(operand[-1])
+
+    def encode_register_call_direct(self, opp_code, operand, line, fixups):
+        # The operand is (global_index, procedure_uid, destination, registers) or (global_index, procedure_uid,
+        # registers) in tail position, the address of the procedure is added later
+        (index, uid) = operand[:2]
+        fixups["calls"].setdefault(uid, []).append(line)
+        output = self.opp_byte(opp_code) + self.uid_to_4_bytes(index) + self.uid_to_4_bytes(0)
+        if(opp_code == OppCodes.reg_call_direct):
+            output += self.num_to_byte(operand[2])
+        return output + self.register_list(operand[-1])
+
+    def encode_register_closure(self, opp_code, operand, line, fixups):
+        # The operand is (procedure_uid, destination, captured_registers)
+        (uid, destination, registers) = operand
+        if(uid in fixups["lambdas"]):
+            raise AssemblerError("reg_closure uid not unique")
+        fixups["lambdas"][uid] = line
+        return self.opp_byte(opp_code) + self.uid_to_4_bytes(0) + self.num_to_byte(destination) + self.register_list(registers)
+
+    def encode_label(self, opp_code, operand, line, fixups):
+        if(operand in fixups["label_locations"]):
+            raise AssemblerError(str(operand) + " already in label_locations")
+        # Labels only mark the address of the next line, when they are not stripped they are written out as an
+        # instruction that does nothing to make it easier to debug
+        if(self.strip_labels):
+            fixups["label_locations"][operand] = line
+            return None
+        fixups["label_locations"][operand] = line + 1
+        return self.opp_byte(opp_code)
+
+    def encode_profile_point(self, opp_code, operand, line, fixups):
+        # The operand is (kind, id). A procedure is profiled at its start, the other points at the instruction
+        # right before them
+        (kind, point_id) = operand
+        fixups["profile"].append((kind, 0 if kind == ProfileKinds.procedure else line - 1, point_id))
+        return None
+
+    def encode_error(self, opp_code, operand, line, fixups):
+        if(opp_code == OppCodes.call_global):
+            raise AssemblerError("call_global has to be linked before it is assembled")
+        raise AssemblerError("Should not have a " + opp_code.name + " in the body")
+
+    # The value of every OppCode, reading it from the enum is slow
+    opp_values = {opp: opp.value for opp in OppCodes}
+
+    encoders = {
+        OppCodes.opp_null: encode_no_input,
+        OppCodes.unbind: encode_no_input,
+        OppCodes.apply: encode_no_input,
+        OppCodes.ret: encode_no_input,
+        OppCodes.push: encode_no_input,
+        OppCodes.ext: encode_no_input,
+        OppCodes.proc_end: encode_no_input,
+        OppCodes.global_get: encode_4_bytes,
+        OppCodes.global_set: encode_4_bytes,
+        OppCodes.global_define: encode_4_bytes,
+        OppCodes.load_const: encode_4_bytes,
+        OppCodes.const_push: encode_4_bytes,
+        OppCodes.lookup_local: encode_local,
+        OppCodes.set_local: encode_local,
+        OppCodes.lookup_boxed: encode_local,
+        OppCodes.set_boxed: encode_local,
+        OppCodes.lookup_push: encode_local,
+        OppCodes.lookup_apply: encode_local,
+        OppCodes.bind: encode_byte,
+        OppCodes.rebind: encode_byte,
+        OppCodes.box_slot: encode_byte,
+        OppCodes.save_continuation: encode_jump,
+        OppCodes.if_false_branch: encode_jump,
+        OppCodes.if_true_branch: encode_jump,
+        OppCodes.branch: encode_jump,
+        OppCodes.rebind_branch: encode_fused_jump,
+        OppCodes.branch_if_not: encode_fused_jump,
+        OppCodes.make_closure: encode_make_closure,
+        OppCodes.call_direct: encode_call_direct,
+        OppCodes.label: encode_label,
+        OppCodes.profile_point: encode_profile_point,
+        OppCodes.reg_enter: encode_enter,
+        OppCodes.reg_const: encode_register_4_bytes,
+        OppCodes.reg_move: encode_registers,
+        OppCodes.reg_global_get: encode_register_4_bytes,
+        OppCodes.reg_global_set: encode_register_4_bytes,
+        OppCodes.reg_global_define: encode_register_4_bytes,
+        OppCodes.reg_box: encode_byte,
+        OppCodes.reg_unbox: encode_registers,
+        OppCodes.reg_set_box: encode_registers,
+        OppCodes.reg_prim: encode_register_primitive,
+        OppCodes.reg_branch_false: encode_register_jump,
+        OppCodes.reg_branch_true: encode_register_jump,
+        OppCodes.reg_branch_if_not: encode_register_test,
+        OppCodes.reg_loop: encode_register_jump,
+        OppCodes.reg_call: encode_register_call,
+        OppCodes.reg_tail_call: encode_register_call,
+        OppCodes.reg_call_global: encode_register_call,
+        OppCodes.reg_tail_call_global: encode_register_call,
+        OppCodes.reg_call_direct: encode_register_call_direct,
+        OppCodes.reg_tail_call_direct: encode_register_call_direct,
+        OppCodes.reg_ret: encode_byte,
+        OppCodes.reg_closure: encode_register_closure,
+        OppCodes.call_global: encode_error,
+        OppCodes.data_start: encode_error,
+        OppCodes.data_end: encode_error,
+    }
+    for opp in OppCodes:
+        if(OppCodes.prim_add.value <= opp.value <= OppCodes.prim_is_symbol.value or
+           OppCodes.unchecked_add.value <= opp.value <= OppCodes.unchecked_ge.value):
+            encoders[opp] = encode_primitive
+    del opp
+
     def assemble_body(self, instruction_body):
         output = []
-        # {label_uid: [line_that_needs_this_label,]}
-        lines_that_need_label = {}
-        # {label_uid: label_line}
-        label_locations = {}
-        # {lambda_uid: line_that_needs_the_ip_of_this_lambda}
-        lines_that_need_lambda = {}
-        for instruction in instruction_body:
-            opp_code = instruction[0]
-            operand = instruction[1]
-            if(opp_code == OppCodes.opp_null):
-                output.append(self.enum_to_byte(OppCodes.opp_null))
-            elif(opp_code == OppCodes.unbind):
-                output.append(self.enum_to_byte(OppCodes.unbind))
-            elif(opp_code == OppCodes.lookup):
-                compiled = self.enum_to_byte(OppCodes.lookup)
-                if(type(operand) != str):
-                    raise AssemblerError(str(type(operand)) + " not of type string")
-                # Null terminated string
-                compiled += self.string_to_byes(operand)
-                output.append(compiled)
-            elif(opp_code == OppCodes.load_const):
-                output.append(self.enum_to_byte(OppCodes.load_const) + self.uid_to_4_bytes(operand))
-            elif(opp_code == OppCodes.bind):
-                no_vars = len(operand)
-                compiled = self.enum_to_byte(OppCodes.bind)
-                compiled += self.num_to_byte(no_vars)
-                for i in range(no_vars):
-                    compiled += self.string_to_byes(operand[i])
-                output.append(compiled)
-            elif(opp_code == OppCodes.apply):
-                output.append(self.enum_to_byte(OppCodes.apply))
-            elif(opp_code == OppCodes.ret):
-                output.append(self.enum_to_byte(OppCodes.ret))
-            elif(opp_code == OppCodes.save_continuation):
-                compiled = self.enum_to_byte(OppCodes.save_continuation) 
-                len_so_far = len(output)
-                l = lines_that_need_label.get(operand)
-                if(l):
-                    l.append(len_so_far)
-                else:
-                    lines_that_need_label[operand] = [len_so_far,]
-                # Add zeroed data, that will be replaced with the actuall value later
-                compiled += self.uid_to_4_bytes(0)
-                output.append(compiled)
-            elif(opp_code == OppCodes.if_false_branch):
-                compiled = self.enum_to_byte(OppCodes.if_false_branch) 
-                len_so_far = len(output) 
-                l = lines_that_need_label.get(operand)
-                if(l):
-                    l.append(len_so_far)
-                else:
-                    lines_that_need_label[operand] = [len_so_far,]
-                # Add zeroed data, that will be replaced with the actuall value later
-                compiled += self.uid_to_4_bytes(0)
-                output.append(compiled)
-            elif(opp_code == OppCodes.if_true_branch):
-                compiled = self.enum_to_byte(OppCodes.if_true_branch) 
-                len_so_far = len(output) 
-                l = lines_that_need_label.get(operand)
-                if(l):
-                    l.append(len_so_far)
-                else:
-                    lines_that_need_label[operand] = [len_so_far,]
-                # Add zeroed data, that will be replaced with the actuall value later
-                compiled += self.uid_to_4_bytes(0)
-                output.append(compiled)
-            elif(opp_code == OppCodes.branch):
-                compiled = self.enum_to_byte(OppCodes.branch) 
-                len_so_far = len(output) 
-                l = lines_that_need_label.get(operand)
-                if(l):
-                    l.append(len_so_far)
-                else:
-                    lines_that_need_label[operand] = [len_so_far,]
-                # Add zeroed data, that will be replaced with the actuall value later
-                compiled += self.uid_to_4_bytes(0)
-                output.append(compiled)
-            elif(opp_code == OppCodes.push):
-                output.append(self.enum_to_byte(OppCodes.push))
-            elif(opp_code == OppCodes.make_closure):
-                len_so_far = len(output)
-                l = lines_that_need_lambda.get(operand)
-                if(l):
-                    raise AssemblerError("make_closure uid not unique")
-                else:
-                    lines_that_need_lambda[operand] = len_so_far
-                # Add zeroed 4 bytes that will be replaced later
-                output.append(self.enum_to_byte(OppCodes.make_closure) + self.uid_to_4_bytes(0))
-            elif(opp_code == OppCodes.set):
-                output.append(self.enum_to_byte(OppCodes.set) + self.string_to_byes(operand))
-            elif(opp_code == OppCodes.define):
-                output.append(self.enum_to_byte(OppCodes.define) + self.string_to_byes(operand))
-            elif(opp_code == OppCodes.ext):
-                output.append(self.enum_to_byte(OppCodes.ext))
-            elif(opp_code == OppCodes.label):
-                # Technically we have no need to add a null op, but do it to make it easier to debug
-                output.append(self.enum_to_byte(OppCodes.label))
-                len_so_far = len(output) 
-                if(label_locations.get(operand)):
-                    raise AssemblerError(str(operand) + " already in label_locations")
-                label_locations[operand] = len_so_far
-            elif(opp_code == OppCodes.proc_end):
-                output.append(self.enum_to_byte(OppCodes.proc_end))
-            elif(opp_code == OppCodes.data_start):
-                raise AssemblerError("Should not have a data_start in the body")
-            elif(opp_code == OppCodes.data_end):
-                raise AssemblerError("Should not have a data_end in the body")
-            else:
-                raise AssemblerError(str(type(instruction)) + " is not one of the enums in OppCodes")
-        return (output, lines_that_need_label, label_locations, lines_that_need_lambda)
+        # The lines whose addresses are filled in later. labels is {label_uid: [line_that_needs_this_label,]},
+        # label_locations is {label_uid: label_line}, lambdas is {lambda_uid: line_that_needs_the_ip_of_this_lambda}
+        # calls is {lambda_uid: [line_that_calls_this_lambda,]} and profile is [(kind, line, id),] of the profile points
+        fixups = {"labels": {}, "label_locations": {}, "lambdas": {}, "calls": {}, "profile": []}
+        encoders = self.encoders
+        for (opp_code, operand) in instruction_body:
+            encoder = encoders.get(opp_code)
+            if(encoder == None):
+                raise AssemblerError(str(opp_code) + " is not one of the enums in OppCodes")
+            line = encoder(self, opp_code, operand, len(output), fixups)
+            if(line != None):
+                output.append(line)
+        return (output, fixups["labels"], fixups["label_locations"], fixups["lambdas"], fixups["calls"], fixups["profile"])
     
     
     def debug_output(self):
@@ -200,51 +359,83 @@ class Assembler():
             output += "------------\n"
         return output
     
+    def line_addresses(self, assembled_body, offset):
+        # The address of every line in the body, plus the address right after the body
+        addresses = [offset]
+        for line in assembled_body:
+            addresses.append(addresses[-1] + len(line))
+        return addresses
+
     def sub_in_labels(self, assembled_body, label_replacement, label_location, offset):
+        addresses = self.line_addresses(assembled_body, offset)
         for label_uid in label_location:
             label_line = label_location[label_uid]
-            ip = offset + (self.no_of_bytes_in_a_body(assembled_body[:label_line]))
+            ip = addresses[label_line]
             lines_to_replace = label_replacement[label_uid]
             for line in lines_to_replace:
                 assembled_body[line][1:5] = self.uid_to_4_bytes(ip)
 
-    def assemble(self):
-        bodies = []
-        # {procedure_uid: index_in_body}
+    def assemble_bodies(self, bodies, offset):
+        """Assemble instruction bodies that are placed one after another in the output
+
+        Args:
+            bodies (List): List of tuples (procedure_uid, instructions), procedure_uid is None for the main body
+            offset (int): The address the first body will be placed at
+
+        Returns:
+            List: The assembled bodies, every body being a list of assembled instructions
+        """
+        assembled_bodies = []
+        # The address every assembled body starts at
+        body_addresses = []
+        bytes_so_far = offset
+        # {procedure_uid: index_in_assembled_bodies}
         index_of_procedure = {}
         # {procedure_uid: (body_index, line_index)}
         lines_that_need_procedure = {}
-        
-        assembled_consts = self.assemble_constants()
-        bodies.append(assembled_consts)
-        
-        (main_assembled, lines_in_main_that_need_label, label_locations, lines_in_main_that_need_lambda) = self.assemble_body(self.main)
-        bytes_so_far = self.no_of_bytes_in_list_body(bodies)
-        self.sub_in_labels(main_assembled, lines_in_main_that_need_label, label_locations, bytes_so_far)
-        for lambda_id in lines_in_main_that_need_lambda:
-            if(lines_that_need_procedure.get(lambda_id)):
-                raise AssemblerError("Trying to add an already existing uid to lines_that_need_procedure")
-            lines_that_need_procedure[lambda_id] = (len(bodies), lines_in_main_that_need_lambda[lambda_id])
-        bodies.append(main_assembled)
-        
-        for proc in self.procedures:
-            uid = proc[0]
-            proc_body = proc[1]
-            index_of_procedure[uid] = len(bodies)
-            (assembled_body, lines_that_need_label, label_locations, lines_that_need_lambda) = self.assemble_body(proc_body)
-            bytes_so_far = self.no_of_bytes_in_list_body(bodies)
+        # List of (procedure_uid, body_index, line_index) of the direct calls
+        lines_that_call_procedure = []
+
+        for (uid, body) in bodies:
+            if(uid != None):
+                index_of_procedure[uid] = len(assembled_bodies)
+            (assembled_body, lines_that_need_label, label_locations, lines_that_need_lambda, lines_that_call_lambda, profile_lines) = self.assemble_body(body)
             self.sub_in_labels(assembled_body, lines_that_need_label, label_locations, bytes_so_far)
+            if(len(profile_lines) != 0):
+                addresses = self.line_addresses(assembled_body, bytes_so_far)
+                self.profile_points += [(kind, addresses[line], point_id) for (kind, line, point_id) in profile_lines]
             for lambda_id in lines_that_need_lambda:
                 if(lines_that_need_procedure.get(lambda_id)):
                     raise AssemblerError("Trying to add an already existing uid to lines_that_need_procedure")
-                lines_that_need_procedure[lambda_id] = (len(bodies), lines_that_need_lambda[lambda_id])
-            bodies.append(assembled_body)
+                lines_that_need_procedure[lambda_id] = (len(assembled_bodies), lines_that_need_lambda[lambda_id])
+            for lambda_id in lines_that_call_lambda:
+                for line in lines_that_call_lambda[lambda_id]:
+                    lines_that_call_procedure.append((lambda_id, len(assembled_bodies), line))
+            assembled_bodies.append(assembled_body)
+            body_addresses.append(bytes_so_far)
+            bytes_so_far += self.no_of_bytes_in_a_body(assembled_body)
 
         for lambda_id in lines_that_need_procedure:
             (body_index, line_in_body) = lines_that_need_procedure[lambda_id]
             lambda_pos_in_bodies = index_of_procedure[lambda_id]
-            lambda_pos = self.no_of_bytes_in_list_body(bodies[:lambda_pos_in_bodies])
-            bodies[body_index][line_in_body][1:5] = self.uid_to_4_bytes(lambda_pos)
+            lambda_pos = body_addresses[lambda_pos_in_bodies]
+            assembled_bodies[body_index][line_in_body][1:5] = self.uid_to_4_bytes(lambda_pos)
+        for (lambda_id, body_index, line_in_body) in lines_that_call_procedure:
+            lambda_pos = body_addresses[index_of_procedure[lambda_id]]
+            assembled_bodies[body_index][line_in_body][5:9] = self.uid_to_4_bytes(lambda_pos)
+        return assembled_bodies
+
+    def assemble(self):
+        bodies = []
+        assembled_consts = self.assemble_constants()
+        bodies.append(assembled_consts)
+        bytes_so_far = self.no_of_bytes_in_list_body(bodies)
+        bodies += self.assemble_bodies([(None, self.main)] + self.procedures, bytes_so_far)
+        if(self.profile_table):
+            table_address = self.no_of_bytes_in_list_body(bodies)
+            # The address of the table is in the last line of the data section, before data_end
+            assembled_consts[-2][1:5] = self.uid_to_4_bytes(table_address)
+            bodies.append([self.assemble_profile_table()])
 
         self.assembled = bodies
         final_and = bytearray()
@@ -252,3 +443,76 @@ class Assembler():
             for line in body:
                 final_and += line
         return final_and
+
+
+class StreamingAssembler(Assembler):
+
+    def __init__(self, out_file, strip_labels=False, profile_table=False):
+        """Assembles the program one top level expression at a time and writes it to out_file as it goes.
+
+        The output starts with a data_offset header that points to the data section, which is written at the very end
+        of the file once all the constants are known. Until then the assembled constants are kept in a temporary file.
+
+        Args:
+            out_file (file): Binary file to write the assembled code to
+            strip_labels (bool, optional): Do not write out the label instructions. Defaults to False.
+            profile_table (bool, optional): Write out the profile table, it goes right before the data section. Defaults to False.
+        """
+        super().__init__([], [], [], strip_labels, profile_table=profile_table)
+        self.out_file = out_file
+        self.constants_file = tempfile.TemporaryFile()
+        self.no_constants = 0
+        self.header_pos = out_file.tell()
+        out_file.write(self.enum_to_byte(OppCodes.data_offset) + self.uid_to_4_bytes(0))
+        self.position = self.header_pos + 5
+
+    def assemble_form(self, constants, main, procedures):
+        """Assemble the output of one top level expression and write it out
+
+        Args:
+            constants (List): The constants of the expression
+            main (List): The main instructions of the expression
+            procedures (List): The procedures of the expression
+        """
+        for const in constants:
+            self.check_constant_uid(const, self.no_constants)
+            self.constants_file.write(self.assemble_constant(const))
+            self.no_constants += 1
+
+        # The procedures are placed before the main instructions, with a branch to jump over them
+        offset = self.position
+        if(len(procedures) != 0):
+            offset += 5
+        assembled_bodies = self.assemble_bodies(procedures + [(None, main)], offset)
+        if(len(procedures) != 0):
+            main_pos = offset + self.no_of_bytes_in_list_body(assembled_bodies[:-1])
+            assembled_bodies.insert(0, [self.enum_to_byte(OppCodes.branch) + self.uid_to_4_bytes(main_pos)])
+
+        for body in assembled_bodies:
+            for line in body:
+                self.out_file.write(line)
+                self.position += len(line)
+
+    def finish(self, global_names):
+        """Write the data section at the end of the output and point the header to it
+
+        Args:
+            global_names (List<str>): The name of every global variable, in the order of their indices
+        """
+        if(self.profile_table):
+            table_pos = self.position
+            table = self.assemble_profile_table()
+            self.out_file.write(table)
+            self.position += len(table)
+        data_pos = self.position
+        self.out_file.write(self.enum_to_byte(OppCodes.data_start) + self.uid_to_4_bytes(self.no_constants))
+        self.constants_file.seek(0)
+        shutil.copyfileobj(self.constants_file, self.out_file)
+        self.constants_file.close()
+        self.out_file.write(self.assemble_global_names(global_names))
+        if(self.profile_table):
+            self.out_file.write(self.enum_to_byte(OppCodes.profile_table) + self.uid_to_4_bytes(table_pos))
+        self.out_file.write(self.enum_to_byte(OppCodes.data_end))
+        self.out_file.seek(self.header_pos + 1)
+        self.out_file.write(self.uid_to_4_bytes(data_pos))
+        self.out_file.seek(0, 2)
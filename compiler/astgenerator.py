@@ -1,4 +1,5 @@
 from expressions import *
+from lexer import *
 
 
 class SynError(Exception):
@@ -11,17 +12,38 @@ class SynError(Exception):
 
 class ASTGenerator:
 
+    # The procedures that process (nested) expressions are generators that yield the calls they want to make,
+    # they are run by run_iteratively so that deeply nested code does not hit the recursion limit
 
-    def __init__(self, code):
+    def __init__(self, code, source=None, offset=0):
         """ASTGenerator constructor
 
         Args:
             code (str): The scheme code
+            source (file, optional): File object to lazily read the scheme code from instead of code. Defaults to None.
+            offset (int, optional): The index of the code in the whole file, when it is only a part of it. Defaults to 0.
         """
         self.code = code
-        self.code_len = len(code)
-        self.current = 0
-        self.tokens = []
+        self.source = source
+        self.offset = offset
+        self.lexer = None
+        # The token that will be consumed next, and the iterator producing the ones after it
+        self.current = None
+        self.tokens = iter(())
+        # Every identifier and symbol with the same name shares one string
+        self.names = {}
+
+
+    def intern_name(self, name):
+        """Get the shared copy of an identifier or symbol name
+
+        Args:
+            name (str): The name as read from the code
+
+        Returns:
+            str: The first string seen with this value
+        """
+        return self.names.setdefault(name, name)
 
 
     def report(self, loc, msg):
@@ -31,650 +53,506 @@ class ASTGenerator:
             loc (int): The location of the error
             msg (str): String to print to the user
         """
-        start = loc
-
-        # Find the 'line' the loc belongs to
-        while(start > 0 and self.code[start] != '\n'):
-            start -= 1
-        if(self.code[start] == "\n"):
-            start += 1
-        end = loc
-        while(end < self.code_len and self.code[end] != '\n'):
-            end += 1
-
-        # Print the line of code where error occurs and add a helpful guide to pin point the loc
-        string = self.code[start:end]
-        print(string)
-        for i in range(loc - start):
-            print("_", end = "")
-        print("/")
+        # Only the part of the code the lexer is holding on to is available when reading from a source
+        code = self.code
+        offset = self.offset
+        if(self.lexer != None):
+            code = self.lexer.code
+            offset = self.lexer.offset
+        code_len = len(code)
+
+        if(offset <= loc and loc - offset < code_len):
+            start = loc - offset
+            # Find the 'line' the loc belongs to
+            while(start > 0 and code[start] != '\n'):
+                start -= 1
+            if(code[start] == "\n"):
+                start += 1
+            end = loc - offset
+            while(end < code_len and code[end] != '\n'):
+                end += 1
+
+            # Print the line of code where error occurs and add a helpful guide to pin point the loc
+            string = code[start:end]
+            print(string)
+            for i in range(loc - offset - start):
+                print("_", end = "")
+            print("/")
         a =  SynError("Error at character " + str(loc) + ": " + msg)
         print(a)
         exit(1)
 
 
     def __str__(self):
-        return self.code
-    
-
-    def consume_number_from(self, start, until=None):
-        """Consume a scheme number
+        return self.code if self.source == None else str(self.source)
 
-        Args:
-            start (int): The index where the number begins
-            until (int, optional): Defaults to None.
 
-        Returns:
-            int: The number converted into a float
-        """
-        start_backup = start
-        eof = self.code_len if until == None else until
-        # Consume until whitespace or eof
-        while((not start >= eof) and (not self.code[start].isspace())):
-            start += 1
-        float_str = self.code[start_backup:start] 
-        try:
-            float(float_str)
-            return start
-        except:
-            self.report(start_backup, repr(float_str) + " is not a number")
-    
-
-    def consume_string_from(self, start, until=None):
-        """Consume a scheme string
+    def is_special_form(self, str):
+        """Is scheme special form
 
         Args:
-            start (int): The index of the first single quote
-            until (int, optional): Defaults to None.
+            str (str): The word to check
 
         Returns:
-            int: The index after the string ends
+            boolean: True if str is a special form
         """
-        eof = self.code_len if until == None else until
-        start += 1
-        while(True):
-            if(start >= eof):
-                self.report(start, "missing quotes for a string")
-            if(self.code[start] == '"'):
-                return start + 1
-            else:
-                start += 1
-    
-
-    def consume_boolean_from(self, start, until=None):
-        """Consume a scheme boolean
+        return str in ["quote", "lambda", "if", "and", "or", "let", "set!", "begin", "define", "cond", "do"]
 
-        Args:
-            start (int): The location of #
-            until (int, optional): Defaults to None.
 
-        Returns:
-            int: The index after the boolean ends
-        """
-        eof = self.code_len if until == None else until
-        start += 1
-        if(start >= eof):
-            self.report(start, "invalid boolean")
-        if(not (self.code[start] == "f" or self.code[start] == "t")):
-            self.report(start, "boolean can either be #t or #f")
-        return start + 1
-    
-
-    def consume_word_from(self, start, until=None):
-        """Consume an english word, reports an error when the word contains parenthesis
+    def is_built_in_func(self, str):
+        """Is scheme built in function
 
         Args:
-            start (int): The index where the word begins
-            until (int, optional): Defaults to None.
+            str (str): The word to check
 
         Returns:
-            int: The index after the word ends
+            boolean: True if str is a built in function that should not be re-named
         """
-        eof = self.code_len if until == None else until
-        while(True):
-            if(start >= eof):
-                return start
-            if(self.code[start] == '(' or self.code[start] == ')'):
-                self.report(start, "Unpected " + self.code[start])
-            if(not self.code[start].isspace()):
-                start += 1
-            else:
-                return start
-
+        return str in ["cons", "car", "cdr", "list", "string?", "pair?", "symbol?", "integer?", "eq?", "equal?", "eqv?"]
 
-    def consume_word_from_without_error(self, start, until=None):
-        """Consume an english word, DOES NOT report an error when the word contains parenthesis
 
-        Args:
-            start (int): The index where the word begins
-            until (int, optional): Defaults to None.
+    def peek_token(self):
+        """Look at the current token without consuming it
 
         Returns:
-            int: The index after the word ends
+            Token: The current token, None if all the tokens have been consumed
         """
-        eof = self.code_len if until == None else until
-        while(True):
-            if(start >= eof):
-                return start
-            if(not self.code[start].isspace()):
-                start += 1
-            else:
-                return start
+        return self.current
 
 
-    def consume_var_from(self, start, until=None):
-        """Consume a scheme variable
-
-        Args:
-            start (int): The index where the variable begins
-            until (int, optional): Defaults to None.
+    def next_token(self):
+        """Consume the current token
 
         Returns:
-            int: The index after the variable ends
+            Token: The consumed token, None if all the tokens have been consumed
         """
-        eof = self.code_len if until == None else until
-        if(start >= eof):
-            return start
-        if(not self.code[start].isalpha()):
-            self.report(start, "Variable does not start with an alphabet")
-        while(True):
-            if(start >= eof):
-                return start
-            if(not self.code[start].isspace()):
-                start += 1
-            else:
-                return start
+        token = self.current
+        if(token != None):
+            self.current = next(self.tokens, None)
+        return token
 
 
-    def consume_parenthesis_from(self, start, until=None):
-        """Consume a scheme parenthesis
+    def at_closing_bracket(self, opening):
+        """Check if the current token closes a parenthesis, reports an error when we run out of tokens
 
         Args:
-            start (int): The index where '(' is present
-            until (int, optional): Defaults to None.
+            opening (Token): The '(' token that is waiting to be closed
 
         Returns:
-            int: The index after the matching ')'
+            boolean: True if the current token is a ')'
         """
-        start_backup = start
-        eof = self.code_len if until == None else until
-        left_brackets_no = 1
-        start += 1
-        while(True):
-            if(start >= eof):
-                self.report(start_backup, "Missing closing bracket")
-            elif(self.code[start] == '('):
-                left_brackets_no += 1
-            elif(self.code[start] == ')'):
-                if(left_brackets_no == 1):
-                    start += 1
-                    return start
-                else:
-                    left_brackets_no -= 1
-            start += 1
-    
+        token = self.peek_token()
+        if(token == None):
+            self.report(opening.start, "Missing closing bracket")
+        return token.type == TokenTypes.right_paren
 
-    def is_special_form(self, str):
-        """Is scheme special form
-
-        Args:
-            str (str): The word to check
-
-        Returns:
-            boolean: True if str is a special form
-        """
-        return str in ["quote", "lambda", "if", "and", "or", "let", "set!", "begin", "define", "cond"]
 
-
-    def is_built_in_func(self, str):
-        """Is scheme built in function
+    def consume_and_process_expressions(self, opening):
+        """Consume and process scheme expressions until the ')' matching opening, the ')' is consumed as well
 
         Args:
-            str (str): The word to check
-
-        Returns:
-            boolean: True if str is a built in function that should not be re-named
-        """
-        return str in ["cons", "car", "cdr", "list", "string?", "pair?", "symbol?", "integer?", "eq?", "equal?", "eqv?"]
-
-
-    def consume_and_process_expressions(self, start, end):
-        """Consume and process multiple scheme expressions
-
-        Args:
-            start (int): The index to start at
-            end (int): The index to end at
+            opening (Token): The '(' token of the enclosing form
 
         Returns:
             List: List of scheme expressions
         """
-        # consume multiple expression from start till the end, and return the list
         expressions = []
-        (expression_start, expression_end) = self.consume_expression(start, end)
-        while(expression_end != None):
-            expression = self.process_expression(expression_start, expression_end)
-            expressions.append(expression)
-            start = expression_end
-            (expression_start, expression_end) = self.consume_expression(start, end)
+        while(not self.at_closing_bracket(opening)):
+            expressions.append((yield self.process_expression()))
+        self.next_token()
         return expressions
 
 
-    def dispach_lambda(self, start, end):
+    def dispach_lambda(self, opening, keyword):
         """Generate a SLambda object
 
         Args:
-            start (int): The start of the special form body
-            end (int): The end of the special form body, this is the index of the special form's ')'
+            opening (Token): The '(' of the special form
+            keyword (Token): The special form keyword
 
         Returns:
             SLambda: The processed SLambda object
         """
-        (variables_start, variables_end) = self.consume_expression(start, end)
-        if(variables_end == None):
-            self.report(start, "no bound variable list in lambda function")
+        if(self.at_closing_bracket(opening)):
+            self.report(keyword.end, "no bound variable list in lambda function")
 
         # This is to make sure we have parenthesis around the variable bound list
-        if(not ((self.code[variables_start] == '(') and (self.code[variables_end-1] == ')'))):
-            raise self.report(variables_start, "bound variable list not in proper format. Make sure the variables are enclosed in parenthesis")
+        variables_start = self.next_token()
+        if(variables_start.type != TokenTypes.left_paren):
+            self.report(variables_start.start, "bound variable list not in proper format. Make sure the variables are enclosed in parenthesis")
 
         # Make sure every expression in the variable bound list is a variable
-        variable_list = self.consume_and_process_expressions(variables_start + 1, variables_end - 1)
+        variable_list = yield self.consume_and_process_expressions(variables_start)
         for var in variable_list:
             if(not isinstance(var, SVariable)):
-                self.report(variables_start, "not all members of bound variable list are variables")
-        
-        body = self.consume_and_process_expressions(variables_end, end)
+                self.report(variables_start.start, "not all members of bound variable list are variables")
+
+        body = yield self.consume_and_process_expressions(opening)
         if(len(body) == 0):
-            self.report(variables_end, "no body in lambda expression")
-        return SLambda(variable_list, body)
+            self.report(variables_start.start, "no body in lambda expression")
+        return SLambda(variable_list, body, opening.start)
 
 
-    def dispach_if(self, start, end):
+    def dispach_if(self, opening, keyword):
         """Generate a SIf object
 
         Args:
-            start (int): The start of the special form body
-            end (int): The end of the special form body, this is the index of the special form's ')'
+            opening (Token): The '(' of the special form
+            keyword (Token): The special form keyword
 
         Returns:
             SIf: The processed SIF object
         """
-        (test_start, test_end) = self.consume_expression(start, end)
-        if(test_end == None):
-            self.report(start, "no test inside if")
-        test = self.process_expression(test_start, test_end)
+        if(self.at_closing_bracket(opening)):
+            self.report(keyword.end, "no test inside if")
+        test = yield self.process_expression()
 
-        (consequent_start, consequent_end) = self.consume_expression(test_end, end)
-        if(consequent_end == None):
-            self.report(start, "no consequent inside if")
-        consequent = self.process_expression(consequent_start, consequent_end)
+        if(self.at_closing_bracket(opening)):
+            self.report(keyword.end, "no consequent inside if")
+        consequent = yield self.process_expression()
 
-        (alternative_start, alternative_end) = self.consume_expression(consequent_end, end)
-        if(alternative_end == None):
-            self.report(start, "no alternative inside if")
-        alternative = self.process_expression(alternative_start, alternative_end)
+        if(self.at_closing_bracket(opening)):
+            self.report(keyword.end, "no alternative inside if")
+        alternative = yield self.process_expression()
 
-        # Try consuming one more expression to see if the IF statement has more than 3 expressions in it
-        nxt, nxt_end = self.consume_expression(alternative_end, end)
-        if(nxt_end != None):
-            self.report(alternative_end, "if contains more expressions than the required number (3)")
-        return SIf(test, consequent, alternative) 
+        # Make sure the IF statement does not have more than 3 expressions in it
+        if(not self.at_closing_bracket(opening)):
+            self.report(self.peek_token().start, "if contains more expressions than the required number (3)")
+        self.next_token()
+        return SIf(test, consequent, alternative, opening.start)
 
 
-    def dispach_cond(self, start, end):
+    def dispach_cond(self, opening, keyword):
         """Generate a scheme cond by repurposing SIf
 
         Args:
-            start (int): The start of the special form body
-            end (int): The end of the special form body, this is the index of the special form's ')'
+            opening (Token): The '(' of the special form
+            keyword (Token): The special form keyword
 
         Returns:
             SIf: The processed cond as an SIf
         """
-        test_action_pairs = self.consume_and_process_expressions(start, end)
+        test_action_pairs = yield self.consume_and_process_expressions(opening)
 
         if(len(test_action_pairs) == 0):
-            self.report(start, "cond should contain atleast one test action pair")
+            self.report(keyword.end, "cond should contain atleast one test action pair")
 
         # Every pair should be a SProcApplication, with the test being the operator and the actions being the operands
         for pair in test_action_pairs:
             if(not isinstance(pair, SProcApplication)):
-                self.report(start, "improper let")
+                self.report(keyword.end, "improper let")
 
         # Making sure that else branch is always the last one
         for i in range(len(test_action_pairs) - 1):
             if(isinstance(test_action_pairs[i].operator, SVariable)):
                 if(test_action_pairs[i].operator.value == "else"):
-                    self.report(start, "else should be the last branch in a cond")
-                    
+                    self.report(keyword.end, "else should be the last branch in a cond")
+
         # Check if the last branch is else, initialize cur appropriately
         cur = SBool("#f")
         else_present = False
         if(isinstance(test_action_pairs[-1].operator, SVariable)):
             if(test_action_pairs[-1].operator.value == "else"):
                 else_present = True
-                cur = SIf(SBool("#t"), SBegin(test_action_pairs[-1].operands), cur)
-        
+                cur = SIf(SBool("#t"), SBegin(test_action_pairs[-1].operands), cur, test_action_pairs[-1].loc)
+
         # As we have already set up the value of cur, ignore the last branch if its an else
         pairs = test_action_pairs[:-1] if else_present else test_action_pairs
         reversed_pairs = pairs[::-1]
         # Built up the If using the reversed list
         for pair in reversed_pairs:
-            cur = SIf(pair.operator, SBegin(pair.operands), cur)
+            cur = SIf(pair.operator, SBegin(pair.operands), cur, pair.loc)
         return cur
-        
 
-    # start is the special form end
-    def dispach_let(self, start, end):
-        """Generate a SLet
+
+    def named_let(self, name, var_bindings, body, loc):
+        """Generate a named let. When the body only calls the name in tail position it is a loop, otherwise the
+        name is bound to a lambda the body can call in any way, like ((let ((name #f)) (set! name (lambda ...)) name) inits...)
 
         Args:
-            start (int): The start of the special form body
-            end (int): The end of the special form body, this is the index of the special form's ')'
+            name (SVariable): The name of the named let
+            var_bindings (List): List of (variable, expression) of the loop variables
+            body (List<SExpression>): The body
+            loc (int): The index of the ( of the named let in the file
 
         Returns:
-            SLet: The processed SLet
+            SExpression: A SNamedLet if it is a loop, the procedure application otherwise
         """
-        var_bindings_start, var_bindings_end = self.consume_expression(start, end)
-        if(var_bindings_end == None):
-            self.report(start, "empty let")
+        if(loop_calls(name.value, len(var_bindings), body) != None):
+            return SNamedLet(name, var_bindings, body)
+        procedure = SLambda([binding[0] for binding in var_bindings], body, loc)
+        procedure = SLet([(name, SBool("#f"))], [SSet(SVariable(name.value), procedure), SVariable(name.value)])
+        return SProcApplication(procedure, [binding[1] for binding in var_bindings], loc)
+
+
+    def dispach_let(self, opening, keyword):
+        """Generate a SLet, or a named let if a name comes before the variable bindings
+
+        Args:
+            opening (Token): The '(' of the special form
+            keyword (Token): The special form keyword
+
+        Returns:
+            SLet: The processed SLet, see named_let for the named ones
+        """
+        if(self.at_closing_bracket(opening)):
+            self.report(keyword.end, "empty let")
+        name = None
+        if(self.peek_token().type == TokenTypes.word):
+            name = yield self.process_expression()
+            if(self.is_built_in_func(name.value)):
+                self.report(keyword.end, "improper let, cannot redefine built in functions")
+            if(self.at_closing_bracket(opening)):
+                self.report(keyword.end, "improper named let, no variable bindings")
+        var_bindings_start = self.next_token()
+        if(var_bindings_start.type != TokenTypes.left_paren):
+            self.report(var_bindings_start.start, "improper let, the let variable bindings should of of form ((<variable> <expression)...)")
 
         # The call below will return SProcedureApplications, re-purpose them for the let variable bindings
-        bindings = self.consume_and_process_expressions(var_bindings_start + 1, var_bindings_end - 1)
-        if(len(bindings) < 1):
-            self.report(var_bindings_start, "improper let, should have atleast one variable binding")
+        bindings = yield self.consume_and_process_expressions(var_bindings_start)
+        # A loop can go without variables
+        if(len(bindings) < 1 and name == None):
+            self.report(var_bindings_start.start, "improper let, should have atleast one variable binding")
         var_bindings = []
 
         # Go through each binding, and generate a tuple of (variable, expression)
         for binding in bindings:
             if(not isinstance(binding, SProcApplication)):
-                self.report(var_bindings_start, "improper let, the let variable bindings should of of form ((<variable> <expression)...)")
+                self.report(var_bindings_start.start, "improper let, the let variable bindings should of of form ((<variable> <expression)...)")
             var = binding.operator
             if(self.is_built_in_func(var)):
-                self.report(var_bindings_start, "improper let, cannot redefine built in functions")
+                self.report(var_bindings_start.start, "improper let, cannot redefine built in functions")
             if(not isinstance(var, SVariable)):
-                self.report(var_bindings_start, "improper let, can only bind expressions to variables")
+                self.report(var_bindings_start.start, "improper let, can only bind expressions to variables")
             exp = binding.operands
             if(len(exp) != 1):
-                self.report(var_bindings_start, "improper let, every variable binding should have one expression")
+                self.report(var_bindings_start.start, "improper let, every variable binding should have one expression")
             exp = exp[0]
             var_bindings.append((var, exp))
 
         # Process the body of the let
-        expressions = self.consume_and_process_expressions(var_bindings_end, end)
+        expressions = yield self.consume_and_process_expressions(opening)
         if(len(expressions) == 0):
-            self.report(var_bindings_end, "improper let, the body should contain atleast one expression")
+            self.report(var_bindings_start.start, "improper let, the body should contain atleast one expression")
+        if(name != None):
+            return self.named_let(name, var_bindings, expressions, opening.start)
         return SLet(var_bindings, expressions)
 
 
-    def process_quote(self, start, end, process_list=False):
-        """Process a scheme quote.
+    def dispach_do(self, opening, keyword):
+        """Generate a do loop by repurposing SNamedLet, (do ((var init step)...) (test result...) body...) is the
+        named let (let #do ((var init)...) (if test (begin result...) (begin body... (#do step...)))). The name
+        can not be written in scheme code, so the body never refers to it
 
         Args:
-            start (int): The start of the special form body
-            end (int): The end of the special form body, this is the index of the special form's ')'
-            process_list (boolean): True if we are inside a quoted list and need to consume multiple quotes. Defaults to False
+            opening (Token): The '(' of the special form
+            keyword (Token): The special form keyword
+
+        Returns:
+            SNamedLet: The processed do loop
+        """
+        if(self.at_closing_bracket(opening)):
+            self.report(keyword.end, "empty do")
+        specs_start = self.next_token()
+        if(specs_start.type != TokenTypes.left_paren):
+            self.report(specs_start.start, "improper do, the variables should be of form ((<variable> <init> <step>)...)")
+        # Like the let variable bindings, every variable comes back as a SProcApplication
+        specs = yield self.consume_and_process_expressions(specs_start)
+        var_bindings = []
+        steps = []
+        for spec in specs:
+            if(not isinstance(spec, SProcApplication) or not isinstance(spec.operator, SVariable)):
+                self.report(specs_start.start, "improper do, the variables should be of form ((<variable> <init> <step>)...)")
+            if(self.is_built_in_func(spec.operator.value)):
+                self.report(specs_start.start, "improper do, cannot redefine built in functions")
+            if(len(spec.operands) not in [1, 2]):
+                self.report(specs_start.start, "improper do, every variable should have an init and an optional step")
+            var_bindings.append((spec.operator, spec.operands[0]))
+            # A variable without a step keeps its value
+            steps.append(spec.operands[1] if len(spec.operands) == 2 else SVariable(spec.operator.value))
+
+        if(self.at_closing_bracket(opening)):
+            self.report(keyword.end, "improper do, no test clause")
+        test_start = self.peek_token()
+        if(test_start.type != TokenTypes.left_paren):
+            self.report(test_start.start, "improper do, the test clause should be of form (<test> <expression>...)")
+        # The test clause comes back as a SProcApplication as well, like the pairs of a cond
+        clause = yield self.process_expression()
+        if(not isinstance(clause, SProcApplication)):
+            self.report(test_start.start, "improper do, the test clause should be of form (<test> <expression>...)")
+        body = yield self.consume_and_process_expressions(opening)
+
+        name = SVariable("#do")
+        result = SBegin(clause.operands) if len(clause.operands) != 0 else SBool("#f")
+        step = SProcApplication(SVariable(name.value), steps)
+        return SNamedLet(name, var_bindings, [SIf(clause.operator, result, SBegin(body + [step]), clause.loc)])
+
+
+    def process_quote(self):
+        """Process a quoted scheme datum starting at the current token.
+
         Returns:
             SExpression: Could be a const list, or a symbol or any other scheme constant
         """
-        if(process_list):
-            exp_start, exp_end = self.consume_expression(start, end)
-            # If no expression found, then the list we are processing is an empty list
-            if(exp_end == None):
-                return None
+        token = self.next_token()
+        if(token.type == TokenTypes.left_paren):
             list_objs = []
-            while(True):
-                if(exp_start == None):
-                    return SConstList(list_objs)
-                if(self.code[exp_start] == '('):
-                    # we need to process a list
-                    list_obj = self.process_quote(exp_start+1, exp_end-1, process_list=True)
-                    if(list_obj == None):
-                        list_objs.append(SEmptyList())
-                    else:
-                        list_objs.append(list_obj)
-                else:
-                    # Repurpose the SVariable to be a SSymbol
-                    exp = self.process_expression(exp_start, exp_end)
-                    if(isinstance(exp, SVariable)):
-                        exp = SSymbol(exp.value)
-                    list_objs.append(exp)
-                exp_start, exp_end = self.consume_expression(exp_end, end)
-        else:
-            # At this point we don't know if it's a list or not
-            exp_start, exp_end = self.consume_expression(start, end)
-            if(exp_end == None):
-                self.report(start, "improper quote, quote needs atleast one argument")
-            second_exp_start, second_exp_end = self.consume_expression(exp_end, end)
-            if(second_exp_end != None):
-                self.report(second_exp_start, "improper quote, quote only takes one argument")
-            if(self.code[exp_start] == '('):
-                ans = self.process_quote(exp_start+1, exp_end-1, process_list=True)
-                if(ans == None):
-                    return SEmptyList()
-                return ans
-            else:
-                exp = self.process_expression(exp_start, exp_end)
-                # Repurpose this single SVariable as SSymbol
-                if(isinstance(exp, SVariable)):
-                    exp = SSymbol(exp.value)
-                return exp
-
-
-    def dispach_special_form(self, start, end):
+            while(not self.at_closing_bracket(token)):
+                list_objs.append((yield self.process_quote()))
+            self.next_token()
+            # If no datum was found, then the list we are processing is an empty list
+            if(len(list_objs) == 0):
+                return SEmptyList()
+            return SConstList(list_objs)
+        if(token.type == TokenTypes.quote):
+            if(self.peek_token() == None):
+                self.report(token.start, "improper quote, quote needs atleast one argument")
+            return SConstList([SSymbol("quote"), (yield self.process_quote())])
+        if(token.type == TokenTypes.right_paren):
+            self.report(token.start, "Unexpected )")
+        # Repurpose the SVariable to be a SSymbol
+        exp = yield self.process_token(token)
+        if(isinstance(exp, SVariable)):
+            exp = SSymbol(exp.value)
+        return exp
+
+
+    def dispach_special_form(self, opening, keyword):
         """Dispach on special form
 
         Args:
-            start (int): The index AFTER special form's '('
-            end (int): The index OF the special form's ')'
+            opening (Token): The '(' of the special form
+            keyword (Token): The special form keyword, the current token is the one right after it
 
         Returns:
             SExpression: The dispached and processed special form
         """
-        special_form_end = self.consume_word_from(start, end)
-        special_form = self.code[start:special_form_end]
+        special_form = keyword.value
         if(special_form == "quote"):
+            if(self.at_closing_bracket(opening)):
+                self.report(keyword.end, "improper quote, quote needs atleast one argument")
             # Take in a list of variables, which might contain list in itself
-            objs = self.process_quote(special_form_end, end)
+            objs = yield self.process_quote()
+            if(not self.at_closing_bracket(opening)):
+                self.report(self.peek_token().start, "improper quote, quote only takes one argument")
+            self.next_token()
             return objs
         if(special_form == "lambda"):
-            return self.dispach_lambda(special_form_end, end)
+            return (yield self.dispach_lambda(opening, keyword))
         if(special_form == "if"):
-            return self.dispach_if(special_form_end, end)
+            return (yield self.dispach_if(opening, keyword))
         if(special_form == "and"):
             # take in a a number of scheme expressions
-            and_expressions = self.consume_and_process_expressions(special_form_end, end)
+            and_expressions = yield self.consume_and_process_expressions(opening)
             return SAnd(and_expressions)
         if(special_form == "or"):
             # take in a a number of scheme expressions
-            or_expressions = self.consume_and_process_expressions(special_form_end, end)
+            or_expressions = yield self.consume_and_process_expressions(opening)
             return SOr(or_expressions)
         if(special_form == "let"):
             # take in a list of variable bindings and then a list of scheme expressions
-            return self.dispach_let(special_form_end, end)
+            return (yield self.dispach_let(opening, keyword))
         if(special_form == "set!"):
             # take in a variable and an expression
-            set_expressions = self.consume_and_process_expressions(special_form_end, end)
+            set_expressions = yield self.consume_and_process_expressions(opening)
             if(len(set_expressions) != 2):
-                self.report(special_form_end, "improper set, set should contain a variable and an single expression")
+                self.report(keyword.end, "improper set, set should contain a variable and an single expression")
             if(not isinstance(set_expressions[0], SVariable)):
-                self.report(special_form_end, "improper set, the first argument has to be a variable")
+                self.report(keyword.end, "improper set, the first argument has to be a variable")
             if(not isinstance(set_expressions[1], Expression)):
-                self.report(special_form_end, "improper set, the second argument has to be a variable")
+                self.report(keyword.end, "improper set, the second argument has to be a variable")
             if(self.is_built_in_func(set_expressions[0].value)):
-                self.report(special_form_end, "cannot set the value of a built in function")
+                self.report(keyword.end, "cannot set the value of a built in function")
             return SSet(set_expressions[0], set_expressions[1])
         # begin is not a special form
         if(special_form == "begin"):
-            set_expressions = self.consume_and_process_expressions(special_form_end, end)
+            set_expressions = yield self.consume_and_process_expressions(opening)
             return SBegin(set_expressions)
             # take in a number of scheme expressions
         if(special_form == "define"):
-            define_expressions = self.consume_and_process_expressions(special_form_end, end)
+            define_expressions = yield self.consume_and_process_expressions(opening)
             if(len(define_expressions) != 2):
-                self.report(special_form_end, "define should only have 2 arguments")
+                self.report(keyword.end, "define should only have 2 arguments")
             var = define_expressions[0]
             if(self.is_built_in_func(str(var))):
-                self.report(special_form_end, "cannot set the value of a built in function")
+                self.report(keyword.end, "cannot set the value of a built in function")
             if(not isinstance(var, SVariable)):
-                self.report(special_form_end, "first argument to define should be a variable")
+                self.report(keyword.end, "first argument to define should be a variable")
             exp = define_expressions[1]
             if(not isinstance(exp, Expression)):
-                self.report(special_form_end, "second arguemnt to define should be a scheme expression")
+                self.report(keyword.end, "second arguemnt to define should be a scheme expression")
             return SDefine(var, exp)
         if(special_form == "cond"):
-            return self.dispach_cond(special_form_end, end)
-        self.report(start, "not a special form. Compiler design error")
+            return (yield self.dispach_cond(opening, keyword))
+        if(special_form == "do"):
+            return (yield self.dispach_do(opening, keyword))
+        self.report(keyword.start, "not a special form. Compiler design error")
 
-        """Process and generate SExpression
 
-        Args:
-            start (int): The index where the expression starts. The index where '(' is present if the expression is procedure application / special form
-            end (int): The index where the expression ends. This is one AFTER the index where ')' is present if the expression is procedure application / special form
+    def process_expression(self):
+        """Process and generate the SExpression starting at the current token, all of its tokens are consumed
 
         Returns:
             SExpression: Returns the processed expression
         """
-
-    # start is the ( and end is the character after )
-    # When string sliced, this procedure can see the string it is trying to process
-
-    def process_expression(self, start, end):
-        c = self.code[start]
-        if(self.is_numeric(start, end)):
-            return SNumber(float(self.code[start:end]))
-        # String
-        elif(c == '"'):
-            return SString(self.code[start+1:end-1])
-        # Boolean
-        elif(c == "#"):
-            return SBool(self.code[start:end])
-        # Special form or a procedure application
-        elif(c == "("):
-
-            first_word_start = self.ignore_whitespace(start+1)
-            if(first_word_start == end):
-                self.report(start, "empty parenthesis")
-
-            first_word_end = self.consume_word_from_without_error(first_word_start, end - 1)
-            is_special_form = self.is_special_form(self.code[first_word_start: first_word_end])
-            if(is_special_form):
-                return self.dispach_special_form(first_word_start, end - 1)
-            else:
-                # This expression is a procedure application of the form (<operator> <operands>*)
-                
-                # Extract the operator
-                operator_start = first_word_start
-                (x, operator_end) = self.consume_expression(operator_start, end - 1)
-                if(operator_end == None):
-                    self.report(start, "improper procedure application")
-                operator = self.process_expression(operator_start, operator_end)
-                
-                operands = []
-                previous_operand_end = operator_end
-                # Process the operands
-                while(True):
-                    next_operand_start = self.ignore_whitespace(previous_operand_end, end - 1)
-                    if(next_operand_start == None):
-                        break
-                    (x, next_operand_end) = self.consume_expression(next_operand_start, end - 1)
-                    if(next_operand_end == None):
-                        break
-                    operand = self.process_expression(next_operand_start, next_operand_end)
-                    operands.append(operand)
-                    previous_operand_end = next_operand_end
-                
-                return SProcApplication(operator, operands)
-        # Variable
-        else:
-            return SVariable(self.code[start:end])
+        return (yield self.process_token(self.next_token()))
 
 
-    def ignore_whitespace(self, start, until=None):
-        """Ignore whitespace
+    def process_token(self, token):
+        """Process and generate the SExpression that begins with token, which has already been consumed
 
         Args:
-            start (int): The index to start at
-            until (int, optional): Defaults to None.
+            token (Token): The first token of the expression
 
         Returns:
-            int: The index that is a non white space character
+            SExpression: Returns the processed expression
         """
-        eof = self.code_len if until == None else until
-        while(True):
-            if(start >= eof):
-                return None
-            if(self.code[start].isspace()):
-                start += 1
-            else:
-                return start
-
+        typ = token.type
+        if(typ == TokenTypes.number):
+            return SNumber(float(token.value))
+        # String
+        elif(typ == TokenTypes.string):
+            return SString(token.value)
+        # Boolean
+        elif(typ == TokenTypes.boolean):
+            return SBool(token.value)
+        # Variable
+        elif(typ == TokenTypes.word):
+            return SVariable(self.intern_name(token.value))
+        # 'datum is the same as (quote datum)
+        elif(typ == TokenTypes.quote):
+            if(self.peek_token() == None):
+                self.report(token.start, "improper quote, quote needs atleast one argument")
+            return (yield self.process_quote())
+        elif(typ == TokenTypes.right_paren):
+            self.report(token.start, "Unpected )")
+        # Special form or a procedure application
+        if(self.at_closing_bracket(token)):
+            self.report(token.start, "empty parenthesis")
 
-    def is_numeric(self, start, until=None):
-        """Check if start points to the start of a scheme number
+        first = self.peek_token()
+        if(first.type == TokenTypes.word and self.is_special_form(first.value)):
+            self.next_token()
+            return (yield self.dispach_special_form(token, first))
 
-        Args:
-            start (int): The index where we suspect the number begins
-            until (int, optional): Defaults to None.
+        # This expression is a procedure application of the form (<operator> <operands>*)
+        operator = yield self.process_expression()
+        operands = yield self.consume_and_process_expressions(token)
+        return SProcApplication(operator, operands, token.start)
 
-        Returns:
-            boolean: True if it's a potential start to a scheme number
-        """
-        eof = self.code_len if until == None else until
-        c = self.code[start]
-        if(c.isnumeric()):
-            return True
-        elif(c == "-"):
-            if(start+1 >= eof):
-                return False
-            elif(self.code[start+1].isnumeric()):
-                return True
-            else:
-                return False
-
-        
-
-    def consume_expression(self, start, until=None):
-        """Consume expression, this function tells us how to read an expression as a string
 
-        Args:
-            start (int): The start of the expression
-            until (int, optional): Defaults to None.
+    def ast_stream(self):
+        """Lazily generate the AST for the input, one top level expression at a time
 
-        Returns:
-            (start, next_start): The tuple where start is the start of the expression and next_start is the index where the next expression could potentially start
+        Yields:
+            SExpression: The next top level expression
         """
+        self.lexer = Lexer(self.code, self.report, self.source, offset=self.offset)
+        self.tokens = self.lexer.tokens()
+        self.current = next(self.tokens, None)
+        while(self.peek_token() != None):
+            yield run_iteratively(self.process_expression())
 
-        start = self.ignore_whitespace(start, until)
-        if(start == None):
-            return (None, None)
-        c = self.code[start]
-
-        # Number
-        if(self.is_numeric(start, until)):
-            next_start = self.consume_number_from(start, until)
-            return (start, next_start)
-        # String
-        elif(c == '"'):
-            next_start = self.consume_string_from(start, until)
-            return (start, next_start)
-        # Quotes
-        elif(c == "'"):
-            next_start = self.consume_parenthesis_from(start + 1, until)
-            return (start, next_start)
-        # Boolean
-        elif(c == "#"):
-            next_start = self.consume_boolean_from(start, until)
-            return (start, next_start)
-        # Expression
-        elif(c == "("):
-            next_start = self.consume_parenthesis_from(start, until)
-            return (start, next_start)
-        # Variable (Either user defined or built in)
-        else:
-            next_start = self.consume_word_from(start, until)
-            return (start, next_start)
-    
 
     def generate_ast(self):
         """Generate AST for the input code
@@ -682,4 +560,4 @@ class ASTGenerator:
         Returns:
             List: List of SExpression
         """
-        return self.consume_and_process_expressions(0, self.code_len)
+        return list(self.ast_stream())
@@ -2,19 +2,84 @@ from expressions import *
 from compilerenums import *
 from astgenerator import *
 from assembler import *
+from constantfolder import *
+from peepholeoptimizer import *
+from instructionfuser import *
+from controlflowoptimizer import *
+from passmanager import *
+from inliner import *
+from subexpressioneliminator import *
+from deadcodeeliminator import *
+from compilerprofile import *
 import sys
 import getopt
 
 
 class Compiler():
 
-    def __init__(self, ast):
+    # The procedures that compile (nested) expressions are generators that yield the calls they want to make,
+    # they are run by run_iteratively so that deeply nested code does not hit the recursion limit
+
+    # The built ins that calls are compiled inline for, with the primitive operation and the number of
+    # arguments it accepts
+    primitive_operations = {
+        "+": (OppCodes.prim_add, range(256)),
+        "-": (OppCodes.prim_sub, range(1, 256)),
+        "*": (OppCodes.prim_mul, range(256)),
+        "/": (OppCodes.prim_div, range(1, 256)),
+        "%": (OppCodes.prim_mod, [2]),
+        "=": (OppCodes.prim_num_eq, [2]),
+        "<": (OppCodes.prim_lt, [2]),
+        ">": (OppCodes.prim_gt, [2]),
+        "<=": (OppCodes.prim_le, [2]),
+        ">=": (OppCodes.prim_ge, [2]),
+        "car": (OppCodes.prim_car, [1]),
+        "cdr": (OppCodes.prim_cdr, [1]),
+        "cons": (OppCodes.prim_cons, [2]),
+        "eq?": (OppCodes.prim_eq, [2]),
+        "number?": (OppCodes.prim_is_number, [1]),
+        "string?": (OppCodes.prim_is_string, [1]),
+        "pair?": (OppCodes.prim_is_pair, [1]),
+        "symbol?": (OppCodes.prim_is_symbol, [1]),
+    }
+    # The primitive operations whose input is the number of arguments
+    variadic_operations = [OppCodes.prim_add, OppCodes.prim_sub, OppCodes.prim_mul, OppCodes.prim_div]
+    # The primitive operations on numbers, and the version of each that skips the type checks of the arguments.
+    # It is used when all the arguments are known to be numbers
+    unchecked_operations = {
+        OppCodes.prim_add: OppCodes.unchecked_add,
+        OppCodes.prim_sub: OppCodes.unchecked_sub,
+        OppCodes.prim_mul: OppCodes.unchecked_mul,
+        OppCodes.prim_div: OppCodes.unchecked_div,
+        OppCodes.prim_mod: OppCodes.unchecked_mod,
+        OppCodes.prim_num_eq: OppCodes.unchecked_num_eq,
+        OppCodes.prim_lt: OppCodes.unchecked_lt,
+        OppCodes.prim_gt: OppCodes.unchecked_gt,
+        OppCodes.prim_le: OppCodes.unchecked_le,
+        OppCodes.prim_ge: OppCodes.unchecked_ge,
+    }
+    # The primitive operations whose result is a number
+    number_operations = [OppCodes.prim_add, OppCodes.prim_sub, OppCodes.prim_mul, OppCodes.prim_div, OppCodes.prim_mod]
+
+    def __init__(self, ast, shadowed=None, profile=None, profile_points=False):
         """Comiler constructor
 
         Args:
             ast (List<SExpression>): Abstract Syntax Tree to be compiled
+            shadowed (Iterable, optional): The variables whose value can change, the built ins that are defined and the variables that are set! anywhere in the program. Calls to them are not compiled inline or as loops. When None it is not known, and no call is. Defaults to None.
+            profile (Profile, optional): The profile of an earlier run, used to lay out the procedures and the ifs. Defaults to None.
+            profile_points (bool, optional): Mark the procedures, ifs and calls for the VM to profile, see ProfileKinds. Defaults to False.
         """
         self.ast = ast
+        self.shadowed = None if shadowed == None else set(shadowed)
+        self.profile = profile
+        self.profile_points = profile_points
+        # {procedure_id: loc} of the lambdas the procedures were compiled from, and the number of ifs whose
+        # alternative was placed first because the profile says it is the common path
+        self.procedure_locs = {}
+        self.swapped = 0
+        # The variables that were assumed not to be in shadowed, the output is only valid if they are not
+        self.assumed = set()
 
         # A list of tuples (uid, (Type, [vals,]))
         self.constants = []
@@ -22,18 +87,74 @@ class Compiler():
         self.instructions = []
         # A list of tuple of (procedure_id, instructions)
         self.procedures = []
-        # Reserve some uid's for the scheme defaults
+        # Constants, labels and procedures are numbered densely from zero in their own id spaces, the
+        # first constant uids are the scheme defaults
         self.cur_uid = len(Defaults)
+        self.cur_label = 0
+        self.cur_procedure = 0
+        # The uid of every constant compiled so far, by constant_key
+        self.constant_uids = {}
+        # The frames of the lambdas and lets enclosing the expression being compiled, innermost last. Each
+        # one is a dict {variable_name: (slot, boxed)}. The outermost frame of a lambda holds the variables it
+        # captured when its closure was made
+        self.scopes = []
+        # For every scope in scopes, the variables that are known to hold a number at the instruction being
+        # compiled. Constants and the results of arithmetic are numbers, and since a checked operation on numbers
+        # stops the program when an argument is not one, so are the variables passed to one once it ran. Boxed
+        # variables are never known, a closure can set them
+        self.numbers = []
+        # Every global variable, including the built ins, gets a dense index in the order it is first seen.
+        # The names are written out with the constants so that the VM can report them
+        self.global_names = []
+        self.global_indices = {}
+        # The lambdas enclosing the expression being compiled, innermost last. A lambda that is the value of a
+        # define is a dict describing how calls to itself in tail position loop, None for the other ones
+        self.procedure_stack = []
+        # {id(call): loop} of the calls to the named lets being compiled, loop is a dict like the ones in
+        # procedure_stack
+        self.loop_calls = {}
+        # Closures copy the variables they capture, so no lambda or let frame can outlive its bind and all of them
+        # are kept on the frame stack of the VM. What escapes are the captured variables, the boxed ones are
+        # the only ones that need a heap allocation. Reported in the debug listing
+        self.escapes = {"stack_frames": 0, "captured": 0, "boxed": 0}
+        # {global_index: procedure_id} of the lambdas defined at the top level that are never set!, calls to
+        # them jump straight to the procedure. None if the global is defined more than once
+        self.known_procedures = {}
+        # {id(node): (free, assigned, captured)} of the lambdas and lets, see scope_variables
+        self.variables = {}
 
 
     def generate_uid(self):
-        """Generate UID
+        """Generate the UID of a new constant
 
         Returns:
-            int: The next UID
+            int: The next constant UID
         """
+        uid = self.cur_uid
         self.cur_uid += 1
-        return self.cur_uid
+        return uid
+
+
+    def generate_label(self):
+        """Generate a new label
+
+        Returns:
+            int: The next label
+        """
+        label = self.cur_label
+        self.cur_label += 1
+        return label
+
+
+    def generate_procedure_id(self):
+        """Generate the id of a new procedure
+
+        Returns:
+            int: The next procedure id
+        """
+        procedure_id = self.cur_procedure
+        self.cur_procedure += 1
+        return procedure_id
 
 
     def is_type_default(self, exp):
@@ -48,8 +169,274 @@ class Compiler():
         return isinstance(exp, Defaults)
     
 
+    def constant_key(self, data):
+        """The key a constant is interned by, constants with the same key share a uid
+
+        Args:
+            data ((Type, [vals,])): The data of the constant
+
+        Returns:
+            tuple: The key of the constant
+        """
+        (typ, vals) = data
+        # 0.0 and -0.0 compare equal, but are different constants
+        if(typ == Types.number):
+            return (typ, vals[0].hex())
+        return (typ,) + tuple(vals)
+
+
+    def intern_constant(self, data):
+        """Get the uid of a constant, a new uid is generated and the constant is appended to self.constants
+        only the first time the value is seen
+
+        Args:
+            data ((Type, [vals,])): The data of the constant
+
+        Returns:
+            int: The uid of the constant
+        """
+        key = self.constant_key(data)
+        uid = self.constant_uids.get(key)
+        if(uid == None):
+            uid = self.generate_uid()
+            self.constant_uids[key] = uid
+            self.constants.append((uid, data))
+        return uid
+
+
+    def resolve_variable(self, name):
+        """Find the frame and slot of a local variable
+
+        Args:
+            name (str): The name of the variable
+
+        Returns:
+            (depth, index, boxed): The number of frames to go up, the slot in that frame and if the slot holds a box, None if the variable is global
+        """
+        for depth in range(len(self.scopes)):
+            slot = self.scopes[-1 - depth].get(name)
+            if(slot != None):
+                return (depth,) + slot
+        return None
+
+
+    def known_number(self, expression):
+        """Check if an expression that was just compiled is known to evaluate to a number
+
+        Args:
+            expression (SExpression): The expression
+
+        Returns:
+            boolean: True if the value of the expression is a number
+        """
+        if(isinstance(expression, SNumber)):
+            return True
+        if(isinstance(expression, SVariable)):
+            address = self.resolve_variable(expression.value)
+            return address != None and expression.value in self.numbers[-1 - address[0]]
+        if(isinstance(expression, SProcApplication)):
+            primitive = self.primitive_operation(expression)
+            return primitive != None and primitive[0] in self.number_operations
+        # The value of a begin is the one of its last expression, like the ones the common subexpression
+        # eliminator makes to store a value in a temporary
+        if(isinstance(expression, SBegin) and len(expression.expressions) != 0):
+            return self.known_number(expression.expressions[-1])
+        return False
+
+
+    def set_known_number(self, name, known):
+        """Record if a local variable holds a number from now on, nothing is recorded for global and boxed variables
+
+        Args:
+            name (str): The name of the variable
+            known (boolean): True if it is known to hold a number
+        """
+        address = self.resolve_variable(name)
+        if(address == None or address[2]):
+            return
+        numbers = self.numbers[-1 - address[0]]
+        if(known):
+            numbers.add(name)
+        else:
+            numbers.discard(name)
+
+
+    def save_numbers(self):
+        """Copy what is known about the variables, for the branches of a conditional
+
+        Returns:
+            List<set>: A copy of numbers
+        """
+        return [set(numbers) for numbers in self.numbers]
+
+
+    def merge_numbers(self, branches):
+        """Keep what is known about the variables at the end of every branch of a conditional. The current
+        state of numbers is the end of the last branch
+
+        Args:
+            branches (List): The numbers at the end of the other branches, see save_numbers
+        """
+        for branch in branches:
+            self.numbers = [numbers & other for (numbers, other) in zip(self.numbers, branch)]
+
+
+    def global_index(self, name):
+        """Get the index of a global variable, a new index is generated the first time the name is seen
+
+        Args:
+            name (str): The name of the variable
+
+        Returns:
+            int: The index of the global variable
+        """
+        index = self.global_indices.get(name)
+        if(index == None):
+            index = len(self.global_names)
+            self.global_indices[name] = index
+            self.global_names.append(name)
+        return index
+
+
+    def make_scope(self, variables, boxed=()):
+        """Make the frame of a lambda or let
+
+        Args:
+            variables (List<SVariable>): The variables it binds, in the order they are bound
+            boxed (Iterable, optional): The names of the variables that are kept in a box. Defaults to ().
+
+        Returns:
+            dict: {variable_name: (slot, boxed)}, if a name is repeated the first slot is used
+        """
+        scope = {}
+        for (index, var) in enumerate(variables):
+            scope.setdefault(var.value, (index, var.value in boxed))
+        return scope
+
+
+    def analyze_variables(self, expression):
+        """Find the variables of an expression in one walk from the leaves up, the ones of every lambda and let
+        in it are recorded in self.variables on the way
+
+        Args:
+            expression (SExpression): The expression
+
+        Returns:
+            (dict, set, set): The variables the expression refers to without binding them, as the keys of a dict
+            in the order free_variables finds them, the ones it set!s and the ones free in a lambda in it
+        """
+        if(isinstance(expression, SVariable)):
+            return ({expression.value: None}, set(), set())
+        if(isinstance(expression, SLambda)):
+            (free, assigned, captured) = yield self.analyze_sequence(expression.body)
+            bound = {var.value for var in expression.bound_var_list}
+            free = {name: None for name in free if name not in bound}
+            self.variables[id(expression)] = (list(free), assigned, captured)
+            return (free, assigned, captured | free.keys())
+        if(isinstance(expression, SLet)):
+            (free, assigned, captured) = yield self.analyze_sequence([binding[1] for binding in expression.var_bindings])
+            (body_free, body_assigned, body_captured) = yield self.analyze_sequence(expression.body)
+            bound = {binding[0].value for binding in expression.var_bindings}
+            if(isinstance(expression, SNamedLet)):
+                bound.add(expression.name.value)
+            for name in body_free:
+                if(name not in bound):
+                    free[name] = None
+            self.variables[id(expression)] = (list(free), body_assigned, body_captured)
+            return (free, assigned | body_assigned, captured | body_captured)
+        if(isinstance(expression, (SDefine, SSet))):
+            name = (expression.var if isinstance(expression, SDefine) else expression.variable).value
+            (free, assigned, captured) = yield self.analyze_sequence([expression.expression])
+            free = {name: None, **free}
+            if(isinstance(expression, SSet)):
+                assigned = assigned | {name}
+            return (free, assigned, captured)
+        if(isinstance(expression, SIf)):
+            return (yield self.analyze_sequence([expression.test, expression.consequent, expression.alternative]))
+        if(isinstance(expression, SProcApplication)):
+            return (yield self.analyze_sequence([expression.operator] + expression.operands))
+        if(isinstance(expression, (SAnd, SOr, SBegin))):
+            return (yield self.analyze_sequence(expression.expressions))
+        return ({}, set(), set())
+
+
+    def analyze_sequence(self, sequence):
+        """Find the variables of a list of expressions, see analyze_variables
+
+        Args:
+            sequence (List<SExpression>): The expressions
+
+        Returns:
+            (dict, set, set): The variables of all the expressions
+        """
+        free = {}
+        assigned = set()
+        captured = set()
+        for exp in sequence:
+            (exp_free, exp_assigned, exp_captured) = yield self.analyze_variables(exp)
+            free.update(exp_free)
+            assigned |= exp_assigned
+            captured |= exp_captured
+        return (free, assigned, captured)
+
+
+    def scope_variables(self, expression):
+        """Get the variables of a lambda or let. The whole expression is analyzed the first time, which also
+        records the lambdas and lets nested in it, so every node is only walked once
+
+        Args:
+            expression (SLambda or SLet): The lambda or let
+
+        Returns:
+            (List<str>, set, set): The free variables of the expression in the order free_variables finds them,
+            the variables set! in its body and the ones free in a lambda in its body
+        """
+        if(id(expression) not in self.variables):
+            run_iteratively(self.analyze_variables(expression))
+        return self.variables[id(expression)]
+
+
+    def boxed_variables(self, variables, expression):
+        """Find the variables of a lambda or let that have to be kept in a box. Closures copy the values of the
+        variables they capture, so a variable that is set! and captured by a lambda in the body is boxed for
+        the closure and the frame to share it
+
+        Args:
+            variables (List<SVariable>): The variables bound by the lambda or let
+            expression (SLambda or SLet): The lambda or let
+
+        Returns:
+            set: The names of the variables to box
+        """
+        (free, assigned, captured) = self.scope_variables(expression)
+        return {var.value for var in variables if var.value in assigned and var.value in captured}
+
+
+    def bind_scope(self, list_to_add_to, variables, expression):
+        """Bind the frame of a lambda or let and box the slots of the variables that need it
+
+        Args:
+            list_to_add_to (List): The list to add the instructions to
+            variables (List<SVariable>): The variables bound by the lambda or let
+            expression (SLambda or SLet): The lambda or let
+
+        Returns:
+            dict: The scope of the frame, see make_scope
+        """
+        boxed = self.boxed_variables(variables, expression)
+        scope = self.make_scope(variables, boxed)
+        self.escapes["stack_frames"] += 1
+        self.escapes["boxed"] += len(boxed)
+        list_to_add_to.append((OppCodes.bind, len(variables)))
+        for (slot, boxed) in scope.values():
+            if(boxed):
+                list_to_add_to.append((OppCodes.box_slot, slot))
+        return scope
+
+
     def compile_list_constant(self, expression):
-        """Compile SConstList, append the constants to self.constants and return the list of UIDs of the constants
+        """Compile SConstList into a chain of pair constants. Pairs are interned like every other constant,
+        so identical lists, sublists and tails share their uids
 
         Args:
             expression (SConstList): The SConstList to compile
@@ -58,67 +445,51 @@ class Compiler():
             SynError: raises error of expression is not of type SConstList
 
         Returns:
-            List: UIDs of the constants present in the list
+            int: The uid of the first pair of the list
         """
         if(not isinstance(expression, SConstList)):
             raise SynError(str(expression) + "is not a SConstList")
-        consts = expression.consts
         consts_uids = []
-        for exp in consts:
-                (exp_uid, exp_data, _) = self.generate_data_instruction_for_constant(exp)
-                consts_uids.append(exp_uid)
-                if(not self.is_type_default(exp_data[0])):
-                    self.constants.append((exp_uid, exp_data))
-                    
-        return consts_uids
+        for exp in expression.consts:
+            (exp_uid, _) = yield self.generate_data_instruction_for_constant(exp)
+            consts_uids.append(exp_uid)
+        uid = Defaults.empty_list.value
+        for exp_uid in consts_uids[::-1]:
+            uid = self.intern_constant((Types.pair, [exp_uid, uid]))
+        return uid
 
 
     def generate_data_instruction_for_constant(self, expression):
-        """Generate the uid, data to be written to the constants section and the instruction to load this constant
+        """Generate the uid of a constant and the instruction to load it. The data of the constant is added to
+        self.constants if it has not been seen before
 
         Args:
             expression (SConstant): The constant to generate the output for
 
         Returns:
-            (uid, data, instruction):
+            (uid, instruction):
         """
         if(not isinstance(expression, SConstant)):
             raise SynError(str(expression) + "is not a SConstant")
         uid = None
-        data = None
-        instruction = None
         if(isinstance(expression, SNumber)):
-            uid = self.generate_uid()
-            data = (Types.number, [expression.value,])
-            instruction = (OppCodes.load_const, uid)
+            uid = self.intern_constant((Types.number, [expression.value,]))
         elif(isinstance(expression, SString)):
-            uid = self.generate_uid()
-            data = (Types.string, [expression.value,])
-            instruction = (OppCodes.load_const, uid)
+            uid = self.intern_constant((Types.string, [expression.value,]))
         elif(isinstance(expression, SBool)):
             val = Defaults.boolean_true if expression.value else Defaults.boolean_false
             uid = val.value
-            data = (val, [uid,])
-            instruction = (OppCodes.load_const, uid)
         elif(isinstance(expression, SSymbol)):
-            uid = self.generate_uid()
-            data = (Types.symbol, [expression.value,])
-            instruction = (OppCodes.load_const, uid)
+            uid = self.intern_constant((Types.symbol, [expression.value,]))
         elif(isinstance(expression, SEmptyList)):
-            val = Defaults.empty_list
-            uid = val.value
-            data = (val, [uid,])
-            instruction = (OppCodes.load_const, uid)
+            uid = Defaults.empty_list.value
         elif(isinstance(expression, SConstList)):
-            uids = self.compile_list_constant(expression)
-            uid = self.generate_uid()
-            data = (Types.list, uids)
-            instruction = (OppCodes.load_const, uid)
+            uid = yield self.compile_list_constant(expression)
         else:
             raise SynError("Exhausted all possibilites of SConstant, instead is of type " + str(type(expression)))
 
-        if(uid and data and instruction):
-            return (uid, data, instruction)
+        if(uid != None):
+            return (uid, (OppCodes.load_const, uid))
         else:
             raise SynError("Logic error when compiling constant")
 
@@ -131,10 +502,8 @@ class Compiler():
             expression (SConstant): The expression to compile
             tail (boolean): Is expression in tail position
         """
-        (uid, data, instruction) = self.generate_data_instruction_for_constant(expression)
+        (_, instruction) = yield self.generate_data_instruction_for_constant(expression)
         list_to_add_to.append(instruction)
-        if(not self.is_type_default(data[0])):
-            self.constants.append((uid, data))
         if(tail):
             list_to_add_to.append((OppCodes.ret, None))
 
@@ -151,36 +520,98 @@ class Compiler():
             raise SynError("Not an SIf expression, instead of type: " + str(type(expression)))
 
         # Compile the test in non tail position
-        self.compile_expression(list_to_add_to, expression.test, False)
-        false_branch_uid = self.generate_uid()
-        if_end_branch_uid = self.generate_uid()
-        list_to_add_to.append((OppCodes.if_false_branch, false_branch_uid))
-        # Compile the consequent
-        self.compile_expression(list_to_add_to, expression.consequent, tail)
+        yield self.compile_expression(list_to_add_to, expression.test, False)
+        second_branch_uid = self.generate_label()
+        if_end_branch_uid = self.generate_label()
+        (first, second) = (expression.consequent, expression.alternative)
+        jump = OppCodes.if_false_branch
+        # The arm placed first is reached without a jump. In tail position it returns instead of jumping to the
+        # end, so when the profile says the test is mostly false the alternative goes first
+        if(tail and self.profile != None and self.profile.mostly_false(expression.loc)):
+            (first, second) = (second, first)
+            jump = OppCodes.if_true_branch
+            self.swapped += 1
+        list_to_add_to.append((jump, second_branch_uid))
+        self.add_profile_point(list_to_add_to, ProfileKinds.branch, expression.loc)
+        before_branches = self.save_numbers()
+        # Compile the arm that is reached without a jump
+        yield self.compile_expression(list_to_add_to, first, tail)
+        after_first = self.numbers
+        self.numbers = before_branches
         list_to_add_to.append((OppCodes.branch, if_end_branch_uid))
-        list_to_add_to.append((OppCodes.label, false_branch_uid))
-        # Compile the alternative
-        self.compile_expression(list_to_add_to, expression.alternative, tail)
+        list_to_add_to.append((OppCodes.label, second_branch_uid))
+        # Compile the other arm
+        yield self.compile_expression(list_to_add_to, second, tail)
+        self.merge_numbers([after_first])
         list_to_add_to.append((OppCodes.label, if_end_branch_uid))
 
 
-    def compile_lambda(self, list_to_add_to, expression, tail):
+    def add_profile_point(self, list_to_add_to, kind, loc):
+        """Mark the instruction that was just added for the VM to profile, when asked to
+
+        Args:
+            list_to_add_to (List): The list to add the instructions to
+            kind (ProfileKinds): What the instruction is
+            loc (int): The loc of the expression it was compiled from, None if it has none
+        """
+        if(self.profile_points and loc != None):
+            list_to_add_to.append((OppCodes.profile_point, (kind, loc)))
+
+
+    def layout_procedures(self):
+        """Order the procedures by the number of times the profile says they were called, so that the hot ones
+        sit together right after the main instructions. The ones that were called as often keep their order
+        """
+        calls = lambda procedure: self.profile.times_called(self.procedure_locs.get(procedure[0]))
+        self.procedures.sort(key=calls, reverse=True)
+
+
+    def compile_lambda(self, list_to_add_to, expression, tail, name=None):
         """Compile a lambda procedure
 
         Args:
             list_to_add_to (List): The list to add the instructions to
             expression (SIf): SLambda expression to compile
             tail (boolean): Is expression in tail position
+            name (str, optional): The global variable the lambda is defined as. Defaults to None.
         """
         ins = []
         if(not isinstance(expression, SLambda)):
             raise SynError("Not an SLambda expression, instead of type: " + str(type(expression)))
-        uid = self.generate_uid()
-        var_bound_list_str = list(map(str, expression.bound_var_list))
-        ins.append((OppCodes.bind, var_bound_list_str))
-        self.compile_sequence(ins, expression.body, True)
+        uid = self.generate_procedure_id()
+        top_level = len(self.scopes) == 0
+        # The closure is flat, it gets a copy of the local variables the lambda uses. Boxed variables are
+        # captured as the box itself
+        captured = [(var, self.resolve_variable(var)) for var in self.scope_variables(expression)[0]]
+        captured = [(var, address) for (var, address) in captured if address != None]
+        self.escapes["captured"] += len(captured)
+        for (var, (depth, index, boxed)) in reversed(captured):
+            list_to_add_to.append((OppCodes.lookup_local, (depth, index)))
+            list_to_add_to.append((OppCodes.push, None))
+        captured_scope = {var: (slot, address[2]) for (slot, (var, address)) in enumerate(captured)}
+        # The captured variables that are not boxed never change, so they are still numbers in the body
+        captured_numbers = {var for (var, address) in captured if var in self.numbers[-1 - address[0]]}
+        enclosing_scopes = self.scopes
+        enclosing_numbers = self.numbers
+        self.scopes = [captured_scope, self.bind_scope(ins, expression.bound_var_list, expression)]
+        self.numbers = [captured_numbers, set()]
+        loop = None
+        if(name != None and self.shadowed != None and name not in self.shadowed and top_level):
+            loop = {"name": name, "arity": len(expression.bound_var_list), "scope": len(self.scopes), "label": None}
+        self.procedure_stack.append(loop)
+        yield self.compile_sequence(ins, expression.body, True)
+        self.procedure_stack.pop()
+        self.scopes = enclosing_scopes
+        self.numbers = enclosing_numbers
+        if(loop != None and loop["label"] != None):
+            # The frame is reused on every iteration, the slots are boxed again after it is rebound
+            ins.insert(1, (OppCodes.label, loop["label"]))
+        if(expression.loc != None):
+            self.procedure_locs[uid] = expression.loc
+            if(self.profile_points):
+                ins.insert(0, (OppCodes.profile_point, (ProfileKinds.procedure, expression.loc)))
         ins.append((OppCodes.proc_end, None))
-        list_to_add_to.append((OppCodes.make_closure, uid))
+        list_to_add_to.append((OppCodes.make_closure, (uid, len(captured))))
         if(tail):
             list_to_add_to.append((OppCodes.ret, None))
         self.procedures.append((uid, ins))
@@ -198,13 +629,14 @@ class Compiler():
         # last one inherits the tail argument
         len_sequence = len(sequence)
         for i in range(len_sequence - 1):
-            self.compile_expression(list_to_add_to, sequence[i], False)
+            yield self.compile_expression(list_to_add_to, sequence[i], False)
         if(len_sequence != 0):
-            self.compile_expression(list_to_add_to, sequence[len_sequence - 1], tail)
+            yield self.compile_expression(list_to_add_to, sequence[len_sequence - 1], tail)
 
 
     def compile_variable(self, list_to_add_to, expression, tail):
-        """Compile a variable, insert a return statement if in tail position
+        """Compile a variable, local variables are looked up by their frame and slot and global variables by their
+        index. Insert a return statement if in tail position
 
         Args:
             list_to_add_to (List): The list to add the instructions to
@@ -213,7 +645,12 @@ class Compiler():
         """
         if(not isinstance(expression, SVariable)):
             raise SynError("Not an SVariable expression, instead of type: " + str(type(expression)))
-        list_to_add_to.append((OppCodes.lookup, expression.value))
+        address = self.resolve_variable(expression.value)
+        if(address != None):
+            (depth, index, boxed) = address
+            list_to_add_to.append((OppCodes.lookup_boxed if boxed else OppCodes.lookup_local, (depth, index)))
+        else:
+            list_to_add_to.append((OppCodes.global_get, self.global_index(expression.value)))
         if(tail):
             list_to_add_to.append((OppCodes.ret, None))
 
@@ -226,12 +663,80 @@ class Compiler():
             list_to_add_to (List): The list to add the instructions to
             arguments (List): The list of expressions to compile 
             tail (boolean): Can never be True, only present for consistency purposes
+
+        Returns:
+            List<boolean>: For every argument, if it is known to be a number
         """
         if(tail):
             raise SynError("Tail should always be false when compiling arguments")
+        known = []
         for arg in arguments[::-1]:
-            self.compile_expression(list_to_add_to, arg, False)
+            yield self.compile_expression(list_to_add_to, arg, False)
+            known.append(self.known_number(arg))
             list_to_add_to.append((OppCodes.push, None))
+        return known[::-1]
+
+
+    def primitive_operation(self, expression):
+        """Find the primitive operation a procedure application can be compiled to. That is the case when the
+        operator is a built in that is not redefined anywhere or bound by an enclosing lambda or let
+
+        Args:
+            expression (SProcApplication): The procedure application
+
+        Returns:
+            (Opp, Input): The primitive operation, None if it has to be compiled as a call
+        """
+        if(self.shadowed == None or not isinstance(expression.operator, SVariable)):
+            return None
+        name = expression.operator.value
+        if(name not in self.primitive_operations or name in self.shadowed or self.resolve_variable(name) != None):
+            return None
+        (opp, arg_counts) = self.primitive_operations[name]
+        if(len(expression.operands) not in arg_counts):
+            return None
+        self.assumed.add(name)
+        return (opp, len(expression.operands) if opp in self.variadic_operations else None)
+
+
+    def self_tail_call(self, expression, tail):
+        """Check if a procedure application is a call in tail position of the defined lambda it is in to itself
+
+        Args:
+            expression (SProcApplication): The procedure application
+            tail (boolean): Is expression in tail position
+
+        Returns:
+            dict: The entry of the lambda in procedure_stack, None if it is not a self tail call
+        """
+        if(not tail or len(self.procedure_stack) == 0 or self.procedure_stack[-1] == None):
+            return None
+        loop = self.procedure_stack[-1]
+        if(not isinstance(expression.operator, SVariable) or expression.operator.value != loop["name"]):
+            return None
+        if(len(expression.operands) != loop["arity"] or self.resolve_variable(loop["name"]) != None):
+            return None
+        self.assumed.add(loop["name"])
+        return loop
+
+
+    def compile_loop(self, list_to_add_to, expression, loop):
+        """Compile a self tail call as a jump back to the start of the procedure or named let. The arguments are
+        bound in its frame, closures only hold copies of its slots so it can be reused
+
+        Args:
+            list_to_add_to (List): The list to add the instructions to
+            expression (SProcApplication): The self tail call
+            loop (dict): The entry of the lambda in procedure_stack, or of the named let in loop_calls
+        """
+        if(loop["label"] == None):
+            loop["label"] = self.generate_label()
+        yield self.compile_arguments(list_to_add_to, expression.operands, False)
+        # Leave the frames of the lets the call is in
+        for i in range(len(self.scopes) - loop["scope"]):
+            list_to_add_to.append((OppCodes.unbind, None))
+        list_to_add_to.append((OppCodes.rebind, loop["arity"]))
+        list_to_add_to.append((OppCodes.branch, loop["label"]))
 
 
     def compile_proc_application(self, list_to_add_to, expression, tail):
@@ -244,17 +749,45 @@ class Compiler():
         """
         if(not isinstance(expression, SProcApplication)):
             raise SynError("Not an SProcApplication expression, instead of type: " + str(type(expression)))
+        loop = self.loop_calls.get(id(expression))
+        if(loop == None):
+            loop = self.self_tail_call(expression, tail)
+        if(loop != None):
+            yield self.compile_loop(list_to_add_to, expression, loop)
+            return
+        # Built ins work on the arguments on the stack directly, without a continuation
+        primitive = self.primitive_operation(expression)
+        if(primitive != None):
+            known = yield self.compile_arguments(list_to_add_to, expression.operands, False)
+            (opp, arg) = primitive
+            if(opp in self.unchecked_operations):
+                if(all(known)):
+                    opp = self.unchecked_operations[opp]
+                elif(len(assigned_variables(expression.operands)) == 0):
+                    # The variables still hold the values that were checked
+                    for operand in expression.operands:
+                        if(isinstance(operand, SVariable)):
+                            self.set_known_number(operand.value, True)
+            list_to_add_to.append((opp, arg))
+            if(tail):
+                list_to_add_to.append((OppCodes.ret, None))
+            return
         uid = None
         # If not in tail, then save a continuation before making the procedure call
         if(not tail):
-            uid = self.generate_uid()
+            uid = self.generate_label()
             list_to_add_to.append((OppCodes.save_continuation, uid))
             
         # Compile the arguments
-        self.compile_arguments(list_to_add_to, expression.operands, False)
-        # Compile the operator
-        self.compile_expression(list_to_add_to, expression.operator, False)
-        list_to_add_to.append((OppCodes.apply, None))
+        yield self.compile_arguments(list_to_add_to, expression.operands, False)
+        # Compile the operator, calls to global variables are linked once the whole program is compiled
+        operator = expression.operator
+        if(self.shadowed != None and isinstance(operator, SVariable) and self.resolve_variable(operator.value) == None):
+            list_to_add_to.append((OppCodes.call_global, self.global_index(operator.value)))
+        else:
+            yield self.compile_expression(list_to_add_to, operator, False)
+            list_to_add_to.append((OppCodes.apply, None))
+        self.add_profile_point(list_to_add_to, ProfileKinds.call, expression.loc)
 
         if(not tail):
             list_to_add_to.append((OppCodes.label, uid))
@@ -273,8 +806,19 @@ class Compiler():
             raise SynError("Define in tail posisiton, not allowed")
         if(not isinstance(expression, SDefine)):
             raise SynError("Expression is not of type SDefine, instead is of type " + str(type(expression)))
-        self.compile_expression(list_to_add_to, expression.expression, False)
-        list_to_add_to.append((OppCodes.define, str(expression.var)))
+        name = expression.var.value
+        if(len(self.scopes) == 0 and self.shadowed != None):
+            index = self.global_index(name)
+            if(isinstance(expression.expression, SLambda) and name not in self.shadowed and index not in self.known_procedures):
+                self.assumed.add(name)
+                self.known_procedures[index] = self.cur_procedure
+            else:
+                self.known_procedures[index] = None
+        if(isinstance(expression.expression, SLambda)):
+            yield self.compile_lambda(list_to_add_to, expression.expression, False, name)
+        else:
+            yield self.compile_expression(list_to_add_to, expression.expression, False)
+        list_to_add_to.append((OppCodes.global_define, self.global_index(name)))
 
 
     def compile_set(self, list_to_add_to, expression, tail):
@@ -288,8 +832,14 @@ class Compiler():
         if(not isinstance(expression, SSet)):
             raise SynError("Expression is not of type SSet, instead is of type " + str(type(expression)))
         # Compute the argument to set in non tail position
-        self.compile_expression(list_to_add_to, expression.expression, False)
-        list_to_add_to.append((OppCodes.set, expression.variable.value))
+        yield self.compile_expression(list_to_add_to, expression.expression, False)
+        self.set_known_number(expression.variable.value, self.known_number(expression.expression))
+        address = self.resolve_variable(expression.variable.value)
+        if(address != None):
+            (depth, index, boxed) = address
+            list_to_add_to.append((OppCodes.set_boxed if boxed else OppCodes.set_local, (depth, index)))
+        else:
+            list_to_add_to.append((OppCodes.global_set, self.global_index(expression.variable.value)))
         if(tail):
             list_to_add_to.append((OppCodes.ret, None))
 
@@ -304,12 +854,15 @@ class Compiler():
         """
         if(not isinstance(expression, SAnd)):
             raise SynError("Expression is not of type SAnd, instead is of type " + str(type(expression)))
-        and_false_uid = self.generate_uid()
-        and_end_uid = self.generate_uid()
+        and_false_uid = self.generate_label()
+        and_end_uid = self.generate_label()
+        exits = []
         for exp in expression.expressions:
-            self.compile_expression(list_to_add_to, exp, False)
+            yield self.compile_expression(list_to_add_to, exp, False)
             # Allow false short-circuiting
             list_to_add_to.append((OppCodes.if_false_branch, and_false_uid))
+            exits.append(self.save_numbers())
+        self.merge_numbers(exits)
         list_to_add_to.append((OppCodes.load_const, Defaults.boolean_true.value))
         if(tail):
             list_to_add_to.append((OppCodes.ret, None))
@@ -332,13 +885,16 @@ class Compiler():
         """
         if(not isinstance(expression, SOr)):
             raise SynError("Expression is not of type SOr, instead is of type " + str(type(expression)))
-        or_true_uid = self.generate_uid()
-        or_end_uid = self.generate_uid()
+        or_true_uid = self.generate_label()
+        or_end_uid = self.generate_label()
 
+        exits = []
         for exp in expression.expressions:
-            self.compile_expression(list_to_add_to, exp, False)
+            yield self.compile_expression(list_to_add_to, exp, False)
             # Allow true short-cirtuiting
             list_to_add_to.append((OppCodes.if_true_branch, or_true_uid))
+            exits.append(self.save_numbers())
+        self.merge_numbers(exits)
         list_to_add_to.append((OppCodes.load_const, Defaults.boolean_false.value))
         if(tail):
             list_to_add_to.append((OppCodes.ret, None))
@@ -362,13 +918,68 @@ class Compiler():
             raise SynError("Expression is not of type SLet, instead is of type " + str(type(expression)))
         bindings = [x[1] for x in expression.var_bindings]
         vars = [x[0] for x in expression.var_bindings]
-        vars = list(map(str, vars))
-        self.compile_arguments(list_to_add_to, bindings, False)
-        list_to_add_to.append((OppCodes.bind, vars))
-        self.compile_sequence(list_to_add_to, expression.body, tail)
+        # The bindings are computed outside of the let's frame
+        known = yield self.compile_arguments(list_to_add_to, bindings, False)
+        scope = self.bind_scope(list_to_add_to, vars, expression)
+        self.scopes.append(scope)
+        self.numbers.append({name for (name, (slot, boxed)) in scope.items() if known[slot] and not boxed})
+        yield self.compile_sequence(list_to_add_to, expression.body, tail)
+        self.scopes.pop()
+        self.numbers.pop()
+        list_to_add_to.append((OppCodes.unbind, None))
+
+
+    def compile_named_let(self, list_to_add_to, expression, tail):
+        """Compile a named let as a loop, no closure is made for it. The frame is bound once, the calls to the
+        name jump back to the start of the body after putting the arguments in its slots
+
+        Args:
+            list_to_add_to (List): The list to add the instructions to
+            expression (SNamedLet): The named let to compile
+            tail (boolean): Is expression in tail position
+        """
+        if(not isinstance(expression, SNamedLet)):
+            raise SynError("Expression is not of type SNamedLet, instead is of type " + str(type(expression)))
+        vars = [x[0] for x in expression.var_bindings]
+        calls = loop_calls(expression.name.value, len(vars), expression.body)
+        if(calls == None):
+            raise SynError("The named let " + expression.name.value + " is not a loop")
+        yield self.compile_arguments(list_to_add_to, [x[1] for x in expression.var_bindings], False)
+        ins = []
+        scope = self.bind_scope(ins, vars, expression)
+        # The slots are boxed again on every iteration, each one gets its own boxes like a call would
+        loop = {"name": expression.name.value, "arity": len(vars), "scope": len(self.scopes) + 1, "label": None}
+        if(len(calls) != 0):
+            loop["label"] = self.generate_label()
+            ins.insert(1, (OppCodes.label, loop["label"]))
+        list_to_add_to += ins
+        self.scopes.append(scope)
+        # The start of the body is also reached from the end of an iteration, where nothing is known about the
+        # loop variables and the variables the body sets
+        self.numbers.append(set())
+        for name in self.scope_variables(expression)[1]:
+            self.set_known_number(name, False)
+        for call in calls:
+            self.loop_calls[id(call)] = loop
+        yield self.compile_sequence(list_to_add_to, expression.body, tail)
+        for call in calls:
+            del self.loop_calls[id(call)]
+        self.scopes.pop()
+        self.numbers.pop()
         list_to_add_to.append((OppCodes.unbind, None))
 
 
+    def compile_begin(self, list_to_add_to, expression, tail):
+        """Compile SBegin special form
+
+        Args:
+            list_to_add_to (List): The list to add the instructions to
+            expression (SBegin): The begin special form to compile
+            tail (boolean): Is expression in tail position
+        """
+        yield self.compile_sequence(list_to_add_to, expression.expressions, tail)
+
+
     def compile_expression(self, list_to_add_to,  expression, tail):
         """Compile a scheme expression
 
@@ -377,58 +988,131 @@ class Compiler():
             expression (SExpression): Expression to compile
             tail (boolean): Is expression in tail position
         """
-        if(isinstance(expression, SConstant)):
-            self.compile_constant(list_to_add_to, expression, tail)
-        elif(isinstance(expression, SVariable)):
-            self.compile_variable(list_to_add_to, expression, tail)
-        elif(isinstance(expression, SIf)):
-            self.compile_if(list_to_add_to, expression, tail)
-        elif(isinstance(expression, SLambda)):
-            self.compile_lambda(list_to_add_to, expression, tail)
-        elif(isinstance(expression, SProcApplication)):
-            self.compile_proc_application(list_to_add_to, expression, tail)
-        elif(isinstance(expression, SDefine)):
-            self.compile_define(list_to_add_to, expression, tail)
-        elif(isinstance(expression, SSet)):
-            self.compile_set(list_to_add_to, expression, tail)
-        elif(isinstance(expression, SAnd)):
-            self.compile_and(list_to_add_to, expression, tail)
-        elif(isinstance(expression, SOr)):
-            self.compile_or(list_to_add_to, expression, tail)
-        elif(isinstance(expression, SBegin)):
-            self.compile_sequence(list_to_add_to, expression.expressions, tail)
-        elif(isinstance(expression, SLet)):
-            self.compile_let(list_to_add_to, expression, tail)
-        else:
-            raise SynError("Reached the end of expression case switch, unknown expression of type " + str(type(expression)))
+        handler = self.expression_handlers.get(type(expression))
+        if(handler == None):
+            raise SynError("No handler for expression of type " + str(type(expression)))
+        compiling = handler(self, list_to_add_to, expression, tail)
+        # compile_variable has no nested expressions to compile, it is not a generator
+        if(compiling != None):
+            yield compiling
+
+    # The procedure that compiles every type of expression, looked up by the exact type of the node instead of
+    # going through isinstance checks. The nodes of a type are all compiled the same way, SNamedLet has its own
+    # entry even though it is a SLet
+    expression_handlers = {
+        SNumber: compile_constant,
+        SString: compile_constant,
+        SSymbol: compile_constant,
+        SBool: compile_constant,
+        SEmptyList: compile_constant,
+        SConstList: compile_constant,
+        SVariable: compile_variable,
+        SIf: compile_if,
+        SLambda: compile_lambda,
+        SProcApplication: compile_proc_application,
+        SDefine: compile_define,
+        SSet: compile_set,
+        SAnd: compile_and,
+        SOr: compile_or,
+        SBegin: compile_begin,
+        SLet: compile_let,
+        SNamedLet: compile_named_let,
+    }
+
+
+    def link_calls(self, instructions):
+        """Turn the calls to global variables into direct calls to the known procedures, and into a lookup and
+        an apply for the other ones
+
+        Args:
+            instructions (List): List of (Opp, Input)
+
+        Returns:
+            List: The linked instructions
+        """
+        linked = []
+        for (opp, arg) in instructions:
+            if(opp != OppCodes.call_global):
+                linked.append((opp, arg))
+            elif(self.known_procedures.get(arg) != None):
+                linked.append((OppCodes.call_direct, (arg, self.known_procedures[arg])))
+            else:
+                linked += [(OppCodes.global_get, arg), (OppCodes.apply, None)]
+        return linked
+
+
+    def link(self):
+        """Link the calls to global variables in the whole program, once all the defines are known
+        """
+        self.instructions = self.link_calls(self.instructions)
+        self.procedures = [(uid, self.link_calls(ins)) for (uid, ins) in self.procedures]
 
 
-    def compile(self):
+    def compile(self, link=True):
         """Compile the input AST
+
+        Args:
+            link (bool, optional): Link the calls to global variables. Defaults to True.
         """
         for exp in self.ast:
             # All top level expressions are always in non tail position
-            self.compile_expression(self.instructions, exp, False)
+            run_iteratively(self.compile_expression(self.instructions, exp, False))
         self.instructions.append((OppCodes.ext, None))
+        if(link):
+            self.link()
+        if(self.profile != None):
+            self.layout_procedures()
         return(self.constants, self.instructions, self.procedures)
 
 
-    def debug_output(self):
+    def compile_incrementally(self):
+        """Compile the input AST one top level expression at a time, the AST can be a lazy iterator. Only the
+        output of the expression currently being compiled, and the constants it uses, are held on to
+
+        Yields:
+            (constants, main, procedures): The output of the next top level expression, the last one yielded only contains the ext instruction
+        """
+        for exp in self.ast:
+            # The constants are only shared within a form and the procedures are never laid out, the tables would
+            # otherwise grow with the whole program. The variables are recorded by the ids of the nodes of the form
+            self.constant_uids = {}
+            self.procedure_locs = {}
+            self.variables = {}
+            self.constants = []
+            self.instructions = []
+            self.procedures = []
+            run_iteratively(self.compile_expression(self.instructions, exp, False))
+            yield (self.constants, self.instructions, self.procedures)
+        self.constants = []
+        self.instructions = [(OppCodes.ext, None)]
+        self.procedures = []
+        yield (self.constants, self.instructions, self.procedures)
+
+
+    def debug_output(self, program=None):
         """Produce human readable compiled version
+
+        Args:
+            program (IRProgram, optional): The IR the optimization passes left, see PassManager. Defaults to None, for the IR of the compiled instructions.
+
         Returns:
             string: The human readable compiled version
         """
-        def print_ins(instructions):
-            output = ""
-            for ins in instructions:
-                output += (ins[0]).name + " " + (str(ins[1]) if ins[1] != None else "") + "\n"
-            return output
-            
+        if(program == None):
+            program = IRProgram(self.instructions, self.procedures)
+        (main, procedures) = program.program()
+
         output = ""
         output += ".defaults_start\n"
         for default in Defaults:
             output += "uid: " + str(default.value) + " name: " + default.name + "\n"
         output+=  ".defaults_end\n\n"
+
+        output += ".escapes_start\n"
+        output += "frames on the stack: " + str(self.escapes["stack_frames"]) + "\n"
+        output += "variables captured by closures: " + str(self.escapes["captured"]) + "\n"
+        output += "variables boxed: " + str(self.escapes["boxed"]) + "\n"
+        output += ".escapes_end\n\n"
         
         output += ".data_start\n"
         for dat in self.constants:
@@ -437,12 +1121,12 @@ class Compiler():
             output += "\n"
         output += ".data_end\n\n"
 
-        output += print_ins(self.instructions)
+        output += instruction_listing(main)
         
         output += "\n"
-        for proc in self.procedures:
+        for proc in procedures:
             output += "lambda " + str(proc[0]) + "\n"
-            output += print_ins(proc[1])
+            output += instruction_listing(proc[1])
             output += "\n"
 
         return output
@@ -455,6 +1139,39 @@ if __name__ == "__main__":
         print("Optional arguments:")
         print("\t1) To generate compiled code in human readable form: -c <file_name>")
         print("\t2) To generate assembled code in human readable form: -a <file_name>")
+        print("\t3) To compile and write out one top level expression at a time, for very large inputs: -s")
+        print("\t4) To parse and compile the top level expressions using several processes: -j <jobs>")
+        print("\t5) To report what the optimizations did: -v")
+        print("\t6) To optimize at level 0 to 2, -O1 runs the peephole optimizer and leaves the labels out of the output, -O2 also threads jumps and removes unreachable blocks. -O is -O1: -O<level>")
+        print("\t7) To inline procedures with up to <size> nodes in their body, 0 to only inline lambdas applied right away: -n <size>")
+        print("\t8) To mark the procedures, ifs and calls for the VM to profile, run the VM with -p to write the profile: -P")
+        print("\t9) To use a profile written by the VM to inline the hot calls and lay out the procedures and ifs: -p <profile_file>")
+        print("\t10) To write the IR out after every optimization pass: -d <file_name>")
+        print("\t11) To compile to register based instructions instead of the stack based ones: -r")
+        print("\t12) To keep the top level defines the program never uses, they are removed unless compiling with -s: -k")
+
+    def make_passes(level, dump):
+        # The passes on the control flow graphs run first, they leave jumps to the next block and unused labels
+        # for the peephole optimizer. The superinstructions are picked last, the optimizations before them only
+        # know the instructions they replace
+        passes = PassManager(level, dump)
+        control_flow = ControlFlowOptimizer()
+        peephole = PeepholeOptimizer()
+        fuser = InstructionFuser()
+        passes.register("jump threading", 2, control_flow.thread_jumps)
+        passes.register("unreachable blocks", 2, control_flow.remove_unreachable)
+        passes.register_instruction_pass("peephole", 1, peephole.optimize)
+        passes.register_instruction_pass("superinstructions", 0, fuser.fuse)
+        return (passes, control_flow, peephole, fuser)
+
+    def print_passes(passes, control_flow, peephole, fuser):
+        if(passes.level >= 2):
+            print("control flow: " + str(control_flow.threaded) + " jumps threaded, " + str(control_flow.removed) + " blocks removed")
+        if(passes.level >= 1):
+            print("peephole: " + str(peephole.removed) + " instructions removed")
+        print("superinstructions: " + str(fuser.fused) + " instructions fused")
+        for line in passes.timings():
+            print(line)
 
     compiled_human_readable = False
     assembled_human_readable = False
@@ -462,8 +1179,19 @@ if __name__ == "__main__":
     assembled_verbose = None
     input_file = None
     output_file = None
-
-    opts, args = getopt.getopt(sys.argv[1:], "i:o:c:a:h", [])
+    streaming = False
+    jobs = 1
+    verbose = False
+    level = 0
+    ir_dump = None
+    inline_size = 12
+    profile_points = False
+    profile = None
+    registers = False
+    dead_code = True
+
+    # -O on its own is -O1, getopt only has options that always or never take an input
+    opts, args = getopt.getopt(["-O1" if arg == "-O" else arg for arg in sys.argv[1:]], "i:o:c:a:hsj:vO:n:Pp:d:rk", [])
     for opt, arg in opts:
         if(opt == "-i"):
             input_file = arg
@@ -477,6 +1205,30 @@ if __name__ == "__main__":
         elif(opt == "-a"):
             assembled_human_readable = True
             assembled_verbose = arg
+        elif(opt == "-s"):
+            streaming = True
+        elif(opt == "-j"):
+            jobs = int(arg)
+        elif(opt == "-v"):
+            verbose = True
+        elif(opt == "-O"):
+            if(arg not in ["0", "1", "2"]):
+                print("invalid optimization level", arg)
+                print_help()
+                exit(1)
+            level = int(arg)
+        elif(opt == "-n"):
+            inline_size = int(arg)
+        elif(opt == "-P"):
+            profile_points = True
+        elif(opt == "-p"):
+            profile = Profile(arg)
+        elif(opt == "-d"):
+            ir_dump = arg
+        elif(opt == "-r"):
+            registers = True
+        elif(opt == "-k"):
+            dead_code = False
         else:
             print("invlid argument", opt)
             print_help()
@@ -486,18 +1238,86 @@ if __name__ == "__main__":
         print_help()
         exit(1)
 
+    if(registers and (streaming or jobs > 1 or profile_points)):
+        print("register based instructions are not available when streaming, compiling in parallel or profiling")
+        exit(1)
+
+    if(streaming):
+        if(compiled_human_readable or assembled_human_readable or ir_dump != None):
+            print("human readable output is not available when streaming")
+            exit(1)
+        if(jobs > 1):
+            print("parallel compilation is not available when streaming")
+            exit(1)
+        # Only one top level expression is held in memory at a time. Constant folding and compiling calls to
+        # built ins inline need to see the whole program to know which built ins are redefined, so they are
+        # skipped
+        with open(input_file) as in_file, open(output_file, "wb") as out_file:
+            ast_generator = ASTGenerator(None, in_file)
+            compiler = Compiler(ast_generator.ast_stream(), None, profile, profile_points)
+            (passes, control_flow, peephole, fuser) = make_passes(level, None)
+            assembler = StreamingAssembler(out_file, level >= 1, profile_points)
+            for (constants, main, procedures) in compiler.compile_incrementally():
+                (main, procedures) = passes.run(main, procedures).program()
+                assembler.assemble_form(constants, main, procedures)
+            assembler.finish(compiler.global_names)
+        if(verbose):
+            print_passes(passes, control_flow, peephole, fuser)
+        if(verbose and profile != None):
+            print("profile: " + str(compiler.swapped) + " ifs with the alternative first")
+        exit(0)
+
     with open(input_file) as file_name:
         code = file_name.read()
-    ast_generator = ASTGenerator(code)
-    ast = ast_generator.generate_ast()
-
-    compiler = Compiler(ast)
-    (constants, main, procedures) = compiler.compile()
+    if(jobs > 1):
+        from parallelcompiler import ParallelCompiler
+        compiler = ParallelCompiler(code, jobs, inline_size, profile=profile, profile_points=profile_points, dead_code=dead_code)
+        (constants, main, procedures) = compiler.compile()
+        (folded, inlined, eliminated, hot_inlined) = (compiler.folded, compiler.inlined, compiler.eliminated, compiler.hot_inlined)
+        (removed, dead_lambdas) = (compiler.removed, compiler.dead_lambdas)
+    else:
+        ast_generator = ASTGenerator(code)
+        ast = ast_generator.generate_ast()
+        folder = ConstantFolder(ast)
+        # Calls are inlined before folding, so that the inlined bodies are folded where they are inlined
+        inliner = Inliner(ast, folder.shadowed, inline_size, profile=profile)
+        inliner.inline()
+        ast = folder.fold()
+        # Inlining leaves the procedures it inlined everywhere unused, so they are removed after it
+        dead = DeadCodeEliminator(ast)
+        if(dead_code):
+            ast = dead.eliminate()
+        eliminator = SubexpressionEliminator(ast, folder.shadowed)
+        if(registers):
+            from registercompiler import RegisterCompiler
+            compiler = RegisterCompiler(eliminator.eliminate(), folder.shadowed, profile)
+        else:
+            compiler = Compiler(eliminator.eliminate(), folder.shadowed, profile, profile_points)
+        (constants, main, procedures) = compiler.compile()
+        (folded, inlined, eliminated, hot_inlined) = (folder.folded, inliner.inlined, eliminator.eliminated, inliner.hot_inlined)
+        (removed, dead_lambdas) = (dead.removed, dead.lambdas)
+    if(verbose):
+        print("inlining: " + str(inlined) + " calls inlined")
+        if(profile != None):
+            print("profile: " + str(hot_inlined) + " of them at hot call sites, " + str(compiler.swapped) + " ifs with the alternative first")
+        print("constant folding: " + str(folded) + " nodes folded")
+        print("common subexpressions: " + str(eliminated) + " calls reused")
+        if(dead_code):
+            print("dead code: " + str(len(removed)) + " defines removed with " + str(dead_lambdas) + " lambdas" +
+                  "".join((": " if i == 0 else ", ") + name for (i, name) in enumerate(removed)))
+    dump = open(ir_dump, "w") if ir_dump != None else None
+    (passes, control_flow, peephole, fuser) = make_passes(level, dump)
+    program = passes.run(main, procedures)
+    if(dump != None):
+        dump.close()
+    (main, procedures) = program.program()
+    if(verbose):
+        print_passes(passes, control_flow, peephole, fuser)
     if(compiled_human_readable):
         with open(compiled_verbose, "w") as compiled_verbose_out:
-            compiled_verbose_out.write(compiler.debug_output())
+            compiled_verbose_out.write(compiler.debug_output(program))
 
-    assembler = Assembler(constants, main, procedures)
+    assembler = Assembler(constants, main, procedures, level >= 1, compiler.global_names, profile_points)
     assembled = assembler.assemble()
     with open(output_file, "wb") as out_file:
         out_file.write(assembled)
@@ -0,0 +1,106 @@
+from astgenerator import ASTGenerator
+from compiler import Compiler
+from assembler import Assembler
+from expressions import *
+import tracemalloc
+import time
+
+
+class CompilerBenchmark:
+
+    def __init__(self):
+        pass
+
+
+    def generate_program(self, no_defines):
+        """Generate a program made of many small procedure definitions, like the large inputs we compile
+
+        Args:
+            no_defines (int): The number of top level defines
+
+        Returns:
+            str: The scheme code
+        """
+        return "".join(f'(define f{i} (lambda (x y) (if (< x y) (quote (a b "c" {i})) (let ((z (+ x {i}))) (f{i} (- z 1) y)))))\n'
+                       for i in range(no_defines))
+
+
+    def count_nodes(self, ast):
+        """Count the expressions in an AST
+
+        Args:
+            ast (List<SExpression>): The AST to count the nodes of
+
+        Returns:
+            int: The number of SExpression nodes
+        """
+        count = 0
+        stack = list(ast)
+        while(len(stack) != 0):
+            item = stack.pop()
+            if(isinstance(item, (list, tuple))):
+                stack += item
+            elif(isinstance(item, Expression)):
+                count += 1
+                for cls in type(item).__mro__:
+                    for slot in getattr(cls, "__slots__", ()):
+                        stack.append(getattr(item, slot))
+        return count
+
+
+    def ast_memory_benchmark(self, no_defines=5000):
+        """Measure the memory held by the AST of a generated program
+
+        Args:
+            no_defines (int, optional): The number of top level defines in the program. Defaults to 5000.
+
+        Returns:
+            (int, int): The number of nodes and the bytes held per node
+        """
+        code = self.generate_program(no_defines)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.time()
+        ast = ASTGenerator(code).generate_ast()
+        elapsed = time.time() - start
+        held = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        nodes = self.count_nodes(ast)
+        print(f"\t{nodes} nodes, {held} bytes, {held / nodes:.1f} bytes per node, parsed in {elapsed:.2f}s")
+        return (nodes, held // nodes)
+
+
+    def throughput_benchmark(self, no_groups=2000):
+        """Measure how fast a large synthetic program, with every kind of expression and instruction, is compiled
+        and assembled
+
+        Args:
+            no_groups (int, optional): The number of groups of two defines and a call in the program. Defaults to 2000.
+
+        Returns:
+            (float, float): The instructions compiled and assembled per second
+        """
+        template = ('(define f{0} (lambda (x y) (let ((z (+ x {0}))) (if (< z y) (f{0} (- x 1) (cons z y)) '
+                    '(begin (set! x (car y)) (display "s{0}") (quote (a {0})))))))\n'
+                    '(define g{0} (lambda (l) (do ((i 0 (+ i 1)) (acc l (cdr acc))) ((= i 3) (lambda () (f{0} i acc))) '
+                    '(and (pair? acc) (or (eq? acc l) (h{0} acc))))))\n(g{0} (f{0} 1 2))\n')
+        code = "".join(template.format(i) for i in range(no_groups))
+        ast = ASTGenerator(code).generate_ast()
+        start = time.perf_counter()
+        compiler = Compiler(ast, ())
+        (constants, main, procedures) = compiler.compile()
+        compile_time = time.perf_counter() - start
+        no_instructions = len(main) + sum(len(ins) for (uid, ins) in procedures)
+        start = time.perf_counter()
+        Assembler(constants, main, procedures, global_names=compiler.global_names).assemble()
+        assemble_time = time.perf_counter() - start
+        print(f"\t{no_instructions} instructions, compiled at {no_instructions / compile_time:.0f}/s, assembled at {no_instructions / assemble_time:.0f}/s")
+        return (no_instructions / compile_time, no_instructions / assemble_time)
+
+
+if __name__ == "__main__":
+    benchmark = CompilerBenchmark()
+    print("AST memory")
+    benchmark.ast_memory_benchmark()
+    print("Compile and assemble throughput")
+    benchmark.throughput_benchmark()
@@ -24,6 +24,114 @@ class OppCodes(Enum):
     proc_end = 18
     const_data = 19
     unbind = 20
+    data_offset = 21
+    lookup_local = 22
+    set_local = 23
+    global_get = 24
+    global_set = 25
+    global_define = 26
+    global_names = 27
+    # Primitive operations, they pop their arguments off the stack and set VALUE. The arithmetic ones take
+    # the number of arguments as input
+    prim_add = 28
+    prim_sub = 29
+    prim_mul = 30
+    prim_div = 31
+    prim_mod = 32
+    prim_num_eq = 33
+    prim_lt = 34
+    prim_gt = 35
+    prim_le = 36
+    prim_ge = 37
+    prim_car = 38
+    prim_cdr = 39
+    prim_cons = 40
+    prim_eq = 41
+    prim_is_number = 42
+    prim_is_string = 43
+    prim_is_pair = 44
+    prim_is_symbol = 45
+    # Pop the arguments of a self tail call into the slots of the current frame
+    rebind = 46
+    # Call a procedure in a global variable. call_global is replaced by call_direct or a lookup and an
+    # apply once the program is linked, call_direct takes the global index and the procedure id
+    call_global = 47
+    call_direct = 48
+    # Variables that are set! and captured by a closure are kept in a box shared by the frame and the closure.
+    # box_slot puts a slot of the current frame in a box, the other two take (depth, index) like lookup_local
+    box_slot = 49
+    lookup_boxed = 50
+    set_boxed = 51
+    # The primitive operations on numbers for arguments the compiler knows are numbers, they do not check
+    # the types of the arguments. The arithmetic ones take the number of arguments as input
+    unchecked_add = 52
+    unchecked_sub = 53
+    unchecked_mul = 54
+    unchecked_div = 55
+    unchecked_mod = 56
+    unchecked_num_eq = 57
+    unchecked_lt = 58
+    unchecked_gt = 59
+    unchecked_le = 60
+    unchecked_ge = 61
+    # Superinstructions, each one does the work of the sequence of instructions it replaces with a single
+    # dispatch in the VM, see InstructionFuser. lookup_push and lookup_apply take (depth, index) like lookup_local,
+    # const_push takes a uid, rebind_branch takes (number of slots, label) and branch_if_not takes (Opp, label)
+    # where Opp is a primitive test that takes no input
+    lookup_push = 62
+    const_push = 63
+    lookup_apply = 64
+    rebind_branch = 65
+    branch_if_not = 66
+    # Marks a point the VM can profile, takes (ProfileKinds, id). Nothing is written out for it, the assembler
+    # puts the address of the instruction before it, or of the procedure it starts, in the profile table
+    profile_point = 67
+    # In the data section, followed by the address of the profile table. The table is the number of points and
+    # (kind, address, id) of every one of them
+    profile_table = 68
+    # The register based code, see RegisterCompiler. The registers are the slots of the frame of the procedure
+    # being run: the variables its closure captured, then its arguments, then its let variables and temporaries.
+    # reg_enter takes (frame_size, number_of_captured_and_arguments) and starts every procedure and the main
+    # instructions. Most of the others take the destination register first, the calls and closures take their
+    # arguments as a tuple of registers
+    reg_enter = 69
+    reg_const = 70
+    reg_move = 71
+    reg_global_get = 72
+    reg_global_set = 73
+    reg_global_define = 74
+    reg_box = 75
+    reg_unbox = 76
+    reg_set_box = 77
+    # Takes (Opp, destination, registers), Opp is a primitive operation or its unchecked version
+    reg_prim = 78
+    # Jumps take their label last: (register, label), (Opp, registers, label) for the test of reg_branch_if_not
+    # and (first_register, registers, label) for reg_loop, that copies the registers to the ones starting at
+    # first_register all at once and jumps
+    reg_branch_false = 79
+    reg_branch_true = 80
+    reg_branch_if_not = 81
+    reg_loop = 82
+    # Calls take (procedure_register, destination, registers), the global ones the global index instead of
+    # the procedure register and the direct ones (global_index, procedure_id, destination, registers). The calls
+    # in tail position have no destination
+    reg_call = 83
+    reg_tail_call = 84
+    reg_call_global = 85
+    reg_tail_call_global = 86
+    reg_call_direct = 87
+    reg_tail_call_direct = 88
+    reg_ret = 89
+    # Takes (procedure_id, destination, registers) of the variables the closure captures
+    reg_closure = 90
+
+class ProfileKinds(Enum):
+    # The points the VM profiles: the start of a procedure, the conditional jump of an if and a call. Their id is
+    # the index in the source file of the expression they were compiled from, so it does not change when the
+    # file is compiled again with other options
+    procedure = 0
+    branch = 1
+    call = 2
 
 class Types(Enum):
     # Opp codes for types of constants
@@ -32,10 +140,11 @@ class Types(Enum):
     number = 3
     list = 4
     symbol = 5
+    pair = 6
 
 class Defaults(Enum):
-    boolean_false = 1
-    boolean_true = 2
-    empty_list = 3
+    boolean_false = 0
+    boolean_true = 1
+    empty_list = 2
 
     
\ No newline at end of file
@@ -0,0 +1,363 @@
+from compilerenums import *
+
+
+# The operations that end a basic block, execution never falls through to the next instruction after the
+# unconditional ones
+unconditional_jumps = [OppCodes.branch, OppCodes.rebind_branch, OppCodes.reg_loop]
+conditional_jumps = [OppCodes.if_false_branch, OppCodes.if_true_branch, OppCodes.branch_if_not,
+                     OppCodes.reg_branch_false, OppCodes.reg_branch_true, OppCodes.reg_branch_if_not]
+no_successors = [OppCodes.ret, OppCodes.ext, OppCodes.proc_end, OppCodes.reg_ret, OppCodes.reg_tail_call,
+                 OppCodes.reg_tail_call_global, OppCodes.reg_tail_call_direct]
+# The jumps of the register instructions, their input is a tuple with the label last
+register_jumps = [OppCodes.reg_branch_false, OppCodes.reg_branch_true, OppCodes.reg_branch_if_not, OppCodes.reg_loop]
+
+
+def jump_target(opp, arg):
+    """Find the label an instruction jumps to. rebind_branch and branch_if_not are the fused versions of a rebind
+    and a branch and of a test and an if_false_branch, their input is a pair with the label last
+
+    Args:
+        opp (OppCodes): The operation
+        arg (Any): Its input
+
+    Returns:
+        int: The label, None if the instruction does not jump
+    """
+    if(opp in [OppCodes.branch, OppCodes.if_false_branch, OppCodes.if_true_branch, OppCodes.save_continuation]):
+        return arg
+    if(opp in [OppCodes.rebind_branch, OppCodes.branch_if_not]):
+        return arg[1]
+    if(opp in register_jumps):
+        return arg[-1]
+    return None
+
+
+def retarget(opp, arg, label):
+    """Make an instruction jump to another label
+
+    Args:
+        opp (OppCodes): The operation, it jumps, see jump_target
+        arg (Any): Its input
+        label (int): The new label
+
+    Returns:
+        Any: The new input
+    """
+    if(isinstance(arg, tuple)):
+        return arg[:-1] + (label,)
+    return label
+
+
+def instruction_listing(instructions):
+    """The human readable listing of a list of instructions, one per line
+
+    Args:
+        instructions (List): List of (Opp, Input)
+
+    Returns:
+        str: The listing
+    """
+    output = ""
+    for (opp, arg) in instructions:
+        # branch_if_not has the test it runs in its input, profile_point the kind of the point
+        if(isinstance(arg, tuple)):
+            arg = tuple(x.name if isinstance(x, (OppCodes, ProfileKinds)) else x for x in arg)
+        output += opp.name + " " + (str(arg) if arg != None else "") + "\n"
+    return output
+
+
+class BasicBlock:
+
+    def __init__(self, index, labels, instructions):
+        """BasicBlock constructor, a run of instructions that is only entered at the start and only left at the end
+
+        Args:
+            index (int): The position of the block in its ControlFlowGraph
+            labels (List<int>): The labels at the start of the block
+            instructions (List): List of (Opp, Input), without the labels. The profile points after the last jump are part of the block, they mark the jump
+        """
+        self.index = index
+        self.labels = labels
+        self.instructions = instructions
+        # The indices of the blocks execution can go to next, and of the ones it can come from. The block a
+        # save_continuation resumes at is a successor of the block that saves it
+        self.successors = []
+        self.predecessors = []
+        # The number of frames bound by the procedure when the block is entered, None if no path from the
+        # entry leads to it
+        self.frame_depth = None
+        # The variables the block reads before it sets them, and the ones it sets. A local variable is
+        # ("local", frame, slot), the frames are numbered from the first one the procedure binds so that the
+        # frame of the variables a closure captured is -1. A global variable is ("global", index)
+        self.uses = set()
+        self.defs = set()
+
+
+    def terminator(self):
+        """Find the last instruction that is not a profile point
+
+        Returns:
+            (Opp, Input): The instruction, None if the block has none
+        """
+        for ins in reversed(self.instructions):
+            if(ins[0] != OppCodes.profile_point):
+                return ins
+        return None
+
+
+    def falls_through(self):
+        """Can execution go on to the next block after the end of this one
+
+        Returns:
+            boolean: False if the block ends with an unconditional jump, a ret, an ext or a proc_end
+        """
+        last = self.terminator()
+        return last == None or last[0] not in unconditional_jumps + no_successors
+
+
+class ControlFlowGraph:
+
+    def __init__(self, uid, instructions):
+        """ControlFlowGraph constructor, splits the instructions of a procedure into basic blocks
+
+        Args:
+            uid (int): The id of the procedure, None for the main instructions
+            instructions (List): List of (Opp, Input)
+        """
+        self.uid = uid
+        self.blocks = []
+        labels = []
+        current = []
+        ended = False
+        for (opp, arg) in instructions:
+            # A label starts a new block, and so does any instruction after a jump other than the profile points
+            # that mark the jump
+            if(opp == OppCodes.label):
+                if(len(current) != 0):
+                    self.add_block(labels, current)
+                    (labels, current) = ([], [])
+                labels.append(arg)
+                ended = False
+                continue
+            if(ended and opp != OppCodes.profile_point):
+                self.add_block(labels, current)
+                (labels, current) = ([], [])
+                ended = False
+            current.append((opp, arg))
+            if(opp in unconditional_jumps + conditional_jumps + no_successors):
+                ended = True
+        if(len(labels) != 0 or len(current) != 0):
+            self.add_block(labels, current)
+        self.relink()
+
+
+    def add_block(self, labels, instructions):
+        """Add a block at the end of the graph
+
+        Args:
+            labels (List<int>): The labels at the start of the block
+            instructions (List): List of (Opp, Input)
+
+        Returns:
+            BasicBlock: The block
+        """
+        block = BasicBlock(len(self.blocks), labels, instructions)
+        self.blocks.append(block)
+        return block
+
+
+    def block_labels(self):
+        """Find the block every label starts
+
+        Returns:
+            dict: {label: block_index}
+        """
+        return {label: block.index for block in self.blocks for label in block.labels}
+
+
+    def relink(self):
+        """Number the blocks in order and find their successors, predecessors, frame depths and uses and defs
+        again, after the blocks were changed
+        """
+        for (i, block) in enumerate(self.blocks):
+            block.index = i
+            (block.successors, block.predecessors) = ([], [])
+        labels = self.block_labels()
+        # The frame depth a successor is entered with, by the index of the edge
+        entry_depths = {}
+        for block in self.blocks:
+            last = block.terminator()
+            depth = 0
+            for (opp, arg) in block.instructions:
+                if(opp == OppCodes.bind):
+                    depth += 1
+                elif(opp == OppCodes.unbind):
+                    depth -= 1
+                if(opp == OppCodes.save_continuation or (opp in unconditional_jumps + conditional_jumps and (opp, arg) == last)):
+                    if(jump_target(opp, arg) in labels):
+                        entry_depths[(block.index, labels[jump_target(opp, arg)])] = depth
+            if(block.falls_through() and block.index + 1 < len(self.blocks)):
+                entry_depths[(block.index, block.index + 1)] = depth
+        for (source, target) in entry_depths:
+            if(target not in self.blocks[source].successors):
+                self.blocks[source].successors.append(target)
+                self.blocks[target].predecessors.append(source)
+        self.find_frame_depths(entry_depths)
+        for block in self.blocks:
+            self.find_uses_and_defs(block)
+
+
+    def find_frame_depths(self, entry_depths):
+        """Find the number of frames bound when every block is entered, going from the entry block along the edges
+
+        Args:
+            entry_depths (dict): {(source_index, target_index): frames} the binds and unbinds of the source block add up to at the edge
+        """
+        for block in self.blocks:
+            block.frame_depth = None
+        if(len(self.blocks) == 0):
+            return
+        self.blocks[0].frame_depth = 0
+        stack = [self.blocks[0]]
+        while(len(stack) != 0):
+            block = stack.pop()
+            for target in block.successors:
+                if(self.blocks[target].frame_depth == None):
+                    self.blocks[target].frame_depth = block.frame_depth + entry_depths[(block.index, target)]
+                    stack.append(self.blocks[target])
+
+
+    def find_uses_and_defs(self, block):
+        """Find the variables a block reads before it sets them and the ones it sets
+
+        Args:
+            block (BasicBlock): The block
+        """
+        (block.uses, block.defs) = (set(), set())
+        frames = block.frame_depth if block.frame_depth != None else 0
+
+        def use(variable):
+            if(variable not in block.defs):
+                block.uses.add(variable)
+
+        for (opp, arg) in block.instructions:
+            if(opp in [OppCodes.lookup_local, OppCodes.lookup_boxed, OppCodes.lookup_push, OppCodes.lookup_apply]):
+                use(("local", frames - 1 - arg[0], arg[1]))
+            elif(opp in [OppCodes.set_local, OppCodes.set_boxed]):
+                block.defs.add(("local", frames - 1 - arg[0], arg[1]))
+            elif(opp == OppCodes.box_slot):
+                block.defs.add(("local", frames - 1, arg))
+            elif(opp in [OppCodes.rebind, OppCodes.rebind_branch]):
+                for slot in range(arg if opp == OppCodes.rebind else arg[0]):
+                    block.defs.add(("local", frames - 1, slot))
+            elif(opp in [OppCodes.global_get, OppCodes.call_global]):
+                use(("global", arg))
+            elif(opp in [OppCodes.call_direct, OppCodes.reg_call_global, OppCodes.reg_tail_call_global,
+                         OppCodes.reg_call_direct, OppCodes.reg_tail_call_direct]):
+                use(("global", arg[0]))
+            elif(opp == OppCodes.reg_global_get):
+                use(("global", arg[1]))
+            elif(opp in [OppCodes.global_set, OppCodes.global_define]):
+                block.defs.add(("global", arg))
+            elif(opp in [OppCodes.reg_global_set, OppCodes.reg_global_define]):
+                block.defs.add(("global", arg[1]))
+            elif(opp == OppCodes.bind):
+                frames += 1
+            elif(opp == OppCodes.unbind):
+                frames -= 1
+
+
+    def instructions(self):
+        """Lay the blocks out one after the other again
+
+        Returns:
+            List: List of (Opp, Input)
+        """
+        instructions = []
+        for block in self.blocks:
+            instructions += [(OppCodes.label, label) for label in block.labels]
+            instructions += block.instructions
+        return instructions
+
+
+    def dump(self):
+        """Produce a human readable version of the graph
+
+        Returns:
+            string: The blocks with their edges and variables
+        """
+        def variable_name(variable):
+            return ("g" + str(variable[1])) if variable[0] == "global" else ("l" + str(variable[1]) + "." + str(variable[2]))
+
+        output = ("main" if self.uid == None else "lambda " + str(self.uid)) + "\n"
+        for block in self.blocks:
+            output += "block " + str(block.index) + " labels: " + str(block.labels) + " depth: " + str(block.frame_depth)
+            output += " preds: " + str(block.predecessors) + " succs: " + str(block.successors) + "\n"
+            output += "uses: " + " ".join(sorted(map(variable_name, block.uses))) + "\n"
+            output += "defs: " + " ".join(sorted(map(variable_name, block.defs))) + "\n"
+            output += instruction_listing(block.instructions)
+        return output
+
+
+class IRProgram:
+
+    def __init__(self, main, procedures):
+        """IRProgram constructor, the control flow graphs of a compiled program
+
+        Args:
+            main (List): The main instructions, list of (Opp, Input)
+            procedures (List): List of (procedure_id, instructions)
+        """
+        self.main = ControlFlowGraph(None, main)
+        self.procedures = [ControlFlowGraph(uid, ins) for (uid, ins) in procedures]
+        # Labels are numbered densely over the whole program, the new ones a pass makes come after all of them
+        labels = [label for graph in self.graphs() for block in graph.blocks for label in block.labels]
+        self.cur_label = max(labels, default=-1) + 1
+
+
+    def graphs(self):
+        """The graphs of the main instructions and of the procedures
+
+        Returns:
+            List<ControlFlowGraph>: The main graph first
+        """
+        return [self.main] + self.procedures
+
+
+    def generate_label(self):
+        """Generate a label no block of the program has
+
+        Returns:
+            int: The label
+        """
+        label = self.cur_label
+        self.cur_label += 1
+        return label
+
+
+    def program(self):
+        """Lay the program out as lists of instructions again
+
+        Returns:
+            (main, procedures): The main instructions and the list of (procedure_id, instructions)
+        """
+        return (self.main.instructions(), [(graph.uid, graph.instructions()) for graph in self.procedures])
+
+
+    def map_instructions(self, function):
+        """Run a pass that works on lists of instructions over every graph, and split its output into blocks again
+
+        Args:
+            function (Callable): Takes and returns a list of (Opp, Input)
+        """
+        self.main = ControlFlowGraph(None, function(self.main.instructions()))
+        self.procedures = [ControlFlowGraph(graph.uid, function(graph.instructions())) for graph in self.procedures]
+
+
+    def dump(self):
+        """Produce a human readable version of the program
+
+        Returns:
+            string: The graphs one after the other
+        """
+        return "\n".join(graph.dump() for graph in self.graphs())
@@ -0,0 +1,100 @@
+class ProfileError(Exception):
+    pass
+
+
+class Profile:
+
+    def __init__(self, path=None, hot_share=0.9):
+        """Profile constructor, reads the counts the VM writes out with -p when it runs a program compiled with -P.
+        The points are identified by the index in the source file of the expression they were compiled from, see
+        ProfileKinds, so the profile can be used to compile the same file again with any other options
+
+        Args:
+            path (str, optional): The profile written by the VM. Defaults to None, for an empty profile.
+            hot_share (float, optional): The hot call sites are the busiest ones that together make this share of all the calls. Defaults to 0.9.
+        """
+        # {id: number_of_calls} of the procedures, {id: (times_true, times_false)} of the tests of the ifs and
+        # {id: {target_id: number_of_calls}} of the call sites. The target is None for the built ins and the
+        # procedures without an id
+        self.procedures = {}
+        self.branches = {}
+        self.calls = {}
+        self.hot_share = hot_share
+        self.hot_sites = set()
+        if(path != None):
+            with open(path) as profile_file:
+                self.read(profile_file)
+
+
+    def read(self, lines):
+        """Add the counts in a profile, the same point can show up more than once. The hot call sites are found again
+
+        Args:
+            lines (Iterable<str>): The lines of the profile, each one is "procedure <id> <calls>", "branch <id> <times_true> <times_false>" or "call <id> <target_id or -> <calls>"
+        """
+        for (number, line) in enumerate(lines, 1):
+            fields = line.split()
+            if(len(fields) == 0):
+                continue
+            try:
+                if(fields[0] == "procedure" and len(fields) == 3):
+                    point_id = int(fields[1])
+                    self.procedures[point_id] = self.procedures.get(point_id, 0) + int(fields[2])
+                elif(fields[0] == "branch" and len(fields) == 4):
+                    (times_true, times_false) = self.branches.get(int(fields[1]), (0, 0))
+                    self.branches[int(fields[1])] = (times_true + int(fields[2]), times_false + int(fields[3]))
+                elif(fields[0] == "call" and len(fields) == 4):
+                    targets = self.calls.setdefault(int(fields[1]), {})
+                    target = None if fields[2] == "-" else int(fields[2])
+                    targets[target] = targets.get(target, 0) + int(fields[3])
+                else:
+                    raise ValueError()
+            except ValueError:
+                raise ProfileError("Line " + str(number) + " of the profile is not a procedure, branch or call count: " + repr(line.strip()))
+        self.hot_sites = self.find_hot_sites(self.hot_share)
+
+
+    def find_hot_sites(self, hot_share):
+        """Find the call sites that make most of the calls
+
+        Args:
+            hot_share (float): The share of all the calls the hot sites make together
+
+        Returns:
+            set: The ids of the hot call sites
+        """
+        totals = sorted(((sum(targets.values()), site) for (site, targets) in self.calls.items()), reverse=True)
+        limit = hot_share * sum(total for (total, site) in totals)
+        hot = set()
+        covered = 0
+        for (total, site) in totals:
+            if(covered >= limit or total == 0):
+                break
+            hot.add(site)
+            covered += total
+        return hot
+
+
+    def times_called(self, point_id):
+        """The number of times a procedure was called
+
+        Args:
+            point_id (int): The id of the procedure, None if it has none
+
+        Returns:
+            int: The number of calls, 0 if it was never called or is not in the profile
+        """
+        return self.procedures.get(point_id, 0)
+
+
+    def mostly_false(self, point_id):
+        """Was the test of an if false more often than it was true
+
+        Args:
+            point_id (int): The id of the if, None if it has none
+
+        Returns:
+            boolean: False if the if is not in the profile
+        """
+        (times_true, times_false) = self.branches.get(point_id, (0, 0))
+        return times_false > times_true
@@ -1,7 +1,23 @@
 from astgenerator import ASTGenerator
 from compiler import Compiler
+from parallelcompiler import ParallelCompiler
+from assembler import Assembler
+from constantfolder import ConstantFolder
+from peepholeoptimizer import PeepholeOptimizer
+from instructionfuser import InstructionFuser
+from controlflowoptimizer import ControlFlowOptimizer
+from passmanager import PassManager
+from compilerir import IRProgram
+from inliner import Inliner
+from subexpressioneliminator import SubexpressionEliminator
+from compilerprofile import Profile
+from registercompiler import RegisterCompiler
+from deadcodeeliminator import DeadCodeEliminator
 from expressions import *
 from compilerenums import *
+import io
+import time
+import tracemalloc
 
 
 class CompilerTester:
@@ -24,6 +40,8 @@ class CompilerTester:
             '(quote x)' : [SSymbol("x"),],
             '#f' : [SBool("#f")],
             'x' : [SVariable("x")],
+            "'(x (y))" : [SConstList([SSymbol("x"), SConstList([SSymbol("y")])])],
+            '(f (g 1) "a b")' : [SProcApplication(SVariable('f'), [SProcApplication(SVariable('g'), [SNumber(1.0)]), SString("a b")])],
         }
         
         for code in testcases:
@@ -32,10 +50,437 @@ class CompilerTester:
             got = astgen.generate_ast()
             if(got != expected):
                 raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{got}\n-------\nexpected:\n{expected}")
+            # Reading the same code lazily from a file should not change the AST
+            streamed = list(ASTGenerator(None, io.StringIO(code)).ast_stream())
+            if(streamed != expected):
+                raise AssertionError(f"\nfor streamed code:\n{code}\n-------\ngot:\n{streamed}\n-------\nexpected:\n{expected}")
             
+    def deep_nesting_test(self):
+        depth = 100000
+        # name: (code at a depth, number of instructions in the main and the procedures at that depth)
+        testcases = {
+            "+": (lambda depth: "(+ 1 " * depth + "1" + ")" * depth, lambda depth: 7 * depth + 2),
+            "quote": (lambda depth: "(quote " + "(a " * depth + ")" * depth + ")", lambda depth: 2),
+            "if": (lambda depth: "(if #t " * depth + "1" + " 2)" * depth, lambda depth: 6 * depth + 2),
+            "lambda": (lambda depth: "(lambda (x) " * depth + "x" + ")" * depth, lambda depth: 4 * depth + 2),
+            "let": (lambda depth: "(let ((a 1)) " * depth + "a" + ")" * depth, lambda depth: 4 * depth + 2),
+        }
+        for (name, (make_code, no_instructions)) in testcases.items():
+            # A quarter of the depth has to compile in about a quarter of the time, a pass that walks the
+            # nested expressions again at every level takes 16 times as long
+            times = []
+            for level in [depth // 4, depth]:
+                code = make_code(level)
+                start = time.time()
+                ast = ASTGenerator(code).generate_ast()
+                (constants, main, procedures) = Compiler(ast).compile()
+                times.append(time.time() - start)
+                got = len(main) + sum(len(ins) for (uid, ins) in procedures)
+                if(got != no_instructions(level)):
+                    raise AssertionError(f"\nfor code:\n{code[:20]}...\n-------\ngot {got} instructions, expected {no_instructions(level)}")
+            print(f"\tdepth {depth}, {make_code(2)[:8]}... compiled in {times[1]:.2f}s, {times[1] / times[0]:.1f} times depth {depth // 4}")
+            if(times[1] > 8 * times[0]):
+                raise AssertionError(f"\nfor code:\n{make_code(2)[:20]}...\n-------\ndepth {depth} took {times[1]:.2f}s, {times[1] / times[0]:.1f} times depth {depth // 4}")
+
+    def streaming_test(self):
+        # Every form has its own constants and procedure, the memory held must not grow with the forms compiled
+        no_forms = 20000
+        code = "".join(f'(define f (lambda (x) (if (< x {i}) (quote (a "s{i}" {i})) {i}.5)))\n' for i in range(no_forms))
+        tracemalloc.start()
+        compiler = Compiler(ASTGenerator(None, io.StringIO(code)).ast_stream(), None)
+        for (i, (constants, main, procedures)) in enumerate(compiler.compile_incrementally()):
+            if(i == no_forms // 10):
+                held = tracemalloc.get_traced_memory()[0]
+            if(i < no_forms and len(constants) != 7):
+                raise AssertionError(f"\nform {i} got {len(constants)} constants, expected 7\n{constants}")
+        grown = tracemalloc.get_traced_memory()[0] - held
+        tracemalloc.stop()
+        print(f"\t{no_forms} forms streamed, {grown} bytes more held after the first {no_forms // 10}")
+        if(grown > 100000):
+            raise AssertionError(f"\nstreaming {no_forms} forms held {grown} more bytes after the first {no_forms // 10}")
+
+    def constant_folding_test(self):
+        # code: (code of the expected AST, number of nodes folded)
+        testcases = {
+            "(* (* 60 60) 24)": ("86400", 2),
+            "(- 5)": ("-5", 1),
+            "(if (< 1 2) x y)": ("x", 2),
+            "(cond ((> 1 2) x) (else y))": ("(begin y)", 3),
+            "(if '() x y)": ("x", 1),
+            "(lambda (+) (+ 1 2))": ("(lambda (+) (+ 1 2))", 0),
+            "(let ((* f)) (* 1 2)) (* 1 2)": ("(let ((* f)) (* 1 2)) 2", 1),
+            "(+ 1 2) (define + f)": ("(+ 1 2) (define + f)", 0),
+            "(/ 1 0)": ("(/ 1 0)", 0),
+            "(- 1 2 3) (* 2 3 4) (+)": ("-4 24 0", 3),
+            "(- 1 2 3 x)": ("(- 1 2 3 x)", 0),
+            '(+ 1 "a")': ('(+ 1 "a")', 0),
+        }
+        for code in testcases:
+            (expected_code, expected_folded) = testcases[code]
+            folder = ConstantFolder(ASTGenerator(code).generate_ast())
+            got = folder.fold()
+            expected = ASTGenerator(expected_code).generate_ast()
+            if(got != expected or folder.folded != expected_folded):
+                raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{got}, {folder.folded} folded\n-------\nexpected:\n{expected}, {expected_folded} folded")
+
+    def lexical_addressing_test(self):
+        code = "(lambda (x) (let ((y x)) (lambda () (set! x y) (set! z x) x)))"
+        compiler = Compiler(ASTGenerator(code).generate_ast())
+        (constants, main, procedures) = compiler.compile()
+        # The frames of the two lambdas and the let are on the stack, x and y escape and x is boxed
+        if(compiler.escapes != {"stack_frames": 3, "captured": 2, "boxed": 1}):
+            raise AssertionError(f"\nfor code:\n{code}\n-------\ngot escapes:\n{compiler.escapes}")
+        # The inner lambda is compiled first. Its own frame is at depth 0 and the variables it captured at depth 1,
+        # x is set! and captured so it is boxed
+        expected = [(OppCodes.bind, 0), (OppCodes.lookup_local, (1, 1)), (OppCodes.set_boxed, (1, 0)),
+                    (OppCodes.lookup_boxed, (1, 0)), (OppCodes.global_set, 0), (OppCodes.lookup_boxed, (1, 0)),
+                    (OppCodes.ret, None), (OppCodes.proc_end, None)]
+        if(procedures[0][1] != expected):
+            raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{procedures[0][1]}\n-------\nexpected:\n{expected}")
+        # The outer lambda boxes x and copies y and the box of x into the closure
+        expected = [(OppCodes.bind, 1), (OppCodes.box_slot, 0), (OppCodes.lookup_boxed, (0, 0)), (OppCodes.push, None),
+                    (OppCodes.bind, 1), (OppCodes.lookup_local, (0, 0)), (OppCodes.push, None), (OppCodes.lookup_local, (1, 0)),
+                    (OppCodes.push, None), (OppCodes.make_closure, (1, 2)), (OppCodes.ret, None), (OppCodes.unbind, None),
+                    (OppCodes.proc_end, None)]
+        if(procedures[1][1] != expected):
+            raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{procedures[1][1]}\n-------\nexpected:\n{expected}")
+
+    def primitive_test(self):
+        O = OppCodes
+        testcases = {
+            # Arithmetic takes any number of arguments, the first one is pushed last. The constants are numbers so
+            # their types are not checked
+            "(+ 1 2 3)": [(O.load_const, 3), (O.push, None), (O.load_const, 4), (O.push, None), (O.load_const, 5), (O.push, None), (O.unchecked_add, 3)],
+            "(car x)": [(O.global_get, 0), (O.push, None), (O.prim_car, None)],
+            # Not the built in once it is set!
+            "(set! number? x) (number? x)": [(O.global_get, 0), (O.global_set, 1), (O.save_continuation, 0), (O.global_get, 0), (O.push, None), (O.global_get, 1), (O.apply, None), (O.label, 0)],
+            # Wrong number of arguments, left for the VM to report
+            "(car x x)": [(O.save_continuation, 0), (O.global_get, 0), (O.push, None), (O.global_get, 0), (O.push, None), (O.global_get, 1), (O.apply, None), (O.label, 0)],
+        }
+        for code in testcases:
+            folder = ConstantFolder(ASTGenerator(code).generate_ast())
+            (constants, main, procedures) = Compiler(folder.ast, folder.shadowed).compile()
+            if(main[:-1] != testcases[code]):
+                raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{main[:-1]}\n-------\nexpected:\n{testcases[code]}")
+        # A variable bound by a lambda is not the built in
+        code = "(lambda (car) (car 1))"
+        (constants, main, procedures) = Compiler(ASTGenerator(code).generate_ast(), ()).compile()
+        if(any(opp == O.prim_car for (opp, _) in procedures[0][1])):
+            raise AssertionError(f"\nfor code:\n{code}\n-------\ncompiled car inline:\n{procedures[0][1]}")
+        # x is a number once < checked it, until it is set! to something that is not known to be one
+        testcases = {
+            "(lambda (x) (if (< x 1) 1 (+ x 2)))": [O.prim_lt, O.unchecked_add],
+            "(lambda (x) (let ((y (+ x 1))) (set! x \"s\") (- x y)))": [O.prim_add, O.prim_sub],
+        }
+        for code in testcases:
+            folder = ConstantFolder(ASTGenerator(code).generate_ast())
+            (constants, main, procedures) = Compiler(folder.ast, folder.shadowed).compile()
+            got = [opp for (opp, _) in procedures[0][1] if opp in Compiler.unchecked_operations or opp in Compiler.unchecked_operations.values()]
+            if(got != testcases[code]):
+                raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{got}\n-------\nexpected:\n{testcases[code]}")
+
+    def loop_test(self):
+        O = OppCodes
+        testcases = {
+            # The frame is reused, and i is a number once = checked it
+            "(define f (lambda (i) (if (= i 0) i (f (- i 1)))))":
+                [(O.bind, 1), (O.label, 2), (O.load_const, 3), (O.push, None), (O.lookup_local, (0, 0)), (O.push, None), (O.prim_num_eq, None),
+                 (O.if_false_branch, 0), (O.lookup_local, (0, 0)), (O.ret, None), (O.branch, 1), (O.label, 0),
+                 (O.load_const, 4), (O.push, None), (O.lookup_local, (0, 0)), (O.push, None), (O.unchecked_sub, 2), (O.push, None), (O.rebind, 1), (O.branch, 2),
+                 (O.label, 1), (O.proc_end, None)],
+            # Closures copy what they capture, so the frame is reused even when one is made in the loop
+            "(define f (lambda (g) (let ((x 1)) (f (lambda () x)))))":
+                [(O.bind, 1), (O.label, 0), (O.load_const, 3), (O.push, None), (O.bind, 1), (O.lookup_local, (0, 0)), (O.push, None),
+                 (O.make_closure, (1, 1)), (O.push, None), (O.unbind, None), (O.rebind, 1), (O.branch, 0), (O.unbind, None), (O.proc_end, None)],
+        }
+        for code in testcases:
+            folder = ConstantFolder(ASTGenerator(code).generate_ast())
+            (constants, main, procedures) = Compiler(folder.ast, folder.shadowed).compile()
+            if(procedures[-1][1] != testcases[code]):
+                raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{procedures[-1][1]}\n-------\nexpected:\n{testcases[code]}")
+        # Not a loop once it is set!, or when the call is not in tail position
+        for code in ["(define f (lambda (i) (f i))) (set! f 1)", "(define f (lambda (i) (display (f i))))"]:
+            folder = ConstantFolder(ASTGenerator(code).generate_ast())
+            (constants, main, procedures) = Compiler(folder.ast, folder.shadowed).compile()
+            if((O.rebind, 1) in procedures[0][1] or (O.branch, 0) in procedures[0][1]):
+                raise AssertionError(f"\nfor code:\n{code}\n-------\ncompiled as a loop:\n{procedures[0][1]}")
+
+    def named_let_test(self):
+        O = OppCodes
+        # A do is a named let, with the step in tail position of the body
+        got = ASTGenerator("(do ((i 0 (+ i 1)) (j 1)) ((= i 3) j) (display i))").generate_ast()
+        expected = [SNamedLet(SVariable("#do"), [(SVariable("i"), SNumber(0.0)), (SVariable("j"), SNumber(1.0))],
+                              [SIf(ASTGenerator("(= i 3)").generate_ast()[0], SBegin([SVariable("j")]),
+                                   SBegin(ASTGenerator("(display i)").generate_ast() +
+                                          [SProcApplication(SVariable("#do"), ASTGenerator("(+ i 1) j").generate_ast())]))])]
+        if(got != expected):
+            raise AssertionError(f"\ngot:\n{got}\n-------\nexpected:\n{expected}")
+        # The loop jumps back to the start of its body in place, without a closure
+        code = "(let loop ((i 0)) (if (< i 9) (loop (+ i 1)) i))"
+        folder = ConstantFolder(ASTGenerator(code).generate_ast())
+        (constants, main, procedures) = Compiler(folder.ast, folder.shadowed).compile()
+        expected = [(O.load_const, 3), (O.push, None), (O.bind, 1), (O.label, 0), (O.load_const, 4), (O.push, None),
+                    (O.lookup_local, (0, 0)), (O.push, None), (O.prim_lt, None), (O.if_false_branch, 1),
+                    (O.load_const, 5), (O.push, None), (O.lookup_local, (0, 0)), (O.push, None), (O.unchecked_add, 2), (O.push, None),
+                    (O.rebind, 1), (O.branch, 0), (O.branch, 2), (O.label, 1), (O.lookup_local, (0, 0)), (O.label, 2),
+                    (O.unbind, None), (O.ext, None)]
+        if(main != expected or len(procedures) != 0):
+            raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{main}\n-------\nexpected:\n{expected}")
+        # Once the name is used in another way it is bound to a lambda
+        got = ASTGenerator("(let f ((n 3)) (if (= n 0) 1 (* n (f (- n 1)))))").generate_ast()
+        if(not isinstance(got[0], SProcApplication) or not isinstance(got[0].operator, SLet)):
+            raise AssertionError(f"\ngot:\n{got}")
+
+    def inlining_test(self):
+        testcases = {
+            "(define f (lambda (x) (+ x g))) (f 1)": "(define f (lambda (x) (+ x g))) (let ((x 1)) (+ x g))",
+            "((lambda (x y) (- x y)) 1 2)": "(let ((x 1) (y 2)) (- x y))",
+            # g would refer to the lambda's variable, f is recursive, h is set!
+            "(define f (lambda (x) (+ x g))) (lambda (g) (f g))": "(define f (lambda (x) (+ x g))) (lambda (g) (f g))",
+            "(define f (lambda (x) (f x))) (f 1)": "(define f (lambda (x) (f x))) (f 1)",
+            "(define h (lambda (x) x)) (set! h 1) (h 1)": "(define h (lambda (x) x)) (set! h 1) (h 1)",
+        }
+        for code in testcases:
+            ast = ASTGenerator(code).generate_ast()
+            got = Inliner(ast, ConstantFolder(ast).shadowed).inline()
+            expected = ASTGenerator(testcases[code]).generate_ast()
+            if(got != expected):
+                raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{got}\n-------\nexpected:\n{expected}")
+        # Calls to a defined lambda jump straight to it, once the program is linked
+        code = "(f 1) (define f (lambda (x) (f x)))"
+        (constants, main, procedures) = Compiler(ASTGenerator(code).generate_ast(), ()).compile()
+        if(main[3] != (OppCodes.call_direct, (0, 0))):
+            raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{main}")
+
+    def subexpression_test(self):
+        testcases = {
+            # Computed by the test, so reused in both branches and after the if
+            "(lambda (x) (if (pair? x) (pair? x) (pair? x)) (pair? x))": 3,
+            # Only computed in one of the branches
+            "(lambda (x) (if x (car x) (cdr x)) (car x))": 0,
+            # x is set!, and the other x is a different variable
+            "(lambda (x) (set! x (cdr x)) (car x) (car x))": 0,
+            "(lambda (x) (car x) (let ((x 1)) (car x)))": 0,
+        }
+        for code in testcases:
+            folder = ConstantFolder(ASTGenerator(code).generate_ast())
+            eliminator = SubexpressionEliminator(folder.fold(), folder.shadowed)
+            eliminator.eliminate()
+            if(eliminator.eliminated != testcases[code]):
+                raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{eliminator.eliminated} eliminated\n-------\nexpected:\n{testcases[code]}")
+        # The temporaries hold numbers once they are set to one, the checks the reused calls did are kept
+        O = OppCodes
+        testcases = {
+            "(lambda (x) (if (< x 0) 0 (+ (* x x) (* x x))))": [O.prim_lt, O.unchecked_mul, O.unchecked_add],
+            "(lambda (x) (+ (car x) (car x)))": [O.prim_add],
+        }
+        for code in testcases:
+            folder = ConstantFolder(ASTGenerator(code).generate_ast())
+            eliminator = SubexpressionEliminator(folder.fold(), folder.shadowed)
+            (constants, main, procedures) = Compiler(eliminator.eliminate(), folder.shadowed).compile()
+            got = [opp for (opp, _) in procedures[0][1] if opp in Compiler.unchecked_operations or opp in Compiler.unchecked_operations.values()]
+            if(got != testcases[code]):
+                raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{got}\n-------\nexpected:\n{testcases[code]}")
+
+    def peephole_test(self):
+        O = OppCodes
+        testcases = [
+            # A branch to a ret is a ret, what follows it is unreachable
+            ([(O.branch, 0), (O.global_get, 0), (O.label, 0), (O.ret, None)],
+             [(O.ret, None)]),
+            # Jumps to a branch are threaded, the jump to the next instruction is removed
+            ([(O.if_false_branch, 0), (O.global_get, 0), (O.branch, 2), (O.label, 0), (O.branch, 1), (O.global_get, 1), (O.label, 1), (O.global_get, 2), (O.label, 2), (O.ext, None)],
+             [(O.if_false_branch, 1), (O.global_get, 0), (O.branch, 2), (O.label, 1), (O.global_get, 2), (O.label, 2), (O.ext, None)]),
+            # A load that is replaced right away, and an unbind after a ret
+            ([(O.load_const, 3), (O.global_get, 0), (O.ret, None), (O.unbind, None), (O.proc_end, None)],
+             [(O.global_get, 0), (O.ret, None), (O.proc_end, None)]),
+        ]
+        for (instructions, expected) in testcases:
+            got = PeepholeOptimizer().optimize(instructions)
+            if(got != expected):
+                raise AssertionError(f"\nfor instructions:\n{instructions}\n-------\ngot:\n{got}\n-------\nexpected:\n{expected}")
+
+    def fusion_test(self):
+        O = OppCodes
+        testcases = [
+            ([(O.lookup_local, (0, 1)), (O.push, None), (O.load_const, 3), (O.push, None), (O.prim_lt, None), (O.if_false_branch, 0)],
+             [(O.lookup_push, (0, 1)), (O.const_push, 3), (O.branch_if_not, (O.prim_lt, 0))]),
+            ([(O.lookup_local, (1, 0)), (O.apply, None), (O.rebind, 2), (O.branch, 4), (O.prim_add, 2), (O.if_false_branch, 1)],
+             [(O.lookup_apply, (1, 0)), (O.rebind_branch, (2, 4)), (O.prim_add, 2), (O.if_false_branch, 1)]),
+            # Something can jump to the instruction after a label
+            ([(O.load_const, 3), (O.label, 0), (O.push, None)],
+             [(O.load_const, 3), (O.label, 0), (O.push, None)]),
+        ]
+        for (instructions, expected) in testcases:
+            got = InstructionFuser().fuse(instructions)
+            if(got != expected):
+                raise AssertionError(f"\nfor instructions:\n{instructions}\n-------\ngot:\n{got}\n-------\nexpected:\n{expected}")
+
+    def ir_test(self):
+        O = OppCodes
+        # An and in the test of an if loads a constant and jumps to a test of it
+        instructions = [(O.bind, 1), (O.lookup_local, (0, 0)), (O.if_false_branch, 0), (O.load_const, 1), (O.branch, 1), (O.label, 0),
+                        (O.load_const, 0), (O.label, 1), (O.if_false_branch, 2), (O.load_const, 3), (O.ret, None), (O.label, 2),
+                        (O.set_local, (0, 0)), (O.load_const, 4), (O.ret, None), (O.proc_end, None)]
+        program = IRProgram([(O.ext, None)], [(0, instructions)])
+        if(program.program() != ([(O.ext, None)], [(0, instructions)])):
+            raise AssertionError(f"\nfor instructions:\n{instructions}\n-------\ngot:\n{program.program()}")
+        blocks = [(block.labels, block.successors, block.uses, block.defs) for block in program.procedures[0].blocks]
+        expected = [([], [2, 1], {("local", 0, 0)}, set()), ([], [3], set(), set()), ([0], [3], set(), set()), ([1], [5, 4], set(), set()),
+                    ([], [], set(), set()), ([2], [], set(), {("local", 0, 0)}), ([], [], set(), set())]
+        if(blocks != expected):
+            raise AssertionError(f"\nfor instructions:\n{instructions}\n-------\ngot blocks:\n{blocks}\n-------\nexpected:\n{expected}")
+        # Only the passes of the level run, the tests of the constants are skipped and left unreachable
+        expected = [(O.bind, 1), (O.lookup_local, (0, 0)), (O.if_false_branch, 0), (O.load_const, 1), (O.branch, 3), (O.label, 0),
+                    (O.load_const, 0), (O.branch, 2), (O.label, 3), (O.load_const, 3), (O.ret, None), (O.label, 2),
+                    (O.set_local, (0, 0)), (O.load_const, 4), (O.ret, None), (O.proc_end, None)]
+        for level in range(3):
+            control_flow = ControlFlowOptimizer()
+            passes = PassManager(level)
+            passes.register("jump threading", 2, control_flow.thread_jumps)
+            passes.register("unreachable blocks", 2, control_flow.remove_unreachable)
+            got = passes.run([(O.ext, None)], [(0, instructions)]).program()[1][0][1]
+            if(got != (expected if level == 2 else instructions) or len(passes.timings()) != (2 if level == 2 else 0)):
+                raise AssertionError(f"\nat level {level} for instructions:\n{instructions}\n-------\ngot:\n{got}")
+
+    def constant_pool_test(self):
+        testcases = {
+            "1 1 2 1": 2,
+            '"a" (quote a) "a" (quote a)': 2,
+            "(quote (a b)) (quote (a b))": 4,
+            # (b c) is shared by both lists
+            "(quote (a b c)) (quote (x b c))": 8,
+            "(quote ((1 2) (1 2)))": 6,
+            "0 -0": 2,
+        }
+        for code in testcases:
+            (constants, main, procedures) = Compiler(ASTGenerator(code).generate_ast()).compile()
+            if(len(constants) != testcases[code]):
+                raise AssertionError(f"\nfor code:\n{code}\n-------\ngot {len(constants)} constants, expected {testcases[code]}\n{constants}")
+
+    def parallel_test(self):
+        code = "".join(f'(define f{i} (lambda (x) (if (< x {i}) (quote (a "b" ({i}))) (f{i} (- x 1)))))\n(f{i} {i})\n' for i in range(200))
+        # Unused defines, and ones only used by them, are removed over the whole file
+        code += "".join(f'(define unused{i} (lambda (x) (* x {i})))\n(define helper{i} (quote ({i})))\n(define g{i} (lambda () helper{i}))\n' for i in range(20))
+        code += "(display (* 2 (- 10 4)))\n(set! f3 f4)\n(define square (lambda (x) (* x x)))\n(display (square 3))\n"
+        # The same passes as a serial compile from the command line
+        ast = ASTGenerator(code).generate_ast()
+        folder = ConstantFolder(ast)
+        Inliner(ast, folder.shadowed).inline()
+        dead = DeadCodeEliminator(folder.fold())
+        eliminator = SubexpressionEliminator(dead.eliminate(), folder.shadowed)
+        compiler = Compiler(eliminator.eliminate(), folder.shadowed)
+        serial = Assembler(*compiler.compile(), global_names=compiler.global_names).assemble()
+        for jobs in [2, 3]:
+            compiler = ParallelCompiler(code, jobs)
+            parallel = Assembler(*compiler.compile(), global_names=compiler.global_names).assemble()
+            if(parallel != serial or compiler.removed != dead.removed):
+                raise AssertionError(f"\nparallel compile with {jobs} jobs differs from the serial compile")
+
+    def profile_test(self):
+        O = OppCodes
+        # The points are identified by where their expression starts in the file
+        code = "(define f (lambda (x) (if (< x 1) x (g x))))"
+        (procedure, test, call) = (code.index("(lambda"), code.index("(if"), code.index("(g x)"))
+        compiler = Compiler(ASTGenerator(code).generate_ast(), (), profile_points=True)
+        assembled = Assembler(*compiler.compile(), global_names=compiler.global_names, profile_table=True).assemble()
+        # The table is at the end, every point is its kind, the address of its instruction and its id
+        table = assembled[-4 - 9 * 3:]
+        points = [(table[i], assembled[int.from_bytes(table[i + 1:i + 5], "little")], int.from_bytes(table[i + 5:i + 9], "little")) for i in range(4, len(table), 9)]
+        expected = [(ProfileKinds.procedure.value, O.bind.value, procedure), (ProfileKinds.branch.value, O.if_false_branch.value, test),
+                    (ProfileKinds.call.value, O.apply.value, call)]
+        if(int.from_bytes(table[:4], "little") != 3 or points != expected):
+            raise AssertionError(f"\nfor code:\n{code}\n-------\ngot points:\n{points}\n-------\nexpected:\n{expected}")
+        # The test is mostly false, so in tail position the alternative is placed first
+        profile = Profile()
+        profile.read([f"branch {test} 1 9"])
+        (constants, main, procedures) = Compiler(ASTGenerator(code).generate_ast(), (), profile).compile()
+        expected = [(O.if_true_branch, 0), (O.lookup_local, (0, 0)), (O.push, None), (O.global_get, 1), (O.apply, None)]
+        if(procedures[0][1][6:11] != expected):
+            raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{procedures[0][1]}\n-------\nexpected to start the arms with:\n{expected}")
+        # Only the hot call inlines a procedure larger than the inline size
+        code = "(define f (lambda (x) (+ x x x x x x x x x x x x x x x x))) (f 1) (f 2)"
+        profile.read([f"call {code.index('(f 1)')} 0 1", f"call {code.index('(f 2)')} 0 99"])
+        ast = ASTGenerator(code).generate_ast()
+        inliner = Inliner(ast, (), profile=profile)
+        inliner.inline()
+        if(not isinstance(ast[1], SProcApplication) or not isinstance(ast[2], SLet) or inliner.hot_inlined != 1):
+            raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{ast}")
+        # The procedures called most often come first
+        code = "(define a (lambda () 1)) (define b (lambda () 2))"
+        profile.read([f"procedure {code.index('(lambda () 2)')} 5"])
+        (constants, main, procedures) = Compiler(ASTGenerator(code).generate_ast(), (), profile).compile()
+        if([uid for (uid, ins) in procedures] != [1, 0]):
+            raise AssertionError(f"\nfor code:\n{code}\n-------\ngot procedures in the order:\n{procedures}")
+
+    def register_test(self):
+        O = OppCodes
+        # The argument and the loop variables are registers of the single frame of the procedure, the loop reads
+        # all of its arguments before it replaces the variables
+        code = "(define f (lambda (x) (let loop ((a 0) (b x)) (if (= b 0) a (loop b (- b 1))))))"
+        compiler = RegisterCompiler(ASTGenerator(code).generate_ast(), ())
+        (constants, main, procedures) = compiler.compile()
+        expected = [(O.reg_enter, (5, 1)), (O.reg_move, (2, 0)), (O.reg_const, (1, 3)), (O.label, 0), (O.reg_const, (3, 3)),
+                    (O.reg_branch_if_not, (O.prim_num_eq, (2, 3), 1)), (O.reg_ret, 1), (O.label, 1), (O.reg_const, (4, 4)),
+                    (O.reg_prim, (O.unchecked_sub, 3, (2, 4))), (O.reg_loop, (1, (2, 3), 0)), (O.proc_end, None)]
+        if(procedures != [(0, expected)]):
+            raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{procedures}\n-------\nexpected:\n{expected}")
+        # The arguments are evaluated last to first, the value of the last one is copied before the first one
+        # sets the variable
+        code = "(define g (lambda (x) (f (set! x 2) (begin (set! x 1) x))))"
+        (constants, main, procedures) = RegisterCompiler(ASTGenerator(code).generate_ast(), ()).compile()
+        if(procedures[0][1][2:] != [(O.reg_move, (1, 0)), (O.reg_const, (0, 4)), (O.reg_move, (2, 0)),
+                                    (O.reg_tail_call_global, (1, (2, 1))), (O.proc_end, None)]):
+            raise AssertionError(f"\nfor code:\n{code}\n-------\ngot:\n{procedures}")
+        Assembler(*compiler.compile(), global_names=compiler.global_names).assemble()
+
+    def dead_code_test(self):
+        # Only the defines of lambdas and constants that no used expression refers to are removed, a define with
+        # side effects and a variable defined twice are kept
+        code = ('(define a (lambda () (b))) (define b (lambda () 1)) (define c (lambda () (d))) (define d 2) '
+                '(define e (display 3)) (define f 4) (define f 5) (c)')
+        eliminator = DeadCodeEliminator(ASTGenerator(code).generate_ast())
+        kept = [exp.var.value for exp in eliminator.eliminate() if isinstance(exp, SDefine)]
+        if(kept != ["c", "d", "e", "f", "f"] or eliminator.removed != ["a", "b"] or eliminator.lambdas != 2):
+            raise AssertionError(f"\nfor code:\n{code}\n-------\ngot defines:\n{kept}\n-------\nremoved:\n{eliminator.removed}")
+
 if __name__ == "__main__":
     tester = CompilerTester()
     print("Testing ASTGenerator")
     tester.astgenerator_test()
+    print("Testing deeply nested code")
+    tester.deep_nesting_test()
+    print("Testing streaming compile")
+    tester.streaming_test()
+    print("Testing constant folding")
+    tester.constant_folding_test()
+    print("Testing lexical addressing")
+    tester.lexical_addressing_test()
+    print("Testing primitive operations")
+    tester.primitive_test()
+    print("Testing self tail calls")
+    tester.loop_test()
+    print("Testing named let and do loops")
+    tester.named_let_test()
+    print("Testing inlining")
+    tester.inlining_test()
+    print("Testing common subexpression elimination")
+    tester.subexpression_test()
+    print("Testing the peephole optimizer")
+    tester.peephole_test()
+    print("Testing superinstructions")
+    tester.fusion_test()
+    print("Testing the IR and the pass manager")
+    tester.ir_test()
+    print("Testing the constant pool")
+    tester.constant_pool_test()
+    print("Testing parallel compilation")
+    tester.parallel_test()
+    print("Testing profile guided optimization")
+    tester.profile_test()
+    print("Testing register based code")
+    tester.register_test()
+    print("Testing dead code elimination")
+    tester.dead_code_test()
     print("Testing Compiler")
     tester.compilertest()
\ No newline at end of file
@@ -0,0 +1,228 @@
+from expressions import *
+import functools
+import math
+
+
+def modulo(a, b):
+    """The modulo built in of the VM, which converts both arguments to int and uses the C++ % operator
+
+    Raises:
+        ZeroDivisionError: When b is 0
+        OverflowError: When an argument does not fit in an int
+    """
+    (a, b) = (int(a), int(b))
+    for num in (a, b):
+        if(num < -2 ** 31 or num >= 2 ** 31):
+            raise OverflowError("modulo argument does not fit in an int")
+    # C++ truncates towards zero, so the result has the sign of a
+    return float(math.fmod(a, b))
+
+
+def fold_left(func, unary, empty=None):
+    """An arithmetic built in that accepts any number of arguments, folding them from the left like the VM does
+
+    Args:
+        func (function): The operation on two numbers
+        unary (function): The operation with one argument
+        empty (float, optional): The result with no arguments. Defaults to None.
+
+    Returns:
+        function: The built in
+    """
+    def built_in(*args):
+        if(len(args) == 0):
+            return empty
+        if(len(args) == 1):
+            return unary(args[0])
+        return functools.reduce(func, args)
+    return built_in
+
+
+class ConstantFolder:
+
+    # The names of all the built ins of the VM
+    built_ins = ["+", "-", "*", "/", "%", "=", "<", ">", "<=", ">=", "cons", "car", "cdr", "number?", "string?",
+                 "pair?", "symbol?", "eq?", "equal?", "display"]
+
+    # The built ins that can be evaluated at compile time, with the number of arguments they accept. They
+    # compute the same doubles as the built ins of the VM
+    foldable_built_ins = {
+        "+": (range(256), fold_left(lambda a, b: a + b, lambda a: a, 0.0)),
+        "-": (range(1, 256), fold_left(lambda a, b: a - b, lambda a: -a)),
+        "*": (range(256), fold_left(lambda a, b: a * b, lambda a: a, 1.0)),
+        "/": (range(1, 256), fold_left(lambda a, b: a / b, lambda a: 1.0 / a)),
+        "%": ([2], modulo),
+        "=": ([2], lambda a, b: a == b),
+        "<": ([2], lambda a, b: a < b),
+        ">": ([2], lambda a, b: a > b),
+        "<=": ([2], lambda a, b: a <= b),
+        ">=": ([2], lambda a, b: a >= b),
+    }
+
+    # The procedures that fold (nested) expressions are generators, run by run_iteratively like the ones of
+    # ASTGenerator and Compiler
+
+    def __init__(self, ast, shadowed=()):
+        """ConstantFolder constructor
+
+        Args:
+            ast (List<SExpression>): The AST to fold
+            shadowed (Iterable, optional): Variables that are assigned outside of ast, see find_assigned_variables. Defaults to ().
+        """
+        self.ast = ast
+        # The variables whose value can change, built ins among them are never folded
+        self.assigned = self.find_assigned_variables()
+        self.shadowed = self.assigned | set(shadowed)
+        # The number of nodes that were folded away
+        self.folded = 0
+        # The built ins that were folded, the folding is only valid if they are not assigned anywhere
+        self.assumed = set()
+
+
+    def find_assigned_variables(self):
+        """Find the built ins that are the target of a define, and the variables that are the target of a set!
+        anywhere in the AST
+
+        Returns:
+            set: The names of the variables
+        """
+        assigned = set()
+        stack = list(self.ast)
+        while(len(stack) != 0):
+            exp = stack.pop()
+            if(isinstance(exp, SDefine)):
+                if(exp.var.value in self.built_ins):
+                    assigned.add(exp.var.value)
+                stack.append(exp.expression)
+            elif(isinstance(exp, SSet)):
+                assigned.add(exp.variable.value)
+                stack.append(exp.expression)
+            elif(isinstance(exp, SIf)):
+                stack += [exp.test, exp.consequent, exp.alternative]
+            elif(isinstance(exp, SProcApplication)):
+                stack.append(exp.operator)
+                stack += exp.operands
+            elif(isinstance(exp, SLambda)):
+                stack += exp.body
+            elif(isinstance(exp, SLet)):
+                stack += [binding[1] for binding in exp.var_bindings]
+                stack += exp.body
+            elif(isinstance(exp, (SAnd, SOr, SBegin))):
+                stack += exp.expressions
+        return assigned
+
+
+    def bind(self, bound, variables):
+        """The built ins shadowed inside a lambda or let that binds variables
+
+        Args:
+            bound (frozenset): The built ins shadowed outside of the lambda or let
+            variables (List<SVariable>): The variables it binds
+
+        Returns:
+            frozenset: The built ins shadowed inside
+        """
+        names = {var.value for var in variables} & self.foldable_built_ins.keys()
+        if(len(names) == 0):
+            return bound
+        return bound | names
+
+
+    def evaluate(self, expression, bound):
+        """Evaluate a call to a built in if all its arguments are numbers
+
+        Args:
+            expression (SProcApplication): The call, with its operator and operands already folded
+            bound (frozenset): The built ins shadowed by an enclosing lambda or let
+
+        Returns:
+            SConstant: The result of the call, None if it can not be evaluated at compile time
+        """
+        if(not isinstance(expression.operator, SVariable)):
+            return None
+        name = expression.operator.value
+        if(name not in self.foldable_built_ins or name in bound or name in self.shadowed):
+            return None
+        (arg_counts, func) = self.foldable_built_ins[name]
+        if(len(expression.operands) not in arg_counts):
+            return None
+        for operand in expression.operands:
+            if(not isinstance(operand, SNumber)):
+                return None
+        try:
+            result = func(*[operand.value for operand in expression.operands])
+        except (ZeroDivisionError, OverflowError, ValueError):
+            # Leave it for the VM to fail on
+            return None
+        self.assumed.add(name)
+        if(isinstance(result, bool)):
+            return SBool("#t" if result else "#f")
+        return SNumber(result)
+
+
+    def fold_sequence(self, sequence, bound):
+        """Fold a list of expressions in place
+
+        Args:
+            sequence (List<SExpression>): The expressions to fold
+            bound (frozenset): The built ins shadowed by an enclosing lambda or let
+        """
+        for i in range(len(sequence)):
+            sequence[i] = yield self.fold_expression(sequence[i], bound)
+
+
+    def fold_expression(self, expression, bound):
+        """Fold an expression and the expressions nested in it
+
+        Args:
+            expression (SExpression): The expression to fold
+            bound (frozenset): The built ins shadowed by an enclosing lambda or let
+
+        Returns:
+            SExpression: The folded expression
+        """
+        if(isinstance(expression, SProcApplication)):
+            expression.operator = yield self.fold_expression(expression.operator, bound)
+            yield self.fold_sequence(expression.operands, bound)
+            result = self.evaluate(expression, bound)
+            if(result != None):
+                self.folded += 1
+                return result
+        elif(isinstance(expression, SIf)):
+            expression.test = yield self.fold_expression(expression.test, bound)
+            expression.consequent = yield self.fold_expression(expression.consequent, bound)
+            expression.alternative = yield self.fold_expression(expression.alternative, bound)
+            # Only #f is false. This also drops the #f a cond adds after its else branch
+            if(isinstance(expression.test, SConstant)):
+                taken = expression.alternative if expression.test == SBool("#f") else expression.consequent
+                # An empty begin compiles to nothing, keep the if so that the branch still produces a value
+                if(not (isinstance(taken, SBegin) and len(taken.expressions) == 0)):
+                    self.folded += 1
+                    return taken
+        elif(isinstance(expression, SLambda)):
+            yield self.fold_sequence(expression.body, self.bind(bound, expression.bound_var_list))
+        elif(isinstance(expression, SLet)):
+            for i in range(len(expression.var_bindings)):
+                (var, exp) = expression.var_bindings[i]
+                expression.var_bindings[i] = (var, (yield self.fold_expression(exp, bound)))
+            variables = [x[0] for x in expression.var_bindings]
+            if(isinstance(expression, SNamedLet)):
+                variables.append(expression.name)
+            yield self.fold_sequence(expression.body, self.bind(bound, variables))
+        elif(isinstance(expression, SDefine)):
+            expression.expression = yield self.fold_expression(expression.expression, bound)
+        elif(isinstance(expression, SSet)):
+            expression.expression = yield self.fold_expression(expression.expression, bound)
+        elif(isinstance(expression, (SAnd, SOr, SBegin))):
+            yield self.fold_sequence(expression.expressions, bound)
+        return expression
+
+
+    def fold(self):
+        """Fold the AST
+
+        Returns:
+            List<SExpression>: The folded AST
+        """
+        bound = frozenset()
+        return [run_iteratively(self.fold_expression(exp, bound)) for exp in self.ast]
@@ -0,0 +1,117 @@
+from compilerir import *
+
+
+class ControlFlowOptimizer:
+
+    # The operations that leave VALUE as it is, a block made of them and a conditional jump tests the VALUE it was
+    # entered with
+    value_preserving = [OppCodes.unbind]
+
+
+    def __init__(self):
+        # The number of jumps threaded and of blocks removed by all the calls
+        self.threaded = 0
+        self.removed = 0
+
+
+    def known_test(self, graph, block, labels):
+        """Find the conditional jump a block goes to with a constant in VALUE, the ifs on ands, ors and inlined
+        predicates load #t or #f and go to a block that only tests it
+
+        Args:
+            graph (ControlFlowGraph): The graph of the block
+            block (BasicBlock): The block
+            labels (dict): {label: block_index} of the graph
+
+        Returns:
+            (BasicBlock, bool): The block with the test and whether its jump is taken, None if there is none
+        """
+        if(len(block.instructions) == 0):
+            return None
+        last = block.instructions[-1]
+        if(last[0] == OppCodes.branch and last[1] in labels):
+            (loaded, target) = (block.instructions[-2:-1], graph.blocks[labels[last[1]]])
+        elif(block.falls_through() and block.index + 1 < len(graph.blocks)):
+            (loaded, target) = (block.instructions[-1:], graph.blocks[block.index + 1])
+        else:
+            return None
+        if(len(loaded) == 0 or loaded[0][0] != OppCodes.load_const or target is block or len(target.instructions) == 0):
+            return None
+        # The profile points of the test would miss the runs that skip it
+        (test, middle) = (target.instructions[-1], target.instructions[:-1])
+        if(test[0] not in [OppCodes.if_false_branch, OppCodes.if_true_branch] or
+           any(opp not in self.value_preserving for (opp, arg) in middle)):
+            return None
+        false = loaded[0][1] == Defaults.boolean_false.value
+        return (target, false == (test[0] == OppCodes.if_false_branch))
+
+
+    def thread_graph(self, program, graph):
+        """Make the blocks that go to a test with a constant in VALUE jump straight to where the test goes
+
+        Args:
+            program (IRProgram): The program of the graph, new labels are made in it
+            graph (ControlFlowGraph): The graph, changed in place
+
+        Returns:
+            bool: Was anything threaded
+        """
+        labels = graph.block_labels()
+        changed = False
+        for block in graph.blocks:
+            known = self.known_test(graph, block, labels)
+            if(known == None):
+                continue
+            (target, taken) = known
+            if(taken):
+                label = target.instructions[-1][1]
+            elif(target.index + 1 < len(graph.blocks)):
+                following = graph.blocks[target.index + 1]
+                if(len(following.labels) == 0):
+                    following.labels.append(program.generate_label())
+                    labels[following.labels[0]] = following.index
+                label = following.labels[0]
+            else:
+                continue
+            if(block.instructions[-1][0] == OppCodes.branch):
+                block.instructions.pop()
+            block.instructions += target.instructions[:-1] + [(OppCodes.branch, label)]
+            self.threaded += 1
+            changed = True
+        if(changed):
+            graph.relink()
+        return changed
+
+
+    def thread_jumps(self, program):
+        """Thread the jumps to the tests of constants in every graph, until there are none left. The tests that
+        are no longer reached are left for remove_unreachable
+
+        Args:
+            program (IRProgram): The program, changed in place
+        """
+        for graph in program.graphs():
+            while(self.thread_graph(program, graph)):
+                pass
+
+
+    def remove_unreachable(self, program):
+        """Remove the blocks no path from the entry of their graph leads to, unlike the peephole optimizer this
+        also finds the loops that are never entered. proc_end marks the end of a procedure and is always kept
+
+        Args:
+            program (IRProgram): The program, changed in place
+        """
+        for graph in program.graphs():
+            kept = []
+            for block in graph.blocks:
+                if(block.index == 0 or block.frame_depth != None or block.instructions == [(OppCodes.proc_end, None)]):
+                    kept.append(block)
+                    continue
+                self.removed += 1
+                end = [ins for ins in block.instructions if ins[0] == OppCodes.proc_end]
+                if(len(end) != 0):
+                    kept.append(BasicBlock(block.index, [], end))
+            if(len(kept) != len(graph.blocks)):
+                graph.blocks = kept
+                graph.relink()
@@ -0,0 +1,141 @@
+from expressions import *
+from collections import Counter
+
+
+class DeadCodeEliminator:
+
+    def __init__(self, ast):
+        """DeadCodeEliminator constructor, removes the top level defines the program never uses. The program is
+        what runs the top level expressions that are not defines, a define is only used if one of them, or the
+        value of another used define, refers to its variable
+
+        Args:
+            ast (List<SExpression>): The AST of the whole program
+        """
+        self.ast = ast
+        # The names of the defines removed, in the order they were in the program, and the number of lambdas
+        # they held including the nested ones
+        self.removed = []
+        self.lambdas = 0
+
+
+    def removable(self, expression):
+        """Check if a top level expression is a define that can be removed when its variable is not used. The
+        value has to have no side effects and never fail, so only lambdas and constants are
+
+        Args:
+            expression (SExpression): The top level expression
+
+        Returns:
+            boolean: True if it is a define of a lambda or a constant
+        """
+        return isinstance(expression, SDefine) and isinstance(expression.expression, (SLambda, SConstant))
+
+
+    def count_lambdas(self, expression):
+        """Count the lambdas in an expression, including the nested ones
+
+        Args:
+            expression (SExpression): The expression
+
+        Returns:
+            int: The number of lambdas
+        """
+        count = 0
+        stack = [expression]
+        while(len(stack) != 0):
+            exp = stack.pop()
+            if(isinstance(exp, SLambda)):
+                count += 1
+                stack += exp.body
+            elif(isinstance(exp, (SDefine, SSet))):
+                stack.append(exp.expression)
+            elif(isinstance(exp, SIf)):
+                stack += [exp.test, exp.consequent, exp.alternative]
+            elif(isinstance(exp, SProcApplication)):
+                stack.append(exp.operator)
+                stack += exp.operands
+            elif(isinstance(exp, SLet)):
+                stack += [binding[1] for binding in exp.var_bindings]
+                stack += exp.body
+            elif(isinstance(exp, (SAnd, SOr, SBegin))):
+                stack += exp.expressions
+        return count
+
+
+    def find_references(self):
+        """Find what the reachability of the defines depends on, the parallel compiler gathers it from every chunk
+        to decide over the whole file
+
+        Returns:
+            (List<str>, {str: [List<str>,]}): The variables referred to by the top level expressions that always
+            run, and the free variables of the value of each removable define by name. The variable a define sets
+            does not count as used by the define itself
+        """
+        roots = []
+        definitions = {}
+        for exp in self.ast:
+            if(self.removable(exp)):
+                definitions.setdefault(exp.var.value, []).append(free_variables(exp.expression))
+            else:
+                roots += free_variables(exp.expression if isinstance(exp, SDefine) else exp)
+        return (roots, definitions)
+
+
+    def remove(self, names):
+        """Remove the top level defines of the given variables
+
+        Args:
+            names (Set<str>): The variables of the unused defines
+
+        Returns:
+            List<SExpression>: The AST without the defines, the constants and lambdas only they held are gone with them
+        """
+        ast = []
+        for exp in self.ast:
+            if(isinstance(exp, SDefine) and exp.var.value in names):
+                self.removed.append(exp.var.value)
+                self.lambdas += self.count_lambdas(exp.expression)
+            else:
+                ast.append(exp)
+        return ast
+
+
+    def eliminate(self):
+        """Remove the defines whose variable no used expression refers to
+
+        Returns:
+            List<SExpression>: The AST without the unused defines, the constants and lambdas only they held are gone with them
+        """
+        defined = Counter(exp.var.value for exp in self.ast if isinstance(exp, SDefine))
+        return self.remove(unused_definitions(*self.find_references(), defined))
+
+
+def unused_definitions(roots, definitions, defined):
+    """Follow the references from the expressions that always run to find the removable defines never used. A
+    variable that is defined more than once at the top level keeps all its defines, redefining a variable is an
+    error of the VM
+
+    Args:
+        roots (List<str>): The variables referred to by the top level expressions that always run
+        definitions ({str: [List<str>,]}): The free variables of the value of each removable define by name
+        defined (Counter<str>): The number of top level defines of each variable
+
+    Returns:
+        Set<str>: The variables whose defines can be removed
+    """
+    candidates = {name: references for (name, references) in definitions.items() if defined[name] == 1}
+    stack = list(roots)
+    for (name, references) in definitions.items():
+        if(name not in candidates):
+            for variables in references:
+                stack += variables
+    used = set()
+    while(len(stack) != 0):
+        name = stack.pop()
+        if(name in used):
+            continue
+        used.add(name)
+        for variables in candidates.get(name, []):
+            stack += variables
+    return set(candidates) - used
@@ -2,17 +2,45 @@
 class SError(Exception):
     pass
 
+def run_iteratively(procedure):
+    """Run a recursive procedure without growing the python stack, so that deeply nested expressions can be
+    processed. The procedure is written as a generator: instead of calling itself it yields the generator of the
+    call it wants to make, and is sent the return value of that call once the call finishes.
+
+    Args:
+        procedure (generator): The outermost call of the procedure
+
+    Returns:
+        Any: The return value of the outermost call
+    """
+    calls = [procedure]
+    value = None
+    while(len(calls) != 0):
+        try:
+            call = calls[-1].send(value)
+            calls.append(call)
+            value = None
+        except StopIteration as ret:
+            calls.pop()
+            value = ret.value
+    return value
+
+# The nodes use __slots__ instead of a per instance __dict__, large programs have millions of them. The loc of
+# lambdas, ifs and procedure applications is the index in the source file of the ( they start with, it is what
+# identifies them in a profile. It is None for the ones made by the passes, and is not compared by __eq__
+
 class Expression:
-    def __init__(self):
-        self.tail = None
+    __slots__ = ()
 
 class SConstant(Expression):
-    pass
+    __slots__ = ()
 
 class SSpecialForm(Expression):
-    pass
+    __slots__ = ()
 
 class SNumber(SConstant):
+    __slots__ = ("value",)
+
     def __init__(self, num):
         super().__init__()
         if(type(num) != float):
@@ -28,6 +56,8 @@ class SNumber(SConstant):
         return str(self.value)
 
 class SString(SConstant):
+    __slots__ = ("value",)
+
     def __init__(self, string):
         super().__init__()
         if(type(string) != str):
@@ -43,6 +73,8 @@ class SString(SConstant):
         return str(self.value)
     
 class SSymbol(SConstant):
+    __slots__ = ("value",)
+
     def __init__(self, string):
         super().__init__()
         if(type(string) != str):
@@ -58,6 +90,8 @@ class SSymbol(SConstant):
         return "'" + self.value
 
 class SBool(SConstant):
+    __slots__ = ("value",)
+
     def __init__(self, boolean):
         super().__init__()
         if(type(boolean) != str):
@@ -78,6 +112,8 @@ class SBool(SConstant):
         return str(self.value)
 
 class SVariable(Expression):
+    __slots__ = ("value",)
+
     def __init__(self, string):
         super().__init__()
         if(type(string) != str):
@@ -93,9 +129,10 @@ class SVariable(Expression):
         return str(self.value)
     
 class SEmptyList(SConstant):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
-        pass
     
     def __eq__(self, other):
         return type(self) == type(other)
@@ -104,6 +141,8 @@ class SEmptyList(SConstant):
         return "()"
 
 class SConstList(SConstant):
+    __slots__ = ("consts",)
+
     def __init__(self, consts):
         super().__init__()
         self.consts = consts
@@ -122,6 +161,8 @@ class SConstList(SConstant):
         return "(SList: " + str(self.consts) + ")"
 
 class SDefine(SSpecialForm):
+    __slots__ = ("var", "expression")
+
     def __init__(self, var, expression):
         super().__init__()
         if(not isinstance(var, SVariable)):
@@ -144,6 +185,8 @@ class SDefine(SSpecialForm):
         return "(SDefine: " + str(self.var) + " " + str(self.expression) + ")"
 
 class SLet(SSpecialForm):
+    __slots__ = ("var_bindings", "body")
+
     def __init__(self, var_bindings, body):
         super().__init__()
         for var_binding in var_bindings:
@@ -175,8 +218,27 @@ class SLet(SSpecialForm):
     def __repr__(self):
         return "(SLet: VarBindings: " + str(self.var_bindings) + " Body: " + str(self.body) + ")"
         
+class SNamedLet(SLet):
+    __slots__ = ("name",)
+
+    def __init__(self, name, var_bindings, body):
+        super().__init__(var_bindings, body)
+        if(not isinstance(name, SVariable)):
+            raise SError("SNamedLet: the name of the loop is not a variable")
+        self.name = name
+
+    def __eq__(self, other):
+        if(not super().__eq__(other)):
+            return False
+        return self.name == other.name
+
+    def __repr__(self):
+        return "(SNamedLet: " + str(self.name) + " VarBindings: " + str(self.var_bindings) + " Body: " + str(self.body) + ")"
+
 class SIf(SSpecialForm):
-    def __init__(self, test, consequent, alternative):
+    __slots__ = ("test", "consequent", "alternative", "loc")
+
+    def __init__(self, test, consequent, alternative, loc=None):
         super().__init__()
         if(not isinstance(test, Expression)):
             raise SError("SIf: test is not an instance of Expression")
@@ -187,6 +249,7 @@ class SIf(SSpecialForm):
         self.test = test
         self.consequent = consequent
         self.alternative = alternative
+        self.loc = loc
     
     def __eq__(self, other):
         if(type(self) != type(other)):
@@ -203,7 +266,9 @@ class SIf(SSpecialForm):
         return "(SIf " + str(self.test) + " " + str(self.consequent) + " " + str(self.alternative) +  ")"
 
 class SProcApplication(Expression):
-    def __init__(self, operator, operands):
+    __slots__ = ("operator", "operands", "loc")
+
+    def __init__(self, operator, operands, loc=None):
         super().__init__()
         if(not isinstance(operator, Expression)):
             raise SError("SProcApplication: operator is not an instance of Expression")
@@ -214,6 +279,7 @@ class SProcApplication(Expression):
                 raise SError("SProcApplication: operand is not an instance of Expression")
         self.operator = operator
         self.operands = operands
+        self.loc = loc
         
     def __eq__(self, other):
         if(type(self) != type(other)):
@@ -231,8 +297,10 @@ class SProcApplication(Expression):
         return "(SProcApplication " + str(self.operator) + " " + str(self.operands) + ")"
         
 class SLambda(SSpecialForm):
+    __slots__ = ("bound_var_list", "body", "loc")
+
     # Maybe add a check so that we can't add variable list that contains duplicates
-    def __init__(self, bound_var_list, body):
+    def __init__(self, bound_var_list, body, loc=None):
         super().__init__()
         for var in bound_var_list:
             if(not isinstance(var, SVariable)):
@@ -242,6 +310,7 @@ class SLambda(SSpecialForm):
             if(not isinstance(exp, Expression)):
                 raise SError("SLambda: body is not a list of expressions")
         self.body = body
+        self.loc = loc
         
     def __eq__(self, other):
         if(type(self) != type(other)):
@@ -262,6 +331,8 @@ class SLambda(SSpecialForm):
         return "(SLambda " + str(self.bound_var_list) + " " + str(self.body) + ")"
 
 class SAnd(SSpecialForm):
+    __slots__ = ("expressions",)
+
     def __init__(self, expressions):
         super().__init__()
         for var in expressions:
@@ -283,6 +354,8 @@ class SAnd(SSpecialForm):
         return "(SAnd " + str(self.expressions) + ")"
 
 class SOr(SSpecialForm):
+    __slots__ = ("expressions",)
+
     def __init__(self, expressions):
         super().__init__()
         for var in expressions:
@@ -304,6 +377,8 @@ class SOr(SSpecialForm):
         return "(SOr " + str(self.expressions) + ")"
 
 class SSet(SSpecialForm):
+    __slots__ = ("variable", "expression")
+
     def __init__(self, variable, expression):
         super().__init__()
         if(not isinstance(variable, SVariable)):
@@ -326,6 +401,8 @@ class SSet(SSpecialForm):
         return "(SSet " + str(self.variable) + " " + str(self.expression) + ")"
 
 class SBegin(SSpecialForm):
+    __slots__ = ("expressions",)
+
     def __init__(self, expressions):
         super().__init__()
         for var in expressions:
@@ -344,4 +421,130 @@ class SBegin(SSpecialForm):
         return True
 
     def __repr__(self):
-        return "(SBegin " + str(self.expressions) + ")"
\ No newline at end of file
+        return "(SBegin " + str(self.expressions) + ")"
+
+
+def free_variables(expression):
+    """Find the variables an expression refers to that it does not bind itself
+
+    Args:
+        expression (SExpression): The expression
+
+    Returns:
+        List<str>: The names of the variables, in the order they are first found
+    """
+    free = {}
+    stack = [(expression, frozenset())]
+    while(len(stack) != 0):
+        (exp, bound) = stack.pop()
+        if(isinstance(exp, SVariable)):
+            if(exp.value not in bound):
+                free[exp.value] = None
+        elif(isinstance(exp, SDefine)):
+            free[exp.var.value] = None
+            stack.append((exp.expression, bound))
+        elif(isinstance(exp, SSet)):
+            stack += [(exp.expression, bound), (exp.variable, bound)]
+        elif(isinstance(exp, SIf)):
+            stack += [(exp.alternative, bound), (exp.consequent, bound), (exp.test, bound)]
+        elif(isinstance(exp, SProcApplication)):
+            stack += [(x, bound) for x in reversed([exp.operator] + exp.operands)]
+        elif(isinstance(exp, SLambda)):
+            inner = bound | {var.value for var in exp.bound_var_list}
+            stack += [(x, inner) for x in reversed(exp.body)]
+        elif(isinstance(exp, SLet)):
+            inner = bound | {binding[0].value for binding in exp.var_bindings}
+            if(isinstance(exp, SNamedLet)):
+                inner = inner | {exp.name.value}
+            stack += [(x, inner) for x in reversed(exp.body)]
+            stack += [(binding[1], bound) for binding in reversed(exp.var_bindings)]
+        elif(isinstance(exp, (SAnd, SOr, SBegin))):
+            stack += [(x, bound) for x in reversed(exp.expressions)]
+    return list(free)
+
+
+def assigned_variables(expressions):
+    """Find the variables that are set! in a list of expressions
+
+    Args:
+        expressions (List<SExpression>): The expressions
+
+    Returns:
+        set: The names of the variables
+    """
+    assigned = set()
+    stack = list(expressions)
+    while(len(stack) != 0):
+        exp = stack.pop()
+        if(isinstance(exp, SSet)):
+            assigned.add(exp.variable.value)
+            stack.append(exp.expression)
+        elif(isinstance(exp, SDefine)):
+            stack.append(exp.expression)
+        elif(isinstance(exp, SIf)):
+            stack += [exp.test, exp.consequent, exp.alternative]
+        elif(isinstance(exp, SProcApplication)):
+            stack.append(exp.operator)
+            stack += exp.operands
+        elif(isinstance(exp, SLambda)):
+            stack += exp.body
+        elif(isinstance(exp, SLet)):
+            stack += [binding[1] for binding in exp.var_bindings]
+            stack += exp.body
+        elif(isinstance(exp, (SAnd, SOr, SBegin))):
+            stack += exp.expressions
+    return assigned
+
+
+def loop_calls(name, arity, body):
+    """Find the calls to the name of a named let in its body. It is compiled as a loop when all of them are
+    calls in tail position with one argument per variable, and the name is not used in any other way
+
+    Args:
+        name (str): The name of the named let
+        arity (int): The number of variables it binds
+        body (List<SExpression>): The body of the named let
+
+    Returns:
+        List<SProcApplication>: The calls, None if the name is used in another way
+    """
+    calls = []
+    # (expression, is the expression in tail position of the body)
+    stack = [(exp, False) for exp in body[:-1]] + [(exp, True) for exp in body[-1:]]
+    while(len(stack) != 0):
+        (exp, tail) = stack.pop()
+        if(isinstance(exp, SVariable)):
+            if(exp.value == name):
+                return None
+        elif(isinstance(exp, SProcApplication)):
+            if(isinstance(exp.operator, SVariable) and exp.operator.value == name):
+                if(not tail or len(exp.operands) != arity):
+                    return None
+                calls.append(exp)
+            else:
+                stack.append((exp.operator, False))
+            stack += [(x, False) for x in exp.operands]
+        elif(isinstance(exp, SIf)):
+            stack += [(exp.test, False), (exp.consequent, tail), (exp.alternative, tail)]
+        elif(isinstance(exp, SBegin)):
+            stack += [(x, False) for x in exp.expressions[:-1]] + [(x, tail) for x in exp.expressions[-1:]]
+        elif(isinstance(exp, (SAnd, SOr))):
+            stack += [(x, False) for x in exp.expressions]
+        elif(isinstance(exp, SLet)):
+            stack += [(binding[1], False) for binding in exp.var_bindings]
+            inner = {binding[0].value for binding in exp.var_bindings}
+            if(isinstance(exp, SNamedLet)):
+                inner.add(exp.name.value)
+            # A nested loop ends where the named let does, so its tail calls to name jump out of it
+            if(name not in inner):
+                stack += [(x, False) for x in exp.body[:-1]] + [(x, tail) for x in exp.body[-1:]]
+        elif(isinstance(exp, SLambda)):
+            if(name in free_variables(exp)):
+                return None
+        elif(isinstance(exp, SSet)):
+            if(exp.variable.value == name):
+                return None
+            stack.append((exp.expression, False))
+        elif(isinstance(exp, SDefine)):
+            stack.append((exp.expression, False))
+    return calls
@@ -0,0 +1,188 @@
+from expressions import *
+import copy
+
+
+class Inliner:
+
+    # The procedures that inline (nested) expressions are generators, run by run_iteratively like the ones of
+    # ConstantFolder and Compiler
+
+    def __init__(self, ast, shadowed=(), max_size=12, procedures=None, profile=None, hot_size=None):
+        """Inliner constructor
+
+        Args:
+            ast (List<SExpression>): The AST to inline calls in, it is changed in place
+            shadowed (Iterable, optional): The variables that are set! anywhere in the program, see ConstantFolder.find_assigned_variables. Defaults to ().
+            max_size (int, optional): The largest number of nodes in the body of a procedure that is inlined, 0 to only inline lambdas that are applied right away. Defaults to 12.
+            procedures (dict, optional): The procedures to inline, see find_procedures. When None they are found in ast. Defaults to None.
+            profile (Profile, optional): The profile of an earlier run, the calls at its hot call sites inline larger procedures. Defaults to None.
+            hot_size (int, optional): The largest number of nodes in the body of a procedure that is inlined at a hot call site. Defaults to 4 * max_size.
+        """
+        self.ast = ast
+        self.shadowed = set(shadowed)
+        self.max_size = max_size
+        self.profile = profile
+        self.hot_size = 4 * max_size if hot_size == None else hot_size
+        # The largest procedure inlined at any call
+        self.size_limit = max_size if profile == None else max(max_size, self.hot_size)
+        # {name: (SLambda, free_variables)}, they are copied before the calls are inlined so that the result
+        # does not depend on the order of the definitions
+        self.procedures = self.find_procedures() if procedures == None else procedures
+        # The number of calls inlined, and how many of them are at hot call sites and would not have been
+        # inlined without the profile
+        self.inlined = 0
+        self.hot_inlined = 0
+        # The procedures that were inlined, the inlining is only valid if they are not assigned anywhere
+        self.assumed = set()
+        # The global variables that are called
+        self.calls = set()
+
+
+    def size(self, expressions, limit):
+        """Count the nodes in a list of expressions, stopping once there are more than limit
+
+        Args:
+            expressions (List<SExpression>): The expressions to count the nodes of
+            limit (int): The number of nodes to stop at
+
+        Returns:
+            int: The number of nodes, or a number larger than limit
+        """
+        count = 0
+        stack = list(expressions)
+        while(len(stack) != 0 and count <= limit):
+            exp = stack.pop()
+            count += 1
+            if(isinstance(exp, (SDefine, SSet))):
+                stack.append(exp.expression)
+            elif(isinstance(exp, SIf)):
+                stack += [exp.test, exp.consequent, exp.alternative]
+            elif(isinstance(exp, SProcApplication)):
+                stack.append(exp.operator)
+                stack += exp.operands
+            elif(isinstance(exp, SLambda)):
+                stack += exp.body
+            elif(isinstance(exp, SLet)):
+                stack += [binding[1] for binding in exp.var_bindings]
+                stack += exp.body
+            elif(isinstance(exp, (SAnd, SOr, SBegin))):
+                stack += exp.expressions
+        return count
+
+
+    def find_procedures(self):
+        """Find the procedures calls can be inlined for. They are the lambdas defined at the top level that are
+        defined only once, never set!, small enough for at least the hot call sites and do not refer to themselves
+
+        Returns:
+            dict: {name: (SLambda, free_variables)}
+        """
+        definitions = {}
+        for exp in self.ast:
+            if(isinstance(exp, SDefine)):
+                definitions.setdefault(exp.var.value, []).append(exp.expression)
+        procedures = {}
+        for (name, values) in definitions.items():
+            if(len(values) != 1 or not isinstance(values[0], SLambda) or name in self.shadowed):
+                continue
+            if(self.size(values[0].body, self.size_limit) > self.size_limit):
+                continue
+            free = set(free_variables(values[0]))
+            if(name not in free):
+                procedures[name] = (copy.deepcopy(values[0]), free)
+        return procedures
+
+
+    def inline_sequence(self, sequence, bound):
+        """Inline the calls in a list of expressions in place
+
+        Args:
+            sequence (List<SExpression>): The expressions
+            bound (frozenset): The local variables of the enclosing lambdas and lets
+        """
+        for i in range(len(sequence)):
+            sequence[i] = yield self.inline_expression(sequence[i], bound)
+
+
+    def inline_call(self, expression, bound):
+        """Inline a procedure application as a let if the operator is a lambda or a procedure to inline
+
+        Args:
+            expression (SProcApplication): The call, with its operator and operands already inlined
+            bound (frozenset): The local variables of the enclosing lambdas and lets
+
+        Returns:
+            SLet: The let that replaces the call, None if it can not be inlined
+        """
+        operator = expression.operator
+        if(isinstance(operator, SLambda)):
+            if(len(operator.bound_var_list) != len(expression.operands)):
+                return None
+            return SLet(list(zip(operator.bound_var_list, expression.operands)), operator.body)
+        if(not isinstance(operator, SVariable) or operator.value in bound):
+            return None
+        self.calls.add(operator.value)
+        if(operator.value not in self.procedures):
+            return None
+        (procedure, free) = self.procedures[operator.value]
+        # The body has to mean the same thing where it is inlined
+        if(len(procedure.bound_var_list) != len(expression.operands) or len(free & bound) != 0):
+            return None
+        if(self.size_limit > self.max_size and self.size(procedure.body, self.max_size) > self.max_size):
+            if(expression.loc not in self.profile.hot_sites):
+                return None
+            self.hot_inlined += 1
+        self.assumed.add(operator.value)
+        procedure = copy.deepcopy(procedure)
+        return SLet(list(zip(procedure.bound_var_list, expression.operands)), procedure.body)
+
+
+    def inline_expression(self, expression, bound):
+        """Inline the calls in an expression and the expressions nested in it
+
+        Args:
+            expression (SExpression): The expression
+            bound (frozenset): The local variables of the enclosing lambdas and lets
+
+        Returns:
+            SExpression: The expression with the calls inlined
+        """
+        if(isinstance(expression, SProcApplication)):
+            expression.operator = yield self.inline_expression(expression.operator, bound)
+            yield self.inline_sequence(expression.operands, bound)
+            result = self.inline_call(expression, bound)
+            if(result != None):
+                self.inlined += 1
+                return result
+        elif(isinstance(expression, SIf)):
+            expression.test = yield self.inline_expression(expression.test, bound)
+            expression.consequent = yield self.inline_expression(expression.consequent, bound)
+            expression.alternative = yield self.inline_expression(expression.alternative, bound)
+        elif(isinstance(expression, SLambda)):
+            yield self.inline_sequence(expression.body, bound | {var.value for var in expression.bound_var_list})
+        elif(isinstance(expression, SLet)):
+            for i in range(len(expression.var_bindings)):
+                (var, exp) = expression.var_bindings[i]
+                expression.var_bindings[i] = (var, (yield self.inline_expression(exp, bound)))
+            inner = bound | {x[0].value for x in expression.var_bindings}
+            # The name of a named let is a loop, not a call to inline
+            if(isinstance(expression, SNamedLet)):
+                inner = inner | {expression.name.value}
+            yield self.inline_sequence(expression.body, inner)
+        elif(isinstance(expression, (SDefine, SSet))):
+            expression.expression = yield self.inline_expression(expression.expression, bound)
+        elif(isinstance(expression, (SAnd, SOr, SBegin))):
+            yield self.inline_sequence(expression.expressions, bound)
+        return expression
+
+
+    def inline(self):
+        """Inline the calls in the AST, in place
+
+        Returns:
+            List<SExpression>: The AST
+        """
+        bound = frozenset()
+        for i in range(len(self.ast)):
+            self.ast[i] = run_iteratively(self.inline_expression(self.ast[i], bound))
+        return self.ast
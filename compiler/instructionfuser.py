@@ -0,0 +1,69 @@
+from compilerenums import *
+
+
+class InstructionFuser:
+
+    # The pairs of instructions that are replaced by a superinstruction, picked from the pairs executed most
+    # often by the VM on a set of benchmark programs (see the -s flag of the VM). {(first, second): superinstruction}
+    fused_pairs = {
+        (OppCodes.lookup_local, OppCodes.push): OppCodes.lookup_push,
+        (OppCodes.load_const, OppCodes.push): OppCodes.const_push,
+        (OppCodes.lookup_local, OppCodes.apply): OppCodes.lookup_apply,
+        (OppCodes.rebind, OppCodes.branch): OppCodes.rebind_branch,
+    }
+
+    # The primitive tests that are fused with the if_false_branch after them into a branch_if_not
+    test_operations = [OppCodes.prim_num_eq, OppCodes.prim_lt, OppCodes.prim_gt, OppCodes.prim_le, OppCodes.prim_ge,
+                       OppCodes.prim_eq, OppCodes.prim_is_number, OppCodes.prim_is_string, OppCodes.prim_is_pair,
+                       OppCodes.prim_is_symbol, OppCodes.unchecked_num_eq, OppCodes.unchecked_lt, OppCodes.unchecked_gt,
+                       OppCodes.unchecked_le, OppCodes.unchecked_ge]
+
+
+    def __init__(self):
+        # The number of instructions removed by all the calls to fuse
+        self.fused = 0
+
+
+    def fuse(self, instructions):
+        """Replace the pairs of instructions that run one right after the other by their superinstruction. A label
+        between two instructions keeps them apart, since something can jump to the second one. Runs last, after
+        linking and the peephole optimizer
+
+        Args:
+            instructions (List): List of (Opp, Input)
+
+        Returns:
+            List: The new instructions
+        """
+        output = []
+        for (opp, arg) in instructions:
+            if(len(output) != 0):
+                (prev_opp, prev_arg) = output[-1]
+                fused = None
+                if((prev_opp, opp) in self.fused_pairs):
+                    fused = self.fused_pairs[(prev_opp, opp)]
+                    # Only rebind_branch needs both inputs, the other second instructions take none
+                    if(fused == OppCodes.rebind_branch):
+                        prev_arg = (prev_arg, arg)
+                elif(prev_opp in self.test_operations and opp == OppCodes.if_false_branch):
+                    fused = OppCodes.branch_if_not
+                    prev_arg = (prev_opp, arg)
+                if(fused != None):
+                    output[-1] = (fused, prev_arg)
+                    self.fused += 1
+                    continue
+            output.append((opp, arg))
+        return output
+
+
+    def fuse_program(self, main, procedures):
+        """Fuse the instructions of the main instructions and every procedure
+
+        Args:
+            main (List): The main instructions
+            procedures (List): List of (procedure_id, instructions)
+
+        Returns:
+            (main, procedures): The fused program
+        """
+        return (self.fuse(main), [(uid, self.fuse(ins)) for (uid, ins) in procedures])
@@ -0,0 +1,163 @@
+from enum import Enum
+import re
+
+
+class TokenTypes(Enum):
+    left_paren = 1
+    right_paren = 2
+    quote = 3
+    number = 4
+    string = 5
+    boolean = 6
+    word = 7
+
+
+class Token:
+
+    def __init__(self, typ, value, start, end):
+        """Token constructor
+
+        Args:
+            typ (TokenTypes): The type of the token
+            value (str): The text of the token, strings do not include the surrounding quotes
+            start (int): The index in the code where the token begins
+            end (int): The index in the code after the token ends
+        """
+        self.type = typ
+        self.value = value
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return "(" + self.type.name + " " + repr(self.value) + " @" + str(self.start) + ")"
+
+
+class Lexer:
+
+    # Every alternative starts on a different first character, so a single scan of the code is enough.
+    # Strings are allowed to be unterminated here so that the error can be reported nicely
+    token_regex = re.compile(r'''(?P<whitespace>\s+)|(?P<left_paren>\()|(?P<right_paren>\))|(?P<quote>')|(?P<string>"[^"]*"?)|(?P<atom>[^\s()"'][^\s()"]*)''')
+
+
+    def __init__(self, code, report, source=None, chunk_size=65536, offset=0):
+        """Lexer constructor
+
+        Args:
+            code (str): The scheme code
+            report (function): Called with (loc, msg) to report a syntax error
+            source (file, optional): File object to lazily read the code from, code is ignored when present. Defaults to None.
+            chunk_size (int, optional): Number of characters to read from source at a time. Defaults to 65536.
+            offset (int, optional): The index of the code in the whole file, when it is only a part of it. Defaults to 0.
+        """
+        # When reading from a source, code only holds the part of the file that has not been tokenized yet
+        # and offset is the index of code[0] in the whole file
+        self.code = "" if source else code
+        self.offset = offset
+        self.report = report
+        self.source = source
+        self.chunk_size = chunk_size
+
+
+    def read_chunk(self, consumed):
+        """Drop the tokenized part of the code and read the next chunk from the source
+
+        Args:
+            consumed (int): The index in code upto which everything has been tokenized
+
+        Returns:
+            boolean: False if the source has nothing left to read
+        """
+        if(self.source == None):
+            return False
+        chunk = self.source.read(self.chunk_size)
+        if(not chunk):
+            self.source = None
+            return False
+        self.code = self.code[consumed:] + chunk
+        self.offset += consumed
+        return True
+
+
+    def is_numeric(self, atom):
+        """Check if an atom should be read as a scheme number
+
+        Args:
+            atom (str): The text of the atom
+
+        Returns:
+            boolean: True if the atom starts like a number
+        """
+        if(atom[0].isnumeric()):
+            return True
+        return len(atom) > 1 and atom[0] == "-" and atom[1].isnumeric()
+
+
+    def make_atom(self, atom, start, end):
+        """Classify an atom as a number, boolean or a word
+
+        Args:
+            atom (str): The text of the atom
+            start (int): The index where the atom begins
+            end (int): The index after the atom ends
+
+        Returns:
+            Token: The classified token
+        """
+        if(self.is_numeric(atom)):
+            try:
+                float(atom)
+            except ValueError:
+                self.report(start, repr(atom) + " is not a number")
+            return Token(TokenTypes.number, atom, start, end)
+        if(atom[0] == "#"):
+            if(len(atom) == 1):
+                self.report(start, "invalid boolean")
+            if(atom != "#t" and atom != "#f"):
+                self.report(start + 1, "boolean can either be #t or #f")
+            return Token(TokenTypes.boolean, atom, start, end)
+        return Token(TokenTypes.word, atom, start, end)
+
+
+    def tokens(self):
+        """Generate the tokens present in the code, in order
+
+        Yields:
+            Token: The next token
+        """
+        pos = 0
+        while(True):
+            match = self.token_regex.match(self.code, pos)
+            # The last match of the chunk might continue in the next one, so read more before using it
+            if(match == None or match.end() == len(self.code)):
+                if(self.read_chunk(pos)):
+                    pos = 0
+                    continue
+                if(match == None):
+                    return
+            kind = match.lastgroup
+            pos = match.end()
+            start = self.offset + match.start()
+            end = self.offset + pos
+            if(kind == "whitespace"):
+                continue
+            elif(kind == "left_paren"):
+                yield Token(TokenTypes.left_paren, "(", start, end)
+            elif(kind == "right_paren"):
+                yield Token(TokenTypes.right_paren, ")", start, end)
+            elif(kind == "quote"):
+                yield Token(TokenTypes.quote, "'", start, end)
+            elif(kind == "string"):
+                if(end - start < 2 or self.code[pos - 1] != '"'):
+                    self.report(start, "missing quotes for a string")
+                yield Token(TokenTypes.string, self.code[match.start() + 1:pos - 1], start, end)
+            else:
+                yield self.make_atom(match.group(), start, end)
+
+
+    def tokenize(self):
+        """Convert the code into a list of tokens
+
+        Returns:
+            List: List of Token
+        """
+        return list(self.tokens())
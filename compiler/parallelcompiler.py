@@ -0,0 +1,259 @@
+from expressions import *
+from compilerenums import *
+from astgenerator import *
+from compiler import *
+from constantfolder import *
+from inliner import *
+from subexpressioneliminator import *
+from deadcodeeliminator import *
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import re
+
+
+def compile_chunk(chunk):
+    """Parse, inline, fold, remove the unused defines from, eliminate the common subexpressions of and compile a part of the code made up of whole top level expressions. Runs in a worker
+    process
+
+    Args:
+        chunk ((str, int, set, dict, int, Profile, bool, set)): The code of the chunk, the index where it begins in the whole file, the variables that are assigned in the other chunks, the procedures to inline (None to use the ones of the chunk), the largest body that is inlined, the profile to use (or None), whether to mark the profile points and the variables whose defines are removed (None to keep all of them)
+
+    Returns:
+        dict: The compiled chunk without the final ext instruction and what the merge needs to know about it
+    """
+    (code, offset, shadowed, procedures, inline_size, profile, profile_points, unused) = chunk
+    ast = ASTGenerator(code, offset=offset).generate_ast()
+    folder = ConstantFolder(ast, shadowed)
+    inliner = Inliner(ast, folder.shadowed, inline_size, procedures, profile)
+    inliner.inline()
+    folded = folder.fold()
+    # Which defines are unused is only known from all the chunks, the ones the chunk holds are given to it
+    dead = DeadCodeEliminator(folded)
+    (roots, definitions) = dead.find_references() if unused != None else ([], {})
+    eliminator = SubexpressionEliminator(dead.remove(unused) if unused != None else folded, folder.shadowed)
+    compiler = Compiler(eliminator.eliminate(), folder.shadowed, profile, profile_points)
+    (constants, main, procedures) = compiler.compile(link=False)
+    return {
+        "constants": constants,
+        "main": main[:-1],
+        "procedures": procedures,
+        "labels_used": compiler.cur_label,
+        "procedures_used": compiler.cur_procedure,
+        "global_names": compiler.global_names,
+        "known_procedures": compiler.known_procedures,
+        "folded": folder.folded,
+        "inlined": inliner.inlined,
+        "eliminated": eliminator.eliminated,
+        "escapes": compiler.escapes,
+        "hot_inlined": inliner.hot_inlined,
+        "swapped": compiler.swapped,
+        "procedure_locs": compiler.procedure_locs,
+        # The variables the chunk assigns and the ones its output relies on not being assigned
+        "assigned": folder.assigned,
+        "assumed": folder.assumed | inliner.assumed | eliminator.assumed | compiler.assumed,
+        # The top level defines, the procedures that were inlined and the global variables that are called
+        "defined": [exp.var.value for exp in ast if isinstance(exp, SDefine)],
+        "inlinable": inliner.procedures,
+        "calls": inliner.calls,
+        # What the reachability of the defines depends on and the defines removed
+        "roots": roots,
+        "removable": definitions,
+        "removed": dead.removed,
+        "dead_lambdas": dead.lambdas,
+    }
+
+
+class ParallelCompiler(Compiler):
+
+    # Parens inside strings do not count towards the nesting depth, unterminated strings are left for the
+    # lexer of the chunk to report
+    boundary_regex = re.compile(r'"[^"]*"|[()]')
+
+    # Operations whose input is the index of a global variable
+    global_operations = [OppCodes.global_get, OppCodes.global_set, OppCodes.global_define, OppCodes.call_global]
+
+    # Operations whose input is a label
+    label_operations = [OppCodes.save_continuation, OppCodes.label, OppCodes.branch, OppCodes.if_false_branch,
+                        OppCodes.if_true_branch]
+
+
+    def __init__(self, code, jobs, inline_size=12, chunks_per_job=4, profile=None, profile_points=False, dead_code=True):
+        """ParallelCompiler constructor
+
+        Args:
+            code (str): The scheme code
+            jobs (int): The number of worker processes
+            inline_size (int, optional): The largest body of a procedure that is inlined, see Inliner. Defaults to 12.
+            chunks_per_job (int, optional): The code is split into about jobs * chunks_per_job chunks, so that the work is evenly spread. Defaults to 4.
+            profile (Profile, optional): The profile of an earlier run, see Compiler. Defaults to None.
+            profile_points (bool, optional): Mark the points for the VM to profile, see Compiler. Defaults to False.
+            dead_code (bool, optional): Remove the top level defines the program never uses, see DeadCodeEliminator. Defaults to True.
+        """
+        super().__init__([], None, profile, profile_points)
+        self.code = code
+        self.jobs = jobs
+        self.inline_size = inline_size
+        self.chunks_per_job = chunks_per_job
+        self.dead_code = dead_code
+        # The number of nodes folded by the constant folder, of calls inlined and of calls reused in all the chunks
+        self.folded = 0
+        self.inlined = 0
+        self.eliminated = 0
+        self.hot_inlined = 0
+        # The names of the defines removed in the order they were in the file and the number of lambdas they held
+        self.removed = []
+        self.dead_lambdas = 0
+
+
+    def split_top_level(self, no_chunks):
+        """Split the code into chunks of roughly equal size, only cutting right after a top level expression ends
+
+        Args:
+            no_chunks (int): The number of chunks to aim for
+
+        Returns:
+            List: List of (code, offset) of the chunks
+        """
+        chunk_size = max(len(self.code) // no_chunks, 1)
+        chunks = []
+        start = 0
+        depth = 0
+        for match in self.boundary_regex.finditer(self.code):
+            paren = match.group()
+            if(paren == "("):
+                depth += 1
+            elif(paren == ")"):
+                depth -= 1
+                if(depth == 0 and match.end() - start >= chunk_size):
+                    chunks.append((self.code[start:match.end()], start))
+                    start = match.end()
+        if(start < len(self.code)):
+            chunks.append((self.code[start:], start))
+        return chunks
+
+
+    def renumber_instructions(self, instructions, uids, globals, label_base, procedure_base):
+        """Renumber the constant uids, global indices, labels and procedure ids used by a list of instructions
+
+        Args:
+            instructions (List): List of (Opp, Input)
+            uids (dict): The uid in the serial compile of every constant uid generated by the chunk
+            globals (List): The index in the serial compile of every global index of the chunk
+            label_base (int): The number of labels generated by the chunks before this one
+            procedure_base (int): The number of procedures generated by the chunks before this one
+
+        Returns:
+            List: The renumbered instructions
+        """
+        renumbered = []
+        for (opp, arg) in instructions:
+            if(opp == OppCodes.load_const):
+                arg = uids.get(arg, arg)
+            elif(opp in self.global_operations):
+                arg = globals[arg]
+            elif(opp == OppCodes.make_closure):
+                arg = (arg[0] + procedure_base, arg[1])
+            elif(opp in self.label_operations):
+                arg += label_base
+            renumbered.append((opp, arg))
+        return renumbered
+
+
+    def merge(self, chunk):
+        """Add the output of a chunk to the compiled program. The constants of the chunk are interned again in
+        the order the chunk generated them, so constants that were already seen in an earlier chunk reuse the
+        uid they got there, just like they do in a serial compile. Globals are handled the same way. Labels and
+        procedures are never shared, they are moved past the ones of the chunks before
+
+        Args:
+            chunk (dict): The output of compile_chunk
+        """
+        # The defaults keep their uids
+        uids = {}
+        for (uid, (typ, vals)) in chunk["constants"]:
+            if(typ == Types.pair):
+                vals = [uids.get(val, val) for val in vals]
+            uids[uid] = self.intern_constant((typ, vals))
+        globals = [self.global_index(name) for name in chunk["global_names"]]
+        label_base = self.cur_label
+        procedure_base = self.cur_procedure
+        self.instructions += self.renumber_instructions(chunk["main"], uids, globals, label_base, procedure_base)
+        for (uid, ins) in chunk["procedures"]:
+            self.procedures.append((uid + procedure_base, self.renumber_instructions(ins, uids, globals, label_base, procedure_base)))
+        for (index, uid) in chunk["known_procedures"].items():
+            index = globals[index]
+            self.known_procedures[index] = None if uid == None or index in self.known_procedures else uid + procedure_base
+        self.cur_label += chunk["labels_used"]
+        self.cur_procedure += chunk["procedures_used"]
+        self.folded += chunk["folded"]
+        self.inlined += chunk["inlined"]
+        self.eliminated += chunk["eliminated"]
+        self.hot_inlined += chunk["hot_inlined"]
+        self.removed += chunk["removed"]
+        self.dead_lambdas += chunk["dead_lambdas"]
+        self.swapped += chunk["swapped"]
+        for (uid, loc) in chunk["procedure_locs"].items():
+            self.procedure_locs[uid + procedure_base] = loc
+        for key in self.escapes:
+            self.escapes[key] += chunk["escapes"][key]
+
+
+    def compile(self):
+        """Compile the code, the chunks are compiled in parallel. Since the uids of a chunk are renumbered to the
+        ones they get in a serial compile, the output is identical to the one of Compiler
+
+        Returns:
+            (constants, main, procedures): The compiled program
+        """
+        chunks = self.split_top_level(self.jobs * self.chunks_per_job)
+        # Nothing is removed until the defines used in the whole file are known
+        nothing = set() if self.dead_code else None
+        arguments = [(code, offset, set(), None, self.inline_size, self.profile, self.profile_points, nothing) for (code, offset) in chunks]
+        try:
+            with ProcessPoolExecutor(self.jobs) as pool:
+                compiled_chunks = list(pool.map(compile_chunk, arguments))
+                # Folding a built in, or compiling a call to it or to a defined lambda inline, depends on whether
+                # it is assigned anywhere in the file, and inlining on the procedures defined in the whole file.
+                # The chunks that relied on a variable another chunk assigns, or that call a procedure that is
+                # only inlined in one of the two, are compiled again once all of them are known
+                assigned = set().union(*[chunk["assigned"] for chunk in compiled_chunks])
+                definitions = Counter(name for chunk in compiled_chunks for name in chunk["defined"])
+                procedures = {}
+                for chunk in compiled_chunks:
+                    for (name, procedure) in chunk["inlinable"].items():
+                        if(definitions[name] == 1 and name not in assigned):
+                            procedures[name] = procedure
+                stale = []
+                for (i, chunk) in enumerate(compiled_chunks):
+                    inlined_differently = any((name in procedures) != (name in chunk["inlinable"]) for name in chunk["calls"])
+                    if(len(chunk["assumed"] & assigned) != 0 or inlined_differently):
+                        stale.append(i)
+                for i in stale:
+                    arguments[i] = (chunks[i][0], chunks[i][1], assigned, procedures, self.inline_size, self.profile, self.profile_points, nothing)
+                recompiled = pool.map(compile_chunk, [arguments[i] for i in stale])
+                for (i, chunk) in zip(stale, recompiled):
+                    compiled_chunks[i] = chunk
+                # Like in a serial compile the unused defines are found once inlining is done, over the whole
+                # file, and the chunks holding some of them are compiled again without them
+                if(self.dead_code):
+                    roots = [name for chunk in compiled_chunks for name in chunk["roots"]]
+                    removable = {}
+                    for chunk in compiled_chunks:
+                        for (name, references) in chunk["removable"].items():
+                            removable.setdefault(name, []).extend(references)
+                    unused = unused_definitions(roots, removable, definitions)
+                    dead = [i for (i, chunk) in enumerate(compiled_chunks) if len(unused & chunk["removable"].keys()) != 0]
+                    recompiled = pool.map(compile_chunk, [arguments[i][:-1] + (unused,) for i in dead])
+                    for (i, chunk) in zip(dead, recompiled):
+                        compiled_chunks[i] = chunk
+        except BrokenProcessPool:
+            # A worker exits when it reports an error in its chunk
+            exit(1)
+        for chunk in compiled_chunks:
+            self.merge(chunk)
+        self.instructions.append((OppCodes.ext, None))
+        self.link()
+        if(self.profile != None):
+            self.layout_procedures()
+        return (self.constants, self.instructions, self.procedures)
@@ -0,0 +1,76 @@
+from compilerir import *
+import time
+
+
+class PassManager:
+
+    def __init__(self, level=0, dump=None):
+        """PassManager constructor, runs the registered passes whose level is at most the optimization level
+
+        Args:
+            level (int, optional): The optimization level, 0 to 2. Defaults to 0.
+            dump (file, optional): The IR is written to it after every pass that runs. Defaults to None.
+        """
+        self.level = level
+        self.dump = dump
+        # List of (name, level, function) in the order they run
+        self.passes = []
+        # {name: seconds} spent in every pass by all the calls to run
+        self.times = {}
+
+
+    def register(self, name, level, function):
+        """Add a pass after the ones registered so far
+
+        Args:
+            name (str): The name of the pass in the timings and the IR dumps
+            level (int): The lowest optimization level the pass runs at
+            function (Callable): Takes the IRProgram, and changes it in place
+        """
+        self.passes.append((name, level, function))
+        self.times[name] = 0
+
+
+    def register_instruction_pass(self, name, level, function):
+        """Add a pass that works on lists of instructions, like the peephole optimizer, see register
+
+        Args:
+            name (str): The name of the pass in the timings and the IR dumps
+            level (int): The lowest optimization level the pass runs at
+            function (Callable): Takes and returns a list of (Opp, Input)
+        """
+        self.register(name, level, lambda program: program.map_instructions(function))
+
+
+    def run(self, main, procedures):
+        """Run the passes of the optimization level on a compiled program
+
+        Args:
+            main (List): The main instructions
+            procedures (List): List of (procedure_id, instructions)
+
+        Returns:
+            IRProgram: The optimized program
+        """
+        program = IRProgram(main, procedures)
+        if(self.dump != None):
+            self.dump.write("; compiled\n" + program.dump() + "\n")
+        for (name, level, function) in self.passes:
+            if(level > self.level):
+                continue
+            start = time.perf_counter()
+            function(program)
+            self.times[name] += time.perf_counter() - start
+            if(self.dump != None):
+                self.dump.write("; after " + name + "\n" + program.dump() + "\n")
+        return program
+
+
+    def timings(self):
+        """Describe the time spent in the passes that ran
+
+        Returns:
+            List<str>: One line per pass
+        """
+        return ["pass " + name + ": " + format(self.times[name] * 1000, ".1f") + " ms"
+                for (name, level, function) in self.passes if level <= self.level]
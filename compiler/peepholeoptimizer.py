@@ -0,0 +1,174 @@
+from compilerir import *
+
+
+class PeepholeOptimizer:
+
+    # Operations after which execution never falls through to the next instruction
+    no_fall_through = [OppCodes.branch, OppCodes.ret, OppCodes.ext, OppCodes.reg_ret, OppCodes.reg_tail_call,
+                       OppCodes.reg_tail_call_global, OppCodes.reg_tail_call_direct, OppCodes.reg_loop]
+
+    # Operations that return, a branch to one is replaced by a copy of it
+    returns = [OppCodes.ret, OppCodes.reg_ret]
+
+    # Operations that only set VALUE, a global can be unbound so global_get is never removed
+    # make_closure pops the variables it captures so it is never removed either
+    value_operations = [OppCodes.load_const, OppCodes.global_get, OppCodes.lookup_local, OppCodes.lookup_boxed, OppCodes.make_closure]
+    removable_value_operations = [OppCodes.load_const, OppCodes.lookup_local, OppCodes.lookup_boxed]
+
+
+    def __init__(self):
+        # The number of instructions removed by all the calls to optimize
+        self.removed = 0
+
+
+    def label_targets(self, instructions):
+        """Find the first instruction that is not a label after every label
+
+        Args:
+            instructions (List): List of (Opp, Input)
+
+        Returns:
+            dict: {label: (Opp, Input)}, the instruction is None if the label is at the end of the list
+        """
+        targets = {}
+        pending = []
+        for ins in instructions:
+            if(ins[0] == OppCodes.label):
+                pending.append(ins[1])
+                continue
+            for label in pending:
+                targets[label] = ins
+            pending = []
+        for label in pending:
+            targets[label] = None
+        return targets
+
+
+    def thread_jumps(self, instructions):
+        """Make jumps to a branch go straight to where that branch goes, and turn branches to a ret into a ret.
+        The jumps are found with jump_target, so this works on the register instructions too
+
+        Args:
+            instructions (List): List of (Opp, Input)
+
+        Returns:
+            List: The new instructions
+        """
+        targets = self.label_targets(instructions)
+
+        def final_label(label):
+            seen = set()
+            while(label not in seen):
+                seen.add(label)
+                target = targets.get(label)
+                if(target == None or target[0] != OppCodes.branch):
+                    break
+                label = target[1]
+            return label
+
+        output = []
+        for (opp, arg) in instructions:
+            if(jump_target(opp, arg) != None):
+                arg = retarget(opp, arg, final_label(jump_target(opp, arg)))
+                target = targets.get(arg)
+                if(opp == OppCodes.branch and target != None and target[0] in self.returns):
+                    (opp, arg) = target
+            output.append((opp, arg))
+        return output
+
+
+    def remove_unused_labels(self, instructions):
+        """Remove the labels nothing jumps to
+
+        Args:
+            instructions (List): List of (Opp, Input)
+
+        Returns:
+            List: The new instructions
+        """
+        used = {jump_target(opp, arg) for (opp, arg) in instructions}
+        return [ins for ins in instructions if ins[0] != OppCodes.label or ins[1] in used]
+
+
+    def remove_unreachable(self, instructions):
+        """Remove the instructions after a branch, ret or ext that no label leads to. proc_end marks the end of a
+        procedure and is always kept
+
+        Args:
+            instructions (List): List of (Opp, Input)
+
+        Returns:
+            List: The new instructions
+        """
+        output = []
+        reachable = True
+        for ins in instructions:
+            if(ins[0] == OppCodes.label):
+                reachable = True
+            if(reachable or ins[0] == OppCodes.proc_end):
+                output.append(ins)
+            if(ins[0] in self.no_fall_through):
+                reachable = False
+        return output
+
+
+    def merge_sequences(self, instructions):
+        """Remove jumps to the very next instruction and loads whose value is replaced right away
+
+        Args:
+            instructions (List): List of (Opp, Input)
+
+        Returns:
+            List: The new instructions
+        """
+        output = []
+        for i in range(len(instructions)):
+            (opp, arg) = instructions[i]
+            # The next instruction that is not a label, and the labels before it
+            j = i + 1
+            labels = set()
+            while(j < len(instructions) and instructions[j][0] == OppCodes.label):
+                labels.add(instructions[j][1])
+                j += 1
+            following = instructions[j][0] if j < len(instructions) else None
+            if(opp in [OppCodes.branch, OppCodes.if_false_branch, OppCodes.if_true_branch] and arg in labels):
+                continue
+            if(opp in self.removable_value_operations and j == i + 1 and following in self.value_operations):
+                continue
+            output.append((opp, arg))
+        return output
+
+
+    def optimize(self, instructions):
+        """Optimize a list of instructions until none of the optimizations change it
+
+        Args:
+            instructions (List): List of (Opp, Input)
+
+        Returns:
+            List: The optimized instructions
+        """
+        before = len(instructions)
+        while(True):
+            optimized = self.thread_jumps(instructions)
+            optimized = self.remove_unused_labels(optimized)
+            optimized = self.remove_unreachable(optimized)
+            optimized = self.merge_sequences(optimized)
+            if(optimized == instructions):
+                break
+            instructions = optimized
+        self.removed += before - len(instructions)
+        return instructions
+
+
+    def optimize_program(self, main, procedures):
+        """Optimize the main instructions and every procedure
+
+        Args:
+            main (List): The main instructions
+            procedures (List): List of (procedure_id, instructions)
+
+        Returns:
+            (main, procedures): The optimized program
+        """
+        return (self.optimize(main), [(uid, self.optimize(ins)) for (uid, ins) in procedures])
@@ -0,0 +1,565 @@
+from expressions import *
+from compilerenums import *
+from astgenerator import *
+from compiler import *
+
+
+class RegisterCompiler(Compiler):
+
+    # The procedures that compile (nested) expressions are generators run by run_iteratively like the ones of
+    # Compiler. Each one is given the register to put the value in, or None to leave it in any register, and
+    # returns the register the value is in, None when it was returned because the expression is in tail position
+
+    # Registers are written out as one byte
+    max_registers = 256
+
+    # The primitive operations that are tests, a reg_branch_if_not runs them and jumps when they are false
+    test_operations = [OppCodes.prim_num_eq, OppCodes.prim_lt, OppCodes.prim_gt, OppCodes.prim_le, OppCodes.prim_ge,
+                       OppCodes.prim_eq, OppCodes.prim_is_number, OppCodes.prim_is_string, OppCodes.prim_is_pair,
+                       OppCodes.prim_is_symbol]
+
+    def __init__(self, ast, shadowed=None, profile=None):
+        """RegisterCompiler constructor, compiles to register based code instead of code that passes the values
+        through VALUE and the stack. Every procedure has a single frame, the variables of its lets are kept in
+        it next to its arguments
+
+        Args:
+            ast (List<SExpression>): Abstract Syntax Tree to be compiled
+            shadowed (Iterable, optional): The variables whose value can change, see Compiler. Defaults to None.
+            profile (Profile, optional): The profile of an earlier run, used to lay out the procedures. Defaults to None.
+        """
+        super().__init__(ast, shadowed, profile)
+        # The registers of the procedure being compiled are allocated like a stack, the ones from next_register
+        # on are free. frame_size is the number of registers it needs
+        self.next_register = 0
+        self.frame_size = 0
+
+
+    def allocate_register(self):
+        """Allocate a register in the frame of the procedure being compiled
+
+        Returns:
+            int: The register
+        """
+        register = self.next_register
+        self.next_register += 1
+        if(self.next_register > self.max_registers):
+            raise SynError("A procedure needs more than " + str(self.max_registers) + " registers")
+        self.frame_size = max(self.frame_size, self.next_register)
+        return register
+
+
+    def result(self, list_to_add_to, register, tail, destination):
+        """Return the value of an expression, or put it in the register it was asked for
+
+        Args:
+            list_to_add_to (List): The list to add the instructions to
+            register (int): The register the value is in
+            tail (boolean): Is the expression in tail position
+            destination (int): The register the value was asked for in, None for any
+
+        Returns:
+            int: The register the value is in, None when it was returned
+        """
+        if(tail):
+            list_to_add_to.append((OppCodes.reg_ret, register))
+            return None
+        if(destination != None and destination != register):
+            list_to_add_to.append((OppCodes.reg_move, (destination, register)))
+            return destination
+        return register
+
+
+    def compile_value(self, list_to_add_to, expression, tail, destination=None):
+        """Compile a scheme expression. The temporaries it allocates are free again afterwards, except the
+        register its value is left in
+
+        Args:
+            list_to_add_to (List): The list to add the instructions to
+            expression (SExpression): Expression to compile
+            tail (boolean): Is expression in tail position
+            destination (int, optional): The register to put the value in. Defaults to None, for any register.
+
+        Returns:
+            int: The register the value is in, None when it was returned
+        """
+        handler = self.register_handlers.get(type(expression))
+        if(handler == None):
+            raise SynError("No handler for expression of type " + str(type(expression)))
+        mark = self.next_register
+        register = yield handler(self, list_to_add_to, expression, tail, destination)
+        # A value left in a temporary above the first one is moved down, so that all the others can be freed
+        if(register != None and register > mark):
+            list_to_add_to.append((OppCodes.reg_move, (mark, register)))
+            register = mark
+        self.next_register = register + 1 if register != None and register >= mark else mark
+        return register
+
+
+    def compile_operands(self, list_to_add_to, operands):
+        """Compile the arguments of a call, last to first like Compiler does. The registers they are left in stay
+        allocated. When an argument is set! by the others, the ones whose value is the register of a variable are
+        copied, the call has to see the value the variable had when they were evaluated
+
+        Args:
+            list_to_add_to (List): The list to add the instructions to
+            operands (List<SExpression>): The arguments
+
+        Returns:
+            (registers, known): The registers of the arguments in order, and if each one is known to be a number
+        """
+        assigned = assigned_variables(operands)
+        mark = self.next_register
+        registers = []
+        known = []
+        for operand in operands[::-1]:
+            register = yield self.compile_value(list_to_add_to, operand, False)
+            if(len(assigned) != 0 and register < mark):
+                (copy, register) = (register, self.allocate_register())
+                list_to_add_to.append((OppCodes.reg_move, (register, copy)))
+            registers.append(register)
+            known.append(self.known_number(operand))
+        return (tuple(registers[::-1]), known[::-1])
+
+
+    def target(self, destination):
+        """The register to compute a value in
+
+        Args:
+            destination (int): The register the value was asked for in, None for any
+
+        Returns:
+            int: destination, or a new temporary
+        """
+        return destination if destination != None else self.allocate_register()
+
+
+    def compile_constant_register(self, list_to_add_to, expression, tail, destination):
+        (uid, _) = yield self.generate_data_instruction_for_constant(expression)
+        register = self.target(destination)
+        list_to_add_to.append((OppCodes.reg_const, (register, uid)))
+        return self.result(list_to_add_to, register, tail, None)
+
+
+    def compile_variable_register(self, list_to_add_to, expression, tail, destination):
+        address = self.resolve_variable(expression.value)
+        if(address != None and not address[2]):
+            return self.result(list_to_add_to, address[1], tail, destination)
+        register = self.target(destination)
+        if(address != None):
+            list_to_add_to.append((OppCodes.reg_unbox, (register, address[1])))
+        else:
+            list_to_add_to.append((OppCodes.reg_global_get, (register, self.global_index(expression.value))))
+        return self.result(list_to_add_to, register, tail, None)
+        # Not reached, compile_value expects a generator
+        yield
+
+
+    def compile_test(self, list_to_add_to, expression, false_label):
+        """Compile the test of an if, jumping to false_label when it is false. The primitive tests jump on their
+        result directly, and the parts of ands and ors are tested one by one
+
+        Args:
+            list_to_add_to (List): The list to add the instructions to
+            expression (SExpression): The test
+            false_label (int): The label to jump to
+        """
+        mark = self.next_register
+        if(isinstance(expression, SAnd) and len(expression.expressions) != 0):
+            exits = []
+            for exp in expression.expressions:
+                yield self.compile_test(list_to_add_to, exp, false_label)
+                exits.append(self.save_numbers())
+            self.merge_numbers(exits)
+        elif(isinstance(expression, SOr) and len(expression.expressions) != 0):
+            true_label = self.generate_label()
+            exits = []
+            for exp in expression.expressions[:-1]:
+                register = yield self.compile_value(list_to_add_to, exp, False)
+                list_to_add_to.append((OppCodes.reg_branch_true, (register, true_label)))
+                exits.append(self.save_numbers())
+                self.next_register = mark
+            yield self.compile_test(list_to_add_to, expression.expressions[-1], false_label)
+            self.merge_numbers(exits)
+            list_to_add_to.append((OppCodes.label, true_label))
+        elif(self.primitive_test(expression)):
+            (registers, known) = yield self.compile_operands(list_to_add_to, expression.operands)
+            opp = self.checked_primitive(expression, self.primitive_operation(expression)[0], known)
+            list_to_add_to.append((OppCodes.reg_branch_if_not, (opp, registers, false_label)))
+        else:
+            register = yield self.compile_value(list_to_add_to, expression, False)
+            list_to_add_to.append((OppCodes.reg_branch_false, (register, false_label)))
+        self.next_register = mark
+
+
+    def primitive_test(self, expression):
+        """Check if an expression is a call to a primitive operation that is a test
+
+        Args:
+            expression (SExpression): The expression
+
+        Returns:
+            boolean: True if reg_branch_if_not can run it
+        """
+        if(not isinstance(expression, SProcApplication)):
+            return False
+        primitive = self.primitive_operation(expression)
+        return primitive != None and primitive[0] in self.test_operations
+
+
+    def checked_primitive(self, expression, opp, known):
+        """Pick the unchecked version of a primitive operation when all the arguments are numbers. Otherwise the
+        variables passed to it are numbers once it ran, see Compiler.compile_proc_application
+
+        Args:
+            expression (SProcApplication): The call to the built in
+            opp (OppCodes): The primitive operation
+            known (List<boolean>): If each argument is known to be a number
+
+        Returns:
+            OppCodes: The operation to run
+        """
+        if(opp not in self.unchecked_operations):
+            return opp
+        if(all(known)):
+            return self.unchecked_operations[opp]
+        if(len(assigned_variables(expression.operands)) == 0):
+            for operand in expression.operands:
+                if(isinstance(operand, SVariable)):
+                    self.set_known_number(operand.value, True)
+        return opp
+
+
+    def compile_if_register(self, list_to_add_to, expression, tail, destination):
+        register = None if tail else self.target(destination)
+        second_branch = self.generate_label()
+        yield self.compile_test(list_to_add_to, expression.test, second_branch)
+        before_branches = self.save_numbers()
+        yield self.compile_value(list_to_add_to, expression.consequent, tail, register)
+        after_first = self.numbers
+        self.numbers = before_branches
+        if(tail):
+            list_to_add_to.append((OppCodes.label, second_branch))
+            yield self.compile_value(list_to_add_to, expression.alternative, tail, register)
+        else:
+            if_end = self.generate_label()
+            list_to_add_to.append((OppCodes.branch, if_end))
+            list_to_add_to.append((OppCodes.label, second_branch))
+            yield self.compile_value(list_to_add_to, expression.alternative, tail, register)
+            list_to_add_to.append((OppCodes.label, if_end))
+        self.merge_numbers([after_first])
+        return register
+
+
+    def make_register_scope(self, variables, registers, expression, list_to_add_to):
+        """Make the scope of the variables of a lambda or let, and box the registers of the ones that need it
+
+        Args:
+            variables (List<SVariable>): The variables, in the order they are bound
+            registers (List<int>): The register of each variable
+            expression (SLambda or SLet): The lambda or let
+            list_to_add_to (List): The list to add the instructions to
+
+        Returns:
+            dict: {variable_name: (register, boxed)}, if a name is repeated the first register is used
+        """
+        boxed = self.boxed_variables(variables, expression)
+        scope = {}
+        for (var, register) in zip(variables, registers):
+            scope.setdefault(var.value, (register, var.value in boxed))
+        self.escapes["boxed"] += len(boxed)
+        for (register, is_boxed) in scope.values():
+            if(is_boxed):
+                list_to_add_to.append((OppCodes.reg_box, register))
+        return scope
+
+
+    def compile_lambda_register(self, list_to_add_to, expression, tail, destination, name=None):
+        register = self.target(destination)
+        uid = self.generate_procedure_id()
+        top_level = len(self.scopes) == 0
+        # The closure is flat like the ones of Compiler, the variables it captures are the first registers of the
+        # frame of the procedure and the arguments come right after them
+        captured = [(var, self.resolve_variable(var)) for var in self.scope_variables(expression)[0]]
+        captured = [(var, address) for (var, address) in captured if address != None]
+        self.escapes["captured"] += len(captured)
+        self.escapes["stack_frames"] += 1
+        captured_scope = {var: (slot, address[2]) for (slot, (var, address)) in enumerate(captured)}
+        captured_numbers = {var for (var, address) in captured if var in self.numbers[-1 - address[0]]}
+        enclosing = (self.scopes, self.numbers, self.next_register, self.frame_size)
+        (self.next_register, self.frame_size) = (0, 0)
+        arguments = [self.allocate_register() for i in range(len(captured) + len(expression.bound_var_list))][len(captured):]
+        ins = []
+        self.scopes = [captured_scope, self.make_register_scope(expression.bound_var_list, arguments, expression, ins)]
+        self.numbers = [captured_numbers, set()]
+        loop = None
+        if(name != None and self.shadowed != None and name not in self.shadowed and top_level):
+            loop = {"name": name, "arity": len(expression.bound_var_list), "scope": len(self.scopes), "label": None,
+                    "first_register": len(captured)}
+        self.procedure_stack.append(loop)
+        yield self.compile_sequence_register(ins, expression.body, True, None)
+        self.procedure_stack.pop()
+        if(loop != None and loop["label"] != None):
+            # The arguments are boxed again on every iteration
+            ins.insert(0, (OppCodes.label, loop["label"]))
+        ins.insert(0, (OppCodes.reg_enter, (self.frame_size, len(captured) + len(arguments))))
+        ins.append((OppCodes.proc_end, None))
+        (self.scopes, self.numbers, self.next_register, self.frame_size) = enclosing
+        if(expression.loc != None):
+            self.procedure_locs[uid] = expression.loc
+        list_to_add_to.append((OppCodes.reg_closure, (uid, register, tuple(address[1] for (var, address) in captured))))
+        self.procedures.append((uid, ins))
+        return self.result(list_to_add_to, register, tail, None)
+
+
+    def compile_sequence_register(self, list_to_add_to, sequence, tail, destination):
+        """Compile a list of expressions, only the value of the last one is kept
+
+        Args:
+            list_to_add_to (List): The list to add the instructions to
+            sequence (List): The sequence to compile
+            tail (boolean): Is the sequence in tail position
+            destination (int): The register to put the value in, None for any
+
+        Returns:
+            int: The register the value is in, None when it was returned
+        """
+        mark = self.next_register
+        for exp in sequence[:-1]:
+            yield self.compile_value(list_to_add_to, exp, False)
+            self.next_register = mark
+        if(len(sequence) == 0):
+            # Nothing sets the value of an empty sequence, it is #f like the one of a cond without a clause
+            return (yield self.compile_value(list_to_add_to, SBool("#f"), tail, destination))
+        return (yield self.compile_value(list_to_add_to, sequence[-1], tail, destination))
+
+
+    def compile_begin_register(self, list_to_add_to, expression, tail, destination):
+        return (yield self.compile_sequence_register(list_to_add_to, expression.expressions, tail, destination))
+
+
+    def compile_loop_register(self, list_to_add_to, expression, loop):
+        """Compile a self tail call as a jump back to the start of the procedure or named let, after copying the
+        arguments to the registers of its variables
+
+        Args:
+            list_to_add_to (List): The list to add the instructions to
+            expression (SProcApplication): The self tail call
+            loop (dict): The entry of the lambda in procedure_stack, or of the named let in loop_calls
+        """
+        if(loop["label"] == None):
+            loop["label"] = self.generate_label()
+        (registers, known) = yield self.compile_operands(list_to_add_to, expression.operands)
+        list_to_add_to.append((OppCodes.reg_loop, (loop["first_register"], registers, loop["label"])))
+
+
+    def compile_proc_application_register(self, list_to_add_to, expression, tail, destination):
+        loop = self.loop_calls.get(id(expression))
+        if(loop == None):
+            loop = self.self_tail_call(expression, tail)
+        if(loop != None):
+            yield self.compile_loop_register(list_to_add_to, expression, loop)
+            return None
+        register = None if tail else self.target(destination)
+        primitive = self.primitive_operation(expression)
+        if(primitive != None):
+            # The arithmetic operations take any number of arguments, so the count is part of the register list
+            (registers, known) = yield self.compile_operands(list_to_add_to, expression.operands)
+            opp = self.checked_primitive(expression, primitive[0], known)
+            result = register if register != None else self.allocate_register()
+            list_to_add_to.append((OppCodes.reg_prim, (opp, result, registers)))
+            return self.result(list_to_add_to, result, tail, None)
+        (registers, known) = yield self.compile_operands(list_to_add_to, expression.operands)
+        # Calls to global variables are linked once the whole program is compiled
+        operator = expression.operator
+        if(self.shadowed != None and isinstance(operator, SVariable) and self.resolve_variable(operator.value) == None):
+            index = self.global_index(operator.value)
+            if(tail):
+                list_to_add_to.append((OppCodes.reg_tail_call_global, (index, registers)))
+            else:
+                list_to_add_to.append((OppCodes.reg_call_global, (index, register, registers)))
+            return register
+        procedure = yield self.compile_value(list_to_add_to, operator, False)
+        if(tail):
+            list_to_add_to.append((OppCodes.reg_tail_call, (procedure, registers)))
+        else:
+            list_to_add_to.append((OppCodes.reg_call, (procedure, register, registers)))
+        return register
+
+
+    def compile_define_register(self, list_to_add_to, expression, tail, destination):
+        if(tail):
+            raise SynError("Define in tail posisiton, not allowed")
+        name = expression.var.value
+        if(len(self.scopes) == 0 and self.shadowed != None):
+            index = self.global_index(name)
+            if(isinstance(expression.expression, SLambda) and name not in self.shadowed and index not in self.known_procedures):
+                self.assumed.add(name)
+                self.known_procedures[index] = self.cur_procedure
+            else:
+                self.known_procedures[index] = None
+        if(isinstance(expression.expression, SLambda)):
+            register = yield self.compile_lambda_register(list_to_add_to, expression.expression, False, destination, name)
+        else:
+            register = yield self.compile_value(list_to_add_to, expression.expression, False, destination)
+        list_to_add_to.append((OppCodes.reg_global_define, (register, self.global_index(name))))
+        return register
+
+
+    def compile_set_register(self, list_to_add_to, expression, tail, destination):
+        address = self.resolve_variable(expression.variable.value)
+        if(address != None and not address[2]):
+            # Only the last instruction of the value writes to the register it is asked for
+            register = yield self.compile_value(list_to_add_to, expression.expression, False, address[1])
+        else:
+            register = yield self.compile_value(list_to_add_to, expression.expression, False)
+            if(address != None):
+                list_to_add_to.append((OppCodes.reg_set_box, (address[1], register)))
+            else:
+                list_to_add_to.append((OppCodes.reg_global_set, (register, self.global_index(expression.variable.value))))
+        self.set_known_number(expression.variable.value, self.known_number(expression.expression))
+        return self.result(list_to_add_to, register, tail, destination)
+
+
+    def compile_and_register(self, list_to_add_to, expression, tail, destination, jump=OppCodes.reg_branch_false):
+        # An and is #t when none of its expressions is false, an or is #f when none of them is true
+        register = self.target(destination)
+        (value, other) = (Defaults.boolean_true, Defaults.boolean_false)
+        if(jump == OppCodes.reg_branch_true):
+            (value, other) = (other, value)
+        short_circuit = self.generate_label()
+        end = self.generate_label()
+        mark = self.next_register
+        exits = []
+        for exp in expression.expressions:
+            test = yield self.compile_value(list_to_add_to, exp, False)
+            list_to_add_to.append((jump, (test, short_circuit)))
+            exits.append(self.save_numbers())
+            self.next_register = mark
+        self.merge_numbers(exits)
+        list_to_add_to.append((OppCodes.reg_const, (register, value.value)))
+        if(tail):
+            list_to_add_to.append((OppCodes.reg_ret, register))
+        else:
+            list_to_add_to.append((OppCodes.branch, end))
+        list_to_add_to.append((OppCodes.label, short_circuit))
+        list_to_add_to.append((OppCodes.reg_const, (register, other.value)))
+        if(tail):
+            list_to_add_to.append((OppCodes.reg_ret, register))
+            return None
+        list_to_add_to.append((OppCodes.label, end))
+        return register
+
+
+    def compile_or_register(self, list_to_add_to, expression, tail, destination):
+        return (yield self.compile_and_register(list_to_add_to, expression, tail, destination, OppCodes.reg_branch_true))
+
+
+    def compile_let_register(self, list_to_add_to, expression, tail, destination):
+        register = None if tail else self.target(destination)
+        variables = [x[0] for x in expression.var_bindings]
+        registers = [self.allocate_register() for var in variables]
+        # The bindings are computed outside of the scope of the let, last to first
+        known = []
+        for (register_of_binding, (var, exp)) in list(zip(registers, expression.var_bindings))[::-1]:
+            yield self.compile_value(list_to_add_to, exp, False, register_of_binding)
+            known.append(self.known_number(exp))
+        known = known[::-1]
+        scope = self.make_register_scope(variables, registers, expression, list_to_add_to)
+        self.scopes.append(scope)
+        self.numbers.append({name for (name, (slot, boxed)) in scope.items() if known[registers.index(slot)] and not boxed})
+        yield self.compile_sequence_register(list_to_add_to, expression.body, tail, register)
+        self.scopes.pop()
+        self.numbers.pop()
+        return register
+
+
+    def compile_named_let_register(self, list_to_add_to, expression, tail, destination):
+        variables = [x[0] for x in expression.var_bindings]
+        calls = loop_calls(expression.name.value, len(variables), expression.body)
+        if(calls == None):
+            raise SynError("The named let " + expression.name.value + " is not a loop")
+        register = None if tail else self.target(destination)
+        registers = [self.allocate_register() for var in variables]
+        for (register_of_binding, (var, exp)) in list(zip(registers, expression.var_bindings))[::-1]:
+            yield self.compile_value(list_to_add_to, exp, False, register_of_binding)
+        loop = {"name": expression.name.value, "arity": len(variables), "scope": len(self.scopes) + 1, "label": None,
+                "first_register": registers[0] if len(registers) != 0 else self.next_register}
+        if(len(calls) != 0):
+            # The variables are boxed again on every iteration, each one gets its own boxes like a call would
+            loop["label"] = self.generate_label()
+            list_to_add_to.append((OppCodes.label, loop["label"]))
+        self.scopes.append(self.make_register_scope(variables, registers, expression, list_to_add_to))
+        self.numbers.append(set())
+        for name in self.scope_variables(expression)[1]:
+            self.set_known_number(name, False)
+        for call in calls:
+            self.loop_calls[id(call)] = loop
+        yield self.compile_sequence_register(list_to_add_to, expression.body, tail, register)
+        for call in calls:
+            del self.loop_calls[id(call)]
+        self.scopes.pop()
+        self.numbers.pop()
+        return register
+
+    # The procedure that compiles every type of expression, see Compiler.expression_handlers
+    register_handlers = {
+        SNumber: compile_constant_register,
+        SString: compile_constant_register,
+        SSymbol: compile_constant_register,
+        SBool: compile_constant_register,
+        SEmptyList: compile_constant_register,
+        SConstList: compile_constant_register,
+        SVariable: compile_variable_register,
+        SIf: compile_if_register,
+        SLambda: compile_lambda_register,
+        SProcApplication: compile_proc_application_register,
+        SDefine: compile_define_register,
+        SSet: compile_set_register,
+        SAnd: compile_and_register,
+        SOr: compile_or_register,
+        SBegin: compile_begin_register,
+        SLet: compile_let_register,
+        SNamedLet: compile_named_let_register,
+    }
+
+
+    def link_calls(self, instructions):
+        """Turn the calls to global variables that hold a known procedure into direct calls, the other ones
+        look the global up when they run
+
+        Args:
+            instructions (List): List of (Opp, Input)
+
+        Returns:
+            List: The linked instructions
+        """
+        linked = []
+        for (opp, arg) in instructions:
+            uid = self.known_procedures.get(arg[0]) if opp in [OppCodes.reg_call_global, OppCodes.reg_tail_call_global] else None
+            if(uid == None):
+                linked.append((opp, arg))
+            elif(opp == OppCodes.reg_call_global):
+                linked.append((OppCodes.reg_call_direct, (arg[0], uid) + arg[1:]))
+            else:
+                linked.append((OppCodes.reg_tail_call_direct, (arg[0], uid) + arg[1:]))
+        return linked
+
+
+    def compile(self, link=True):
+        """Compile the input AST, the main instructions get a frame of their own for the variables of the top
+        level lets and the temporaries
+
+        Args:
+            link (bool, optional): Link the calls to global variables. Defaults to True.
+        """
+        for exp in self.ast:
+            run_iteratively(self.compile_value(self.instructions, exp, False))
+            self.next_register = 0
+        self.instructions.insert(0, (OppCodes.reg_enter, (self.frame_size, 0)))
+        self.instructions.append((OppCodes.ext, None))
+        if(link):
+            self.link()
+        if(self.profile != None):
+            self.layout_procedures()
+        return(self.constants, self.instructions, self.procedures)
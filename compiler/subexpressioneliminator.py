@@ -0,0 +1,304 @@
+from expressions import *
+
+
+class SubexpressionEliminator:
+
+    # The procedures that walk (nested) expressions are generators, run by run_iteratively like the ones of
+    # Compiler and Inliner
+
+    # The built ins without side effects, with the numbers of arguments they are compiled inline for. cons is
+    # left out since every call makes a new pair
+    pure_operations = {
+        "+": range(256),
+        "-": range(1, 256),
+        "*": range(256),
+        "/": range(1, 256),
+        "%": [2],
+        "=": [2],
+        "<": [2],
+        ">": [2],
+        "<=": [2],
+        ">=": [2],
+        "car": [1],
+        "cdr": [1],
+        "eq?": [2],
+        "number?": [1],
+        "string?": [1],
+        "pair?": [1],
+        "symbol?": [1],
+    }
+
+    def __init__(self, ast, shadowed=()):
+        """SubexpressionEliminator constructor
+
+        Args:
+            ast (List<SExpression>): The AST to eliminate the common subexpressions of, it is changed in place
+            shadowed (Iterable, optional): The variables that are set! or defined anywhere in the program, calls to the built ins among them are left alone. Defaults to ().
+        """
+        self.ast = ast
+        self.shadowed = set(shadowed)
+        # The number of calls replaced by a temporary
+        self.eliminated = 0
+        # The built ins that were assumed not to be in shadowed
+        self.assumed = set()
+        # For the lambda being walked: the key of every pure call by id of the call, the ids of the calls whose
+        # value is already in a temporary, the keys of those, and the calls that compute a value
+        self.keys = {}
+        self.reused = set()
+        self.reused_keys = set()
+        self.computed = {}
+        # The variables set! in the lambda being walked, they are never part of a pure expression
+        self.assigned = set()
+        self.bindings = 0
+
+
+    def find_lambdas(self):
+        """Find all the lambdas in the AST, including the nested ones
+
+        Returns:
+            List<SLambda>: The lambdas
+        """
+        lambdas = []
+        stack = list(self.ast)
+        while(len(stack) != 0):
+            exp = stack.pop()
+            if(isinstance(exp, SLambda)):
+                lambdas.append(exp)
+                stack += exp.body
+            elif(isinstance(exp, (SDefine, SSet))):
+                stack.append(exp.expression)
+            elif(isinstance(exp, SIf)):
+                stack += [exp.test, exp.consequent, exp.alternative]
+            elif(isinstance(exp, SProcApplication)):
+                stack.append(exp.operator)
+                stack += exp.operands
+            elif(isinstance(exp, SLet)):
+                stack += [binding[1] for binding in exp.var_bindings]
+                stack += exp.body
+            elif(isinstance(exp, (SAnd, SOr, SBegin))):
+                stack += exp.expressions
+        return lambdas
+
+
+    def bind(self, env, variables):
+        """Give new bindings to variables
+
+        Args:
+            env (dict): {name: binding} of the variables in scope
+            variables (List<SVariable>): The variables
+
+        Returns:
+            dict: The new env
+        """
+        env = dict(env)
+        for var in variables:
+            env[var.value] = self.bindings
+            self.bindings += 1
+        return env
+
+
+    def pure_key(self, expression, env):
+        """Find the key of an expression that always has the same value in the lambda being walked: a constant, a
+        local variable that is never set! or a call to a pure built in on such expressions. Structurally equal
+        expressions on the same bindings have the same key
+
+        Args:
+            expression (SExpression): The expression
+            env (dict): {name: binding} of the local variables of the lambda in scope
+
+        Returns:
+            tuple: The key, None if the expression is not pure
+        """
+        if(id(expression) in self.keys):
+            return self.keys[id(expression)]
+        key = None
+        if(isinstance(expression, (SNumber, SString, SBool))):
+            key = (type(expression).__name__, expression.value)
+        elif(isinstance(expression, SVariable)):
+            if(expression.value in env and expression.value not in self.assigned):
+                key = ("variable", env[expression.value])
+        elif(isinstance(expression, SProcApplication) and isinstance(expression.operator, SVariable)):
+            name = expression.operator.value
+            if(name in self.pure_operations and name not in env and name not in self.shadowed and
+               len(expression.operands) in self.pure_operations[name]):
+                key = (name,)
+                for operand in expression.operands:
+                    operand_key = yield self.pure_key(operand, env)
+                    if(operand_key == None):
+                        key = None
+                        break
+                    key += (operand_key,)
+        self.keys[id(expression)] = key
+        return key
+
+
+    def walk_sequence(self, sequence, env, available):
+        """Walk a list of expressions evaluated one after the other
+
+        Args:
+            sequence (List<SExpression>): The expressions
+            env (dict): {name: binding} of the local variables of the lambda in scope
+            available (set): The keys of the calls whose value is computed on every path to the expressions
+
+        Returns:
+            set: The keys available after the expressions
+        """
+        for exp in sequence:
+            available = yield self.walk(exp, env, available)
+        return available
+
+
+    def walk(self, expression, env, available):
+        """Walk an expression in the order it is evaluated, finding the pure calls whose value was already
+        computed on every path that leads to them. Nested lambdas are walked on their own
+
+        Args:
+            expression (SExpression): The expression
+            env (dict): {name: binding} of the local variables of the lambda in scope
+            available (set): The keys of the calls whose value is computed on every path to the expression
+
+        Returns:
+            set: The keys available after the expression
+        """
+        if(isinstance(expression, SProcApplication)):
+            key = yield self.pure_key(expression, env)
+            if(key != None):
+                if(key in available):
+                    self.reused.add(id(expression))
+                    self.reused_keys.add(key)
+                    return available
+                self.computed[id(expression)] = key
+            # The operands are evaluated last to first, then the operator
+            available = yield self.walk_sequence(expression.operands[::-1] + [expression.operator], env, available)
+            if(key != None):
+                available = available | {key}
+        elif(isinstance(expression, SIf)):
+            available = yield self.walk(expression.test, env, available)
+            consequent = yield self.walk(expression.consequent, env, available)
+            alternative = yield self.walk(expression.alternative, env, available)
+            available = consequent & alternative
+        elif(isinstance(expression, (SAnd, SOr))):
+            # Any of the expressions can be the last one evaluated
+            exits = available
+            for (i, exp) in enumerate(expression.expressions):
+                available = yield self.walk(exp, env, available)
+                exits = available if i == 0 else exits & available
+            available = exits
+        elif(isinstance(expression, SLet)):
+            bindings = [binding[1] for binding in expression.var_bindings]
+            available = yield self.walk_sequence(bindings[::-1], env, available)
+            variables = [binding[0] for binding in expression.var_bindings]
+            # The body of a named let runs again after every jump back to the start, the walk only carries the
+            # keys forwards so the ones available at the start are the ones computed before the loop
+            if(isinstance(expression, SNamedLet)):
+                variables.append(expression.name)
+            env = self.bind(env, variables)
+            available = yield self.walk_sequence(expression.body, env, available)
+        elif(isinstance(expression, SBegin)):
+            available = yield self.walk_sequence(expression.expressions, env, available)
+        elif(isinstance(expression, (SDefine, SSet))):
+            available = yield self.walk(expression.expression, env, available)
+        return available
+
+
+    def rewrite_sequence(self, sequence, temporaries):
+        """Rewrite a list of expressions in place, see rewrite
+
+        Args:
+            sequence (List<SExpression>): The expressions
+            temporaries (dict): {key: SVariable} of the temporaries
+        """
+        for i in range(len(sequence)):
+            sequence[i] = yield self.rewrite(sequence[i], temporaries)
+
+
+    def rewrite(self, expression, temporaries):
+        """Replace the calls whose value was already computed by their temporary, and make the calls that
+        compute a reused value store it in the temporary
+
+        Args:
+            expression (SExpression): The expression
+            temporaries (dict): {key: SVariable} of the temporaries
+
+        Returns:
+            SExpression: The rewritten expression
+        """
+        if(isinstance(expression, SProcApplication)):
+            if(id(expression) in self.reused):
+                self.eliminated += 1
+                return SVariable(temporaries[self.keys[id(expression)]].value)
+            yield self.rewrite_sequence(expression.operands, temporaries)
+            key = self.computed.get(id(expression))
+            if(key in temporaries):
+                temporary = temporaries[key]
+                return SBegin([SSet(SVariable(temporary.value), expression), SVariable(temporary.value)])
+        elif(isinstance(expression, SIf)):
+            expression.test = yield self.rewrite(expression.test, temporaries)
+            expression.consequent = yield self.rewrite(expression.consequent, temporaries)
+            expression.alternative = yield self.rewrite(expression.alternative, temporaries)
+        elif(isinstance(expression, SLet)):
+            for i in range(len(expression.var_bindings)):
+                (var, exp) = expression.var_bindings[i]
+                expression.var_bindings[i] = (var, (yield self.rewrite(exp, temporaries)))
+            yield self.rewrite_sequence(expression.body, temporaries)
+        elif(isinstance(expression, (SDefine, SSet))):
+            expression.expression = yield self.rewrite(expression.expression, temporaries)
+        elif(isinstance(expression, (SAnd, SOr, SBegin))):
+            yield self.rewrite_sequence(expression.expressions, temporaries)
+        return expression
+
+
+    def eliminate_in_lambda(self, procedure):
+        """Eliminate the common subexpressions of the body of a lambda. The temporaries are bound by a let
+        around the body, the names start with # so they can not clash with the variables of the program
+
+        Args:
+            procedure (SLambda): The lambda, changed in place
+        """
+        self.keys = {}
+        self.reused = set()
+        self.reused_keys = set()
+        self.computed = {}
+        self.assigned = assigned_variables(procedure.body)
+        env = self.bind({}, procedure.bound_var_list)
+        run_iteratively(self.walk_sequence(procedure.body, env, frozenset()))
+        if(len(self.reused) == 0):
+            return
+        # Numbered in the order the values are first computed
+        temporaries = {}
+        for key in self.computed.values():
+            if(key in self.reused_keys and key not in temporaries):
+                temporaries[key] = SVariable("#cse" + str(len(temporaries)))
+                self.assumed.update(part[0] for part in self.calls_in_key(key))
+        run_iteratively(self.rewrite_sequence(procedure.body, temporaries))
+        procedure.body = [SLet([(temporary, SBool("#f")) for temporary in temporaries.values()], procedure.body)]
+
+
+    def calls_in_key(self, key):
+        """Find the calls a key is made of
+
+        Args:
+            key (tuple): The key of a pure call
+
+        Returns:
+            List<tuple>: The keys of the calls, the first element of each is the name of the built in
+        """
+        calls = []
+        stack = [key]
+        while(len(stack) != 0):
+            key = stack.pop()
+            if(key[0] in self.pure_operations):
+                calls.append(key)
+                stack += key[1:]
+        return calls
+
+
+    def eliminate(self):
+        """Eliminate the common subexpressions in the bodies of all the lambdas, in place
+
+        Returns:
+            List<SExpression>: The AST
+        """
+        for procedure in self.find_lambdas():
+            self.eliminate_in_lambda(procedure)
+        return self.ast
@@ -2,43 +2,90 @@
 
 void VM::apply_builtin(std::shared_ptr<ScmClosure> closure)
 {
+    run_builtin(closure);
+    pop_continuation();
+}
+
+void VM::run_builtin(std::shared_ptr<ScmClosure> closure)
+{
+    // The arguments are on the stack, the result is put in VALUE. display leaves VALUE as it is, the closure
+    // is in it when it is applied
     if(!closure->built_in) {
         std::cout << "Called VM::apply_builtin on a non built in closure";
     }
     // All the built in functions are technically top level functions, so set the environment to top_level when executing them
     ENVT = top_level_env;
-    
+
     BuiltInFunctions func = closure->func;
-    if(func == BuiltInFunctions::addition) {
+    // If let consumes the exact number of arguments it pushes on the stack
+    // And only argument generation in let and a proc application causes the stack to grow,
+    // This would mean that its guaranteed that the stack will be empty when a function is
+    // called, so the arithmetic functions consume all the arguments on it
+    if(func == BuiltInFunctions::addition || func == BuiltInFunctions::multiplication) {
+        // Any number of arguments
+    } else if(func == BuiltInFunctions::subtraction || func == BuiltInFunctions::division) {
+        if(STACK->empty()) {
+            is_stack_size(1, built_in.find(func)->second);
+        }
+    } else if(func == BuiltInFunctions::car || func == BuiltInFunctions::cdr || func == BuiltInFunctions::display ||
+              func == BuiltInFunctions::is_number || func == BuiltInFunctions::is_string ||
+              func == BuiltInFunctions::is_pair || func == BuiltInFunctions::is_symbol) {
+        is_stack_size(1, built_in.find(func)->second);
+    } else {
+        is_stack_size(2, built_in.find(func)->second);
+    }
+    apply_primitive(func, STACK->size());
+}
 
-        // If let consumes the exact number of arguments it pushes on the stack
-        // And only argument generation in let and a proc application causes the stack to grow,
-        // This would mean that its guaranteed that the stack will be empty when a function is
-        // called, So I THINK i could change this to consume any number of arguments
-        is_stack_size(2, "+");
+std::shared_ptr<ScmInt> VM::pop_number(BuiltInFunctions func)
+{
+    auto a = STACK->top();
+    STACK->pop();
+    auto a_int = std::dynamic_pointer_cast<ScmInt>(a);
+    if(a_int == nullptr) {
+        std::cout << "Please provide a number to " << built_in.find(func)->second << std::endl;
+        exit(1);
+    }
+    return a_int;
+}
 
-        auto a = STACK->top();
-        STACK->pop();
-        auto a_int = std::dynamic_pointer_cast<ScmInt>(a);
-        if(a_int == nullptr) {
-            std::cout << "Please provide a number to +" << std::endl;
-            exit(1);
+void VM::apply_primitive(BuiltInFunctions func, uint32_t no_args)
+{
+    // The arguments are on top of the stack, the first argument on the very top. They are all popped and the
+    // result is put in VALUE
+    if(func == BuiltInFunctions::addition || func == BuiltInFunctions::subtraction ||
+       func == BuiltInFunctions::multiplication || func == BuiltInFunctions::division) {
+
+        double ans;
+        if(no_args == 0) {
+            ans = func == BuiltInFunctions::multiplication ? 1 : 0;
+        } else {
+            ans = pop_number(func)->val;
+            if(no_args == 1) {
+                if(func == BuiltInFunctions::subtraction) {
+                    ans = -ans;
+                } else if(func == BuiltInFunctions::division) {
+                    ans = 1 / ans;
+                }
+            }
         }
-
-        auto b = STACK->top();
-        STACK->pop();
-        auto b_int = std::dynamic_pointer_cast<ScmInt>(b);
-        if(b_int == nullptr) {
-            std::cout << "Please provide a number to +" << std::endl;
-            exit(1);
+        // The arguments are folded from the left
+        for(uint32_t i = 1; i < no_args; i++) {
+            double b = pop_number(func)->val;
+            if(func == BuiltInFunctions::addition) {
+                ans = ans + b;
+            } else if(func == BuiltInFunctions::subtraction) {
+                ans = ans - b;
+            } else if(func == BuiltInFunctions::multiplication) {
+                ans = ans * b;
+            } else {
+                ans = ans / b;
+            }
         }
-
-        auto ans = std::make_shared<ScmInt>(a_int->val + b_int->val);
-        VALUE = ans;
+        VALUE = std::make_shared<ScmInt>(ans);
 
     } else if(func == BuiltInFunctions::display) {
 
-        is_stack_size(1, "display");
         auto obj = STACK->top();
         STACK->pop();
         std::string o;
@@ -53,8 +100,7 @@ void VM::apply_builtin(std::shared_ptr<ScmClosure> closure)
         std::cout << std::endl;
 
     } else if(func == BuiltInFunctions::car) {
-        
-        is_stack_size(1, "car");
+
         auto obj = STACK->top();
         STACK->pop();
         auto fin = std::dynamic_pointer_cast<ScmPair>(obj);
@@ -66,7 +112,6 @@ void VM::apply_builtin(std::shared_ptr<ScmClosure> closure)
 
     } else if(func == BuiltInFunctions::cdr) {
 
-        is_stack_size(1, "car");
         auto obj = STACK->top();
         STACK->pop();
         auto fin = std::dynamic_pointer_cast<ScmPair>(obj);
@@ -75,98 +120,14 @@ void VM::apply_builtin(std::shared_ptr<ScmClosure> closure)
             exit(1);
         }
         VALUE = fin->cdr;
-        
-    } else if(func == BuiltInFunctions::subtraction) {
-        
-        if(STACK->size() == 1) {
-            auto a = STACK->top();
-            STACK->pop();
-            auto a_int = std::dynamic_pointer_cast<ScmInt>(a);
-            if(a_int == nullptr) {
-                std::cout << "Please provide a number to -" << std::endl;
-                exit(1);
-            } else {
-                VALUE = std::make_shared<ScmInt>(-(a_int->val));
-            }
-        } else {
-            is_stack_size(2, "-");
-
-            auto a = STACK->top();
-            STACK->pop();
-            auto a_int = std::dynamic_pointer_cast<ScmInt>(a);
-            if(a_int == nullptr) {
-                std::cout << "Please provide a number to -" << std::endl;
-                exit(1);
-            }
-
-            auto b = STACK->top();
-            STACK->pop();
-            auto b_int = std::dynamic_pointer_cast<ScmInt>(b);
-            if(b_int == nullptr) {
-                std::cout << "Please provide a number to -" << std::endl;
-                exit(1);
-            }
-
-            auto ans = std::make_shared<ScmInt>(a_int->val - b_int->val);
-            VALUE = ans;
-        }
-        
-
-    } else if(func == BuiltInFunctions::division) {
-        
-        is_stack_size(2, "/");
-
-        auto a = STACK->top();
-        STACK->pop();
-        auto a_int = std::dynamic_pointer_cast<ScmInt>(a);
-        if(a_int == nullptr) {
-            std::cout << "Please provide a number to /" << std::endl;
-            exit(1);
-        }
-
-        auto b = STACK->top();
-        STACK->pop();
-        auto b_int = std::dynamic_pointer_cast<ScmInt>(b);
-        if(b_int == nullptr) {
-            std::cout << "Please provide a number to /" << std::endl;
-            exit(1);
-        }
-
-        auto ans = std::make_shared<ScmInt>(a_int->val / b_int->val);
-        VALUE = ans;
-
-    } else if(func == BuiltInFunctions::multiplication) {
-        
-        is_stack_size(2, "*");
-
-        auto a = STACK->top();
-        STACK->pop();
-        auto a_int = std::dynamic_pointer_cast<ScmInt>(a);
-        if(a_int == nullptr) {
-            std::cout << "Please provide a number to /" << std::endl;
-            exit(1);
-        }
-
-        auto b = STACK->top();
-        STACK->pop();
-        auto b_int = std::dynamic_pointer_cast<ScmInt>(b);
-        if(b_int == nullptr) {
-            std::cout << "Please provide a number to *" << std::endl;
-            exit(1);
-        }
-
-        auto ans = std::make_shared<ScmInt>(a_int->val * b_int->val);
-        VALUE = ans;
 
     } else if(func == BuiltInFunctions::cons) {
-        is_stack_size(2, "cons");
         auto a = STACK->top();
         STACK->pop();
         auto b = STACK->top();
         STACK->pop();
         VALUE = std::make_shared<ScmPair>(a, b);
     } else if(func == BuiltInFunctions::is_number) {
-        is_stack_size(1, "number?");
         auto a = STACK->top();
         STACK->pop();
         auto a_int = std::dynamic_pointer_cast<ScmInt>(a);
@@ -176,7 +137,6 @@ void VM::apply_builtin(std::shared_ptr<ScmClosure> closure)
             VALUE = constants[Defaults::boolean_true];
         }
     } else if(func == BuiltInFunctions::is_string) {
-        is_stack_size(1, "string?");
         auto a = STACK->top();
         STACK->pop();
         auto a_str = std::dynamic_pointer_cast<ScmStr>(a);
@@ -186,7 +146,6 @@ void VM::apply_builtin(std::shared_ptr<ScmClosure> closure)
             VALUE = constants[Defaults::boolean_true];
         }
     } else if(func == BuiltInFunctions::is_pair) {
-        is_stack_size(1, "pair?");
         auto a = STACK->top();
         STACK->pop();
         auto a_pair = std::dynamic_pointer_cast<ScmPair>(a);
@@ -196,7 +155,6 @@ void VM::apply_builtin(std::shared_ptr<ScmClosure> closure)
             VALUE = constants[Defaults::boolean_true];
         }
     } else if(func == BuiltInFunctions::is_symbol) {
-        is_stack_size(1, "symbol?");
         auto a = STACK->top();
         STACK->pop();
         auto a_sym = std::dynamic_pointer_cast<ScmSym>(a);
@@ -205,38 +163,12 @@ void VM::apply_builtin(std::shared_ptr<ScmClosure> closure)
         } else {
             VALUE = constants[Defaults::boolean_true];
         }
-    } else if(func == BuiltInFunctions::num_equal) {
-        is_stack_size(2, "=");
-
-        auto a = STACK->top();
-        STACK->pop();
-        auto a_int = std::dynamic_pointer_cast<ScmInt>(a);
-        if(a_int == nullptr) {
-            std::cout << "Please provide a number to =" << std::endl;
-            exit(1);
-        }
-
-        auto b = STACK->top();
-        STACK->pop();
-        auto b_int = std::dynamic_pointer_cast<ScmInt>(b);
-        if(b_int == nullptr) {
-            std::cout << "Please provide a number to =" << std::endl;
-            exit(1);
-        }
-
-        if(a_int->val == b_int->val) {
-            VALUE = constants[Defaults::boolean_true];
-        } else {
-            VALUE = constants[Defaults::boolean_false];
-        }
-        
     } else if(func == BuiltInFunctions::eq) {
-        is_stack_size(2, "eq?");
         auto a = STACK->top();
         STACK->pop();
         auto b = STACK->top();
         STACK->pop();
-        
+
         if(a == b) {
             VALUE = constants[Defaults::boolean_true];
         } else {
@@ -262,129 +194,96 @@ void VM::apply_builtin(std::shared_ptr<ScmClosure> closure)
                 }
             }
         }
-    } else if(func == BuiltInFunctions::num_greater){
-        is_stack_size(2, ">");
-
-        auto a = STACK->top();
-        STACK->pop();
-        auto a_int = std::dynamic_pointer_cast<ScmInt>(a);
-        if(a_int == nullptr) {
-            std::cout << "Please provide a number to >" << std::endl;
-            exit(1);
-        }
-
-        auto b = STACK->top();
-        STACK->pop();
-        auto b_int = std::dynamic_pointer_cast<ScmInt>(b);
-        if(b_int == nullptr) {
-            std::cout << "Please provide a number to >" << std::endl;
-            exit(1);
-        }
-
-        if(a_int->val > b_int->val) {
-            VALUE = constants[Defaults::boolean_true];
+    } else if(func == BuiltInFunctions::modulo) {
+        double a = pop_number(func)->val;
+        double b = pop_number(func)->val;
+        VALUE = std::make_shared<ScmInt>(int(a) % int(b));
+
+    } else if(func == BuiltInFunctions::num_equal || func == BuiltInFunctions::num_greater ||
+              func == BuiltInFunctions::num_greater_equal || func == BuiltInFunctions::num_less ||
+              func == BuiltInFunctions::num_less_equal) {
+        double a = pop_number(func)->val;
+        double b = pop_number(func)->val;
+
+        bool ans;
+        if(func == BuiltInFunctions::num_equal) {
+            ans = a == b;
+        } else if(func == BuiltInFunctions::num_greater) {
+            ans = a > b;
+        } else if(func == BuiltInFunctions::num_greater_equal) {
+            ans = a >= b;
+        } else if(func == BuiltInFunctions::num_less) {
+            ans = a < b;
         } else {
-            VALUE = constants[Defaults::boolean_false];
-        }
-
-    } else if(func == BuiltInFunctions::num_greater_equal){
-        is_stack_size(2, ">=");
-
-        auto a = STACK->top();
-        STACK->pop();
-        auto a_int = std::dynamic_pointer_cast<ScmInt>(a);
-        if(a_int == nullptr) {
-            std::cout << "Please provide a number to >=" << std::endl;
-            exit(1);
+            ans = a <= b;
         }
+        VALUE = constants[ans ? Defaults::boolean_true : Defaults::boolean_false];
+    } else {
+        std::cout << "Unrecognised function " << (int)func << std::endl;
+    }
+}
 
-        auto b = STACK->top();
-        STACK->pop();
-        auto b_int = std::dynamic_pointer_cast<ScmInt>(b);
-        if(b_int == nullptr) {
-            std::cout << "Please provide a number to >=" << std::endl;
-            exit(1);
-        }
+double VM::pop_unchecked(void)
+{
+    // The compiler only emits the unchecked operations for arguments that are numbers
+    double a = std::static_pointer_cast<ScmInt>(STACK->top())->val;
+    STACK->pop();
+    return a;
+}
 
-        if(a_int->val >= b_int->val) {
-            VALUE = constants[Defaults::boolean_true];
+void VM::apply_unchecked(BuiltInFunctions func, uint32_t no_args)
+{
+    // apply_primitive for the operations on numbers, without checking the types of the arguments
+    if(func == BuiltInFunctions::modulo) {
+        double a = pop_unchecked();
+        double b = pop_unchecked();
+        VALUE = std::make_shared<ScmInt>(int(a) % int(b));
+    } else if(func == BuiltInFunctions::num_equal || func == BuiltInFunctions::num_greater ||
+              func == BuiltInFunctions::num_greater_equal || func == BuiltInFunctions::num_less ||
+              func == BuiltInFunctions::num_less_equal) {
+        double a = pop_unchecked();
+        double b = pop_unchecked();
+
+        bool ans;
+        if(func == BuiltInFunctions::num_equal) {
+            ans = a == b;
+        } else if(func == BuiltInFunctions::num_greater) {
+            ans = a > b;
+        } else if(func == BuiltInFunctions::num_greater_equal) {
+            ans = a >= b;
+        } else if(func == BuiltInFunctions::num_less) {
+            ans = a < b;
         } else {
-            VALUE = constants[Defaults::boolean_false];
+            ans = a <= b;
         }
-
-    } else if(func == BuiltInFunctions::num_less){
-
-        is_stack_size(2, "<");
-
-        auto a = STACK->top();
-        STACK->pop();
-        auto a_int = std::dynamic_pointer_cast<ScmInt>(a);
-        if(a_int == nullptr) {
-            std::cout << "Please provide a number to <" << std::endl;
-            exit(1);
-        }
-
-        auto b = STACK->top();
-        STACK->pop();
-        auto b_int = std::dynamic_pointer_cast<ScmInt>(b);
-        if(b_int == nullptr) {
-            std::cout << "Please provide a number to <" << std::endl;
-            exit(1);
-        }
-
-        if(a_int->val < b_int->val) {
-            VALUE = constants[Defaults::boolean_true];
+        VALUE = constants[ans ? Defaults::boolean_true : Defaults::boolean_false];
+    } else {
+        double ans;
+        if(no_args == 0) {
+            ans = func == BuiltInFunctions::multiplication ? 1 : 0;
         } else {
-            VALUE = constants[Defaults::boolean_false];
-        }
-    } else if(func == BuiltInFunctions::modulo){
-        is_stack_size(2, "%");
-
-        auto a = STACK->top();
-        STACK->pop();
-        auto a_int = std::dynamic_pointer_cast<ScmInt>(a);
-        if(a_int == nullptr) {
-            std::cout << "Please provide a number to %" << std::endl;
-            exit(1);
-        }
-
-        auto b = STACK->top();
-        STACK->pop();
-        auto b_int = std::dynamic_pointer_cast<ScmInt>(b);
-        if(b_int == nullptr) {
-            std::cout << "Please provide a number to %" << std::endl;
-            exit(1);
-        }
-        auto ans = std::make_shared<ScmInt>(int(a_int->val) % int(b_int->val));
-        VALUE = ans;
-
-
-    } else if(func == BuiltInFunctions::num_less_equal){
-        is_stack_size(2, "<=");
-
-        auto a = STACK->top();
-        STACK->pop();
-        auto a_int = std::dynamic_pointer_cast<ScmInt>(a);
-        if(a_int == nullptr) {
-            std::cout << "Please provide a number to <=" << std::endl;
-            exit(1);
-        }
-
-        auto b = STACK->top();
-        STACK->pop();
-        auto b_int = std::dynamic_pointer_cast<ScmInt>(b);
-        if(b_int == nullptr) {
-            std::cout << "Please provide a number to <=" << std::endl;
-            exit(1);
+            ans = pop_unchecked();
+            if(no_args == 1) {
+                if(func == BuiltInFunctions::subtraction) {
+                    ans = -ans;
+                } else if(func == BuiltInFunctions::division) {
+                    ans = 1 / ans;
+                }
+            }
         }
-
-        if(a_int->val <= b_int->val) {
-            VALUE = constants[Defaults::boolean_true];
-        } else {
-            VALUE = constants[Defaults::boolean_false];
+        // The arguments are folded from the left
+        for(uint32_t i = 1; i < no_args; i++) {
+            double b = pop_unchecked();
+            if(func == BuiltInFunctions::addition) {
+                ans = ans + b;
+            } else if(func == BuiltInFunctions::subtraction) {
+                ans = ans - b;
+            } else if(func == BuiltInFunctions::multiplication) {
+                ans = ans * b;
+            } else {
+                ans = ans / b;
+            }
         }
-    } else {
-        std::cout << "Unrecognised function " << (int)func << std::endl;
+        VALUE = std::make_shared<ScmInt>(ans);
     }
-    pop_continuation();
-}
\ No newline at end of file
+}
@@ -23,6 +23,82 @@ enum OppCodes: std::uint8_t
     proc_end = 18,
     const_data = 19,
     unbind = 20,
+    data_offset = 21,
+    lookup_local = 22,
+    set_local = 23,
+    global_get = 24,
+    global_set = 25,
+    global_define = 26,
+    global_names = 27,
+    prim_add = 28,
+    prim_sub = 29,
+    prim_mul = 30,
+    prim_div = 31,
+    prim_mod = 32,
+    prim_num_eq = 33,
+    prim_lt = 34,
+    prim_gt = 35,
+    prim_le = 36,
+    prim_ge = 37,
+    prim_car = 38,
+    prim_cdr = 39,
+    prim_cons = 40,
+    prim_eq = 41,
+    prim_is_number = 42,
+    prim_is_string = 43,
+    prim_is_pair = 44,
+    prim_is_symbol = 45,
+    rebind = 46,
+    call_global = 47,
+    call_direct = 48,
+    box_slot = 49,
+    lookup_boxed = 50,
+    set_boxed = 51,
+    unchecked_add = 52,
+    unchecked_sub = 53,
+    unchecked_mul = 54,
+    unchecked_div = 55,
+    unchecked_mod = 56,
+    unchecked_num_eq = 57,
+    unchecked_lt = 58,
+    unchecked_gt = 59,
+    unchecked_le = 60,
+    unchecked_ge = 61,
+    lookup_push = 62,
+    const_push = 63,
+    lookup_apply = 64,
+    rebind_branch = 65,
+    branch_if_not = 66,
+    profile_point = 67,
+    profile_table = 68,
+    reg_enter = 69,
+    reg_const = 70,
+    reg_move = 71,
+    reg_global_get = 72,
+    reg_global_set = 73,
+    reg_global_define = 74,
+    reg_box = 75,
+    reg_unbox = 76,
+    reg_set_box = 77,
+    reg_prim = 78,
+    reg_branch_false = 79,
+    reg_branch_true = 80,
+    reg_branch_if_not = 81,
+    reg_loop = 82,
+    reg_call = 83,
+    reg_tail_call = 84,
+    reg_call_global = 85,
+    reg_tail_call_global = 86,
+    reg_call_direct = 87,
+    reg_tail_call_direct = 88,
+    reg_ret = 89,
+    reg_closure = 90,
+};
+enum class ProfileKinds: std::uint8_t
+{
+    procedure = 0,
+    branch = 1,
+    call = 2,
 };
 
 enum Types: std::uint8_t
@@ -32,13 +108,14 @@ enum Types: std::uint8_t
     number = 3,
     list = 4,
     symbol = 5,
+    pair = 6,
 };
 
 enum Defaults: std::uint8_t
 {
-    boolean_false = 1,
-    boolean_true = 2,
-    empty_list = 3,
+    boolean_false = 0,
+    boolean_true = 1,
+    empty_list = 2,
 };
 
 enum BuiltInFunctions : std::uint8_t
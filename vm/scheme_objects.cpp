@@ -11,6 +11,10 @@ ScmEnv::ScmEnv(std::shared_ptr<ScmEnv> prev_initial): prev(prev_initial)
     map = std::make_shared<env_map>();
 }
 
+ScmEnv::ScmEnv(std::shared_ptr<ScmEnv> prev_initial, uint32_t no_slots): prev(prev_initial), slots(no_slots)
+{
+}
+
 std::string ScmInt::to_str(void)
 {
     return std::to_string(val); 
@@ -96,4 +100,17 @@ std::string ScmPair::to_str(void)
 void ScmPair::print(void)
 {
     std::cout << to_str();
-}
\ No newline at end of file
+}
+
+std::string ScmBox::to_str(void)
+{
+    if(val == nullptr) {
+        return "#f";
+    }
+    return val->to_str();
+}
+
+void ScmBox::print(void)
+{
+    std::cout << to_str();
+}
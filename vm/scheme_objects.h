@@ -4,6 +4,7 @@
 #include <stack>
 #include <string>
 #include <iostream>
+#include <vector>
 
 // typedef std::unordered_map<std::string, std::shared_ptr<ScmObj>> environment;
 
@@ -20,8 +21,11 @@ class ScmEnv {
 
     public:
     std::shared_ptr<ScmEnv> prev;
+    // Only the top level environment has a map, closures hold the variables they capture in slots
     std::shared_ptr<env_map> map;
+    std::vector<std::shared_ptr<ScmObj>> slots;
     ScmEnv(std::shared_ptr<ScmEnv> prev_initial);
+    ScmEnv(std::shared_ptr<ScmEnv> prev_initial, uint32_t no_slots);
     
 };
 
@@ -87,6 +91,16 @@ class ScmClosure : public ScmObj
 
 };
 
+// A variable that is set! and captured by a closure, the frame and the closure share the box
+class ScmBox : public ScmObj
+{
+    public:
+    std::shared_ptr<ScmObj> val;
+    void print(void) override;
+    std::string to_str(void) override;
+    ScmBox(std::shared_ptr<ScmObj> initial): val(initial) {}
+};
+
 using scm_stack = std::stack<std::shared_ptr<ScmObj> >;
 
 class ScmCont {
@@ -95,6 +109,11 @@ class ScmCont {
     std::shared_ptr<ScmEnv> env;
     std::shared_ptr<scm_stack> saved_stack;
     std::shared_ptr<ScmCont> prev;
-    ScmCont(uint32_t resume_loc_initial, std::shared_ptr<ScmEnv> env_initial, std::shared_ptr<scm_stack> saved_stack_initial, std::shared_ptr<ScmCont> prev_initial):
-        resume_loc(resume_loc_initial), env(env_initial), saved_stack(saved_stack_initial), prev(prev_initial) {}
+    // The size of the frame stack when the continuation was made, the frames above it are released on return
+    uint32_t no_frames;
+    uint32_t no_slots;
+    // In register based code, the register of the caller the value is returned to
+    uint32_t result_register = UINT32_MAX;
+    ScmCont(uint32_t resume_loc_initial, std::shared_ptr<ScmEnv> env_initial, std::shared_ptr<scm_stack> saved_stack_initial, std::shared_ptr<ScmCont> prev_initial, uint32_t no_frames_initial, uint32_t no_slots_initial):
+        resume_loc(resume_loc_initial), env(env_initial), saved_stack(saved_stack_initial), prev(prev_initial), no_frames(no_frames_initial), no_slots(no_slots_initial) {}
 };
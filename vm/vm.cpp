@@ -1,7 +1,13 @@
 #include "vm.h"
+#include <algorithm>
 
-VM::VM(std::ifstream& source, bool interactive): file(source), interactive(interactive)
+VM::VM(std::ifstream& source, bool interactive, bool counting, std::string profile_path): file(source), interactive(interactive), counting(counting), profile_path(profile_path)
 {
+    profiling = !profile_path.empty();
+    if(counting) {
+        opp_counts.resize(256);
+        pair_counts.resize(256 * 256);
+    }
     // Get the file size
     file.seekg(0, std::ios::end);
     file_size = file.tellg();
@@ -19,6 +25,7 @@ VM::VM(std::ifstream& source, bool interactive): file(source), interactive(inter
     vm_init();
     // Read all the constants from the input
     init_constants();
+    registers = file.peek() == OppCodes::reg_enter;
 }
 
 void inline VM::read_byte(uint8_t* dest)
@@ -78,11 +85,23 @@ void VM::run(void)
         std::cout << "Cannot run() while in interactive mode" << std::endl;
         exit(1);
     }
+    if(registers) {
+        while(fetch_execute_registers()) {
+            //
+        }
+        return;
+    }
     while(fetch_execute()) {
         //
     }
 }
 
+bool VM::step(void)
+{
+    // Run one instruction of either kind of code, for the debugger
+    return registers ? fetch_execute_registers() : fetch_execute();
+}
+
 void VM::print_list(uint32_t uid)
 {
     auto scm_pair = std::dynamic_pointer_cast<ScmPair>(constants[uid]);
@@ -98,33 +117,43 @@ void VM::init_constants(void)
 {
     uint8_t code;
     read_byte(&code);
+    // Files compiled in streaming mode have the data section at the end, and a header pointing to it
+    std::streampos code_start = -1;
+    if(code == OppCodes::data_offset) {
+        uint32_t data_address;
+        read_4_bytes(&data_address);
+        code_start = file.tellg();
+        file.seekg(data_address);
+        check_file();
+        read_byte(&code);
+    }
     if(code != OppCodes::data_start) {
         std::cout << "Data section does not start with a data_start OppCode" << std::endl;
     }
 
+    // The constants are stored in the order of their uids, right after the defaults
+    uint32_t no_constants;
+    read_4_bytes(&no_constants);
+    constants.reserve(constants.size() + no_constants);
+
     read_byte(&code);
     while(code == OppCodes::const_data) {
-        uint32_t uid;
-        read_4_bytes(&uid);
         uint8_t type;
         read_byte(&type);
         if(type == Types::number) {
             double val;
             read_double(&val);
-            auto num = std::make_shared<ScmInt>(val);
-            constants.insert(std::pair<uint32_t, std::shared_ptr<ScmObj> >(uid, num));
+            constants.push_back(std::make_shared<ScmInt>(val));
             std::cout << std::fixed << std::setprecision(7);
 
         } else if(type == Types::string) {
             // std::cout << "string" << std::endl;
             std::string val = read_string();
-            auto str = std::make_shared<ScmStr>(val);
-            constants.insert(std::pair<uint32_t, std::shared_ptr<ScmObj> >(uid, str));
+            constants.push_back(std::make_shared<ScmStr>(val));
 
         } else if(type == Types::symbol) {
             std::string val = read_string();
-            auto sym = std::make_shared<ScmSym>(val);
-            constants.insert(std::pair<uint32_t, std::shared_ptr<ScmObj> >(uid, sym));
+            constants.push_back(std::make_shared<ScmSym>(val));
 
         } else if(type == Types::list) {
 
@@ -137,23 +166,45 @@ void VM::init_constants(void)
                 read_4_bytes(&uid);
                 list_uids.push_back(uid);
             }
-            
+
             // Create the list object using ScmPair
             std::shared_ptr<ScmObj> cur = constants[Defaults::empty_list];
             for(int i = len_list - 1; i >= 0; i--) {
                 cur = std::make_shared<ScmPair>(constants[list_uids[i]], cur);
             }
-            constants[uid] = cur;
+            constants.push_back(cur);
+        } else if(type == Types::pair) {
+            // The car and the cdr always come before the pair in the data section
+            uint32_t car, cdr;
+            read_4_bytes(&car);
+            read_4_bytes(&cdr);
+            constants.push_back(std::make_shared<ScmPair>(constants[car], constants[cdr]));
         } else {
             std::cout << "Of unknown type " << (unsigned int) type << " at pos " << (static_cast<int>(file.tellg()) - 1) << std::endl;
             exit(1);
         }
         read_byte(&code);
     }
+    if(code == OppCodes::global_names) {
+        init_globals();
+        read_byte(&code);
+    }
+    if(code == OppCodes::profile_table) {
+        uint32_t table_address;
+        read_4_bytes(&table_address);
+        if(profiling) {
+            read_profile_table(table_address);
+        }
+        read_byte(&code);
+    }
     if(code != OppCodes::data_end) {
         std::cout << "Data section does not end with a data_end OppCode" << std::endl;
         exit(1);
     }
+    if(code_start != -1) {
+        file.seekg(code_start);
+        check_file();
+    }
 }
 
 void VM::vm_init(void)
@@ -166,24 +217,91 @@ void VM::vm_init(void)
         auto closure = std::make_shared<ScmClosure>(true, static_cast<BuiltInFunctions>(i), 0, top_level_env);
         top_level_env->map->insert(std::pair<std::string, std::shared_ptr<ScmObj> >(proc_name, closure));
     }
+    // In the order of their uids in Defaults
     constants = {
-        std::pair<uint32_t, std::shared_ptr<ScmObj> >(Defaults::boolean_true, std::make_shared<ScmBool>(true)),
-        std::pair<uint32_t, std::shared_ptr<ScmObj> >(Defaults::boolean_false, std::make_shared<ScmBool>(false)),
-        std::pair<uint32_t, std::shared_ptr<ScmObj> >(Defaults::empty_list, std::make_shared<ScmPair>(nullptr, nullptr)),
+        std::make_shared<ScmBool>(false),
+        std::make_shared<ScmBool>(true),
+        std::make_shared<ScmPair>(nullptr, nullptr),
     };
 }
 
-std::shared_ptr<ScmObj> VM::lookup_var(std::string var)
+void VM::init_globals(void)
 {
-    std::shared_ptr<ScmEnv> cur = ENVT;
-    while(cur != nullptr) {
-        auto obj = cur->map->find(var);
-        if (obj != cur->map->end()) {
-            return obj->second;
+    // The names of the global variables in the order of their indices. The built ins are the only globals
+    // that have a value before the program runs
+    uint32_t no_globals;
+    read_4_bytes(&no_globals);
+    globals.reserve(no_globals);
+    global_names.reserve(no_globals);
+    for(uint32_t i = 0; i < no_globals; i++) {
+        std::string name = read_string();
+        auto obj = top_level_env->map->find(name);
+        globals.push_back(obj != top_level_env->map->end() ? obj->second : std::shared_ptr<ScmObj>(nullptr));
+        global_names.push_back(name);
+    }
+}
+
+void VM::read_profile_table(uint32_t table_address)
+{
+    // The table is after the code, the data section is read before the program runs so the position is restored
+    auto pos_backup = file.tellg();
+    file.seekg(table_address);
+    check_file();
+    uint32_t no_points;
+    read_4_bytes(&no_points);
+    for(uint32_t i = 0; i < no_points; i++) {
+        uint8_t kind;
+        uint32_t address, id;
+        read_byte(&kind);
+        read_4_bytes(&address);
+        read_4_bytes(&id);
+        if(kind == static_cast<uint8_t>(ProfileKinds::procedure)) {
+            procedure_ids[address] = id;
+        } else if(kind == static_cast<uint8_t>(ProfileKinds::branch)) {
+            branch_ids[address] = id;
+        } else {
+            call_ids[address] = id;
         }
-        cur = cur->prev;
     }
-    return std::shared_ptr<ScmObj>(nullptr);
+    file.seekg(pos_backup);
+    check_file();
+}
+
+void VM::profile_call(uint32_t call_address, uint32_t procedure_address)
+{
+    if(procedure_address != no_procedure) {
+        procedure_calls[procedure_address]++;
+    }
+    call_targets[call_address][procedure_address]++;
+}
+
+void VM::profile_branch(uint32_t branch_address)
+{
+    // Counted by the value of the test, so the counts do not depend on which arm the compiler placed first
+    auto& counts = branch_counts[branch_address];
+    if(VALUE != constants[Defaults::boolean_false]) {
+        counts.first++;
+    } else {
+        counts.second++;
+    }
+}
+
+std::shared_ptr<ScmObj>& VM::slot_at(uint32_t depth, uint32_t index)
+{
+    return slot_stack[frame_bases[frame_bases.size() - 1 - depth] + index];
+}
+
+void VM::push_frame(std::shared_ptr<ScmEnv> closure_env)
+{
+    // The outermost frame of a procedure holds the variables its closure captured
+    frame_bases.push_back(slot_stack.size());
+    slot_stack.insert(slot_stack.end(), closure_env->slots.begin(), closure_env->slots.end());
+}
+
+void VM::release_frames(uint32_t no_frames, uint32_t no_slots)
+{
+    frame_bases.resize(no_frames);
+    slot_stack.resize(no_slots);
 }
 
 void VM::pop_continuation(void)
@@ -199,12 +317,13 @@ void VM::pop_continuation(void)
     check_file();
     STACK = cur_cont->saved_stack;
     ENVT = cur_cont->env;
+    release_frames(cur_cont->no_frames, cur_cont->no_slots);
     CONT = prev;
 }
 
 void VM::push_continuation(uint32_t resume_loc)
 {
-    auto new_cont = std::make_shared<ScmCont>(resume_loc, ENVT, STACK, CONT);
+    auto new_cont = std::make_shared<ScmCont>(resume_loc, ENVT, STACK, CONT, frame_bases.size(), slot_stack.size());
     auto new_stack = std::make_shared<scm_stack>();
     STACK = new_stack;
     CONT = new_cont;
@@ -222,67 +341,149 @@ void VM::is_stack_size(int size, std::string func_name)
 bool VM::fetch_execute(void)
 {
     uint8_t code;
+    // The profile points are found by the address of their instruction
+    uint32_t address = profiling ? static_cast<uint32_t>(file.tellg()) : 0;
     read_byte(&code);
     check_file();
+    if(counting) {
+        opp_counts[code]++;
+        pair_counts[prev_code * 256 + code]++;
+        prev_code = code;
+    }
     if(code == OppCodes::ext) {
         return false;
     } else if(code == OppCodes::opp_null) {
         // Nothing to do
-    } else if (code == OppCodes::lookup) {
-        auto var = read_string();
-        check_file();
-        auto val = lookup_var(var);
-        if (val != nullptr) {
-            VALUE = val;
-        } else {
-            std::cout << "Unbound variable " << var << std::endl;
+    } else if (code == OppCodes::global_get) {
+        uint32_t index;
+        read_4_bytes(&index);
+        VALUE = globals[index];
+        if (VALUE == nullptr) {
+            std::cout << "Unbound variable " << global_names[index] << std::endl;
             exit(1);
         }
-    } else if (code == OppCodes::load_const) {
+    } else if (code == OppCodes::lookup_local || code == OppCodes::lookup_push) {
+        uint32_t depth, index;
+        read_4_bytes(&depth);
+        read_4_bytes(&index);
+        VALUE = slot_at(depth, index);
+        if(code == OppCodes::lookup_push) {
+            STACK->push(VALUE);
+        }
+    } else if (code == OppCodes::set_local) {
+        uint32_t depth, index;
+        read_4_bytes(&depth);
+        read_4_bytes(&index);
+        slot_at(depth, index) = VALUE;
+    } else if (code == OppCodes::lookup_boxed) {
+        uint32_t depth, index;
+        read_4_bytes(&depth);
+        read_4_bytes(&index);
+        VALUE = std::static_pointer_cast<ScmBox>(slot_at(depth, index))->val;
+    } else if (code == OppCodes::set_boxed) {
+        uint32_t depth, index;
+        read_4_bytes(&depth);
+        read_4_bytes(&index);
+        std::static_pointer_cast<ScmBox>(slot_at(depth, index))->val = VALUE;
+    } else if (code == OppCodes::box_slot) {
+        uint8_t index;
+        read_byte(&index);
+        auto& slot = slot_at(0, index);
+        slot = std::make_shared<ScmBox>(slot);
+    } else if (code == OppCodes::load_const || code == OppCodes::const_push) {
         uint32_t uid;
         read_4_bytes(&uid);
         check_file();
-        auto iter = constants.find(uid);
-        if (iter != constants.end()) {
-            VALUE = iter->second;
+        if (uid < constants.size()) {
+            VALUE = constants[uid];
         } else {
             std::cout << "Unbound constant with uid " << uid << std::endl;
             exit(1);
         }
+        if(code == OppCodes::const_push) {
+            STACK->push(VALUE);
+        }
     } else if (code == OppCodes::bind) {
         uint8_t no_vars;
         read_byte(&no_vars);
         check_file();
         
-        // Create and set the new environment
-        auto new_env = std::make_shared<ScmEnv>(ENVT);
-        ENVT = new_env;
+        // Push a new frame, the first value on the stack goes in slot 0
+        frame_bases.push_back(slot_stack.size());
         for(auto i = 0; i < no_vars; i++) {
-            auto var_str = read_string();
-            check_file();
             if(!STACK->empty()) {
-                std::shared_ptr<ScmObj> var_val = STACK->top();
+                slot_stack.push_back(STACK->top());
                 STACK->pop();
-                ENVT->map->insert({var_str, var_val});
             } else {
                 std::cout << "Error: empty stack while trying to bind variables" << std::endl;
                 exit(1);
             }
         }
-    } else if (code == OppCodes::apply) {
+    } else if (code == OppCodes::rebind || code == OppCodes::rebind_branch) {
+        uint32_t branch_address;
+        if(code == OppCodes::rebind_branch) {
+            read_4_bytes(&branch_address);
+        }
+        uint8_t no_vars;
+        read_byte(&no_vars);
+        // A self tail call, the arguments replace the ones in the current frame
+        uint32_t base = frame_bases.back();
+        for(auto i = 0; i < no_vars; i++) {
+            slot_stack[base + i] = STACK->top();
+            STACK->pop();
+        }
+        if(code == OppCodes::rebind_branch) {
+            file.seekg(branch_address);
+            check_file();
+        }
+    } else if (code == OppCodes::apply || code == OppCodes::lookup_apply) {
+        if(code == OppCodes::lookup_apply) {
+            uint32_t depth, index;
+            read_4_bytes(&depth);
+            read_4_bytes(&index);
+            VALUE = slot_at(depth, index);
+        }
         std::shared_ptr<ScmClosure> closure = std::dynamic_pointer_cast<ScmClosure>(VALUE);
         if(closure == nullptr) {
             std::cout << "Trying to apply a non procedure" << std::endl;
             exit(1);
         }
+        if(profiling) {
+            profile_call(address, closure->built_in ? no_procedure : closure->porc_address);
+        }
         if(closure->built_in) {
             apply_builtin(closure);
         } else {
+            // Right after save_continuation nothing was bound, so this only releases the frames of the
+            // procedure making a call in tail position
+            if(CONT != nullptr) {
+                release_frames(CONT->no_frames, CONT->no_slots);
+            }
             ENVT = closure->closure_env;
+            push_frame(ENVT);
             // !! This is a converstion from unsigned int to int, which might be lossy !!
             file.seekg(closure->porc_address);
             check_file();
         }
+    } else if (code == OppCodes::call_direct) {
+        uint32_t index, procedure_address;
+        read_4_bytes(&index);
+        read_4_bytes(&procedure_address);
+        // A call to a lambda defined at the top level that is never set!, so the closure is not needed
+        if(globals[index] == nullptr) {
+            std::cout << "Unbound variable " << global_names[index] << std::endl;
+            exit(1);
+        }
+        if(profiling) {
+            profile_call(address, procedure_address);
+        }
+        if(CONT != nullptr) {
+            release_frames(CONT->no_frames, CONT->no_slots);
+        }
+        ENVT = top_level_env;
+        push_frame(ENVT);
+        file.seekg(procedure_address);
+        check_file();
     } else if (code == OppCodes::ret) {
         pop_continuation();
     } else if (code == OppCodes::save_continuation) {
@@ -292,6 +493,29 @@ bool VM::fetch_execute(void)
     } else if (code == OppCodes::if_false_branch) {
         uint32_t branch_address;
         read_4_bytes(&branch_address);
+        if(profiling) {
+            profile_branch(address);
+        }
+        if(VALUE == constants[Defaults::boolean_false]) {
+            file.seekg(branch_address);
+            check_file();
+        }
+    } else if (code == OppCodes::branch_if_not) {
+        uint32_t branch_address;
+        uint8_t test;
+        read_4_bytes(&branch_address);
+        read_byte(&test);
+        // A primitive test followed by an if_false_branch, the tests take no input
+        if(test >= OppCodes::unchecked_add) {
+            auto primitive = primitives[test - OppCodes::unchecked_add];
+            apply_unchecked(primitive.first, primitive.second);
+        } else {
+            auto primitive = primitives[test - OppCodes::prim_add];
+            apply_primitive(primitive.first, primitive.second);
+        }
+        if(profiling) {
+            profile_branch(address);
+        }
         if(VALUE == constants[Defaults::boolean_false]) {
             file.seekg(branch_address);
             check_file();
@@ -299,6 +523,9 @@ bool VM::fetch_execute(void)
     } else if (code == OppCodes::if_true_branch) {
         uint32_t branch_address;
         read_4_bytes(&branch_address);
+        if(profiling) {
+            profile_branch(address);
+        }
         if(VALUE != constants[Defaults::boolean_false]) {
             file.seekg(branch_address);
             check_file();
@@ -311,49 +538,73 @@ bool VM::fetch_execute(void)
     } else if (code == OppCodes::push) {
         STACK->push(VALUE);
     } else if (code == OppCodes::make_closure) {
-        uint32_t closure_address;
+        uint32_t closure_address, no_captured;
         read_4_bytes(&closure_address);
-        auto new_closure = std::make_shared<ScmClosure>(false, BuiltInFunctions::not_built_in, closure_address, ENVT);
-        VALUE = new_closure;
-    } else if (code == OppCodes::set) {
-        std::string var = read_string();
-        std::shared_ptr<ScmEnv> cur = ENVT;
-        bool found = false;
-        while(cur != nullptr) {
-            auto obj = cur->map->find(var);
-            if (obj != cur->map->end()) {
-                found = true;
-                obj->second = VALUE;
+        read_4_bytes(&no_captured);
+        // Closures are flat, the variables they capture are on the stack, the first one on the very top. A
+        // closure that captures nothing only needs the top level environment
+        auto closure_env = top_level_env;
+        if(no_captured != 0) {
+            closure_env = std::make_shared<ScmEnv>(nullptr, no_captured);
+            for(uint32_t i = 0; i < no_captured; i++) {
+                closure_env->slots[i] = STACK->top();
+                STACK->pop();
             }
-            cur = cur->prev;
         }
-        if(!found) {
-            std::cout << "Unable to set " << var << " could not find value" << std::endl;
+        auto new_closure = std::make_shared<ScmClosure>(false, BuiltInFunctions::not_built_in, closure_address, closure_env);
+        VALUE = new_closure;
+    } else if (code == OppCodes::global_set) {
+        uint32_t index;
+        read_4_bytes(&index);
+        if (globals[index] != nullptr) {
+            globals[index] = VALUE;
+        } else {
+            std::cout << "Unable to set " << global_names[index] << " could not find value" << std::endl;
             exit(1);
         }
-    } else if (code == OppCodes::define) {
-        std::string var = read_string();
-        auto val = top_level_env->map->find(var);
-        if(val != top_level_env->map->end()) {
-            std::cout << "Unable to define " << var << " , value already exists" << std::endl;
+    } else if (code == OppCodes::global_define) {
+        uint32_t index;
+        read_4_bytes(&index);
+        if(globals[index] != nullptr) {
+            std::cout << "Unable to define " << global_names[index] << " , value already exists" << std::endl;
             exit(1);
         } else {
-            top_level_env->map->insert({var, VALUE});
+            globals[index] = VALUE;
         }
     } else if (code == OppCodes::label) {
         // Do nothing
     } else if (code == OppCodes::proc_end) {
         std::cout << "Reached proc end at " << (int) file.tellg() << std::endl;
         exit(1);
-    } else if (code == OppCodes::data_start || code == OppCodes::data_end || code == OppCodes::const_data) {
+    } else if (code == OppCodes::data_start || code == OppCodes::data_end || code == OppCodes::const_data || code == OppCodes::data_offset || code == OppCodes::global_names || code == OppCodes::profile_table) {
         std::cout << "Const data instruction at " << (int) file.tellg() << std::endl;
         exit(1);
+    } else if (code >= OppCodes::prim_add && code <= OppCodes::prim_is_symbol) {
+        // Calls to built ins that the compiler knows are not redefined, they run without a continuation
+        auto primitive = primitives[code - OppCodes::prim_add];
+        uint32_t no_args = primitive.second;
+        if(code <= OppCodes::prim_div) {
+            uint8_t no_args_byte;
+            read_byte(&no_args_byte);
+            no_args = no_args_byte;
+        }
+        apply_primitive(primitive.first, no_args);
+    } else if (code >= OppCodes::unchecked_add && code <= OppCodes::unchecked_ge) {
+        // The same operations on arguments the compiler knows are numbers
+        auto primitive = primitives[code - OppCodes::unchecked_add];
+        uint32_t no_args = primitive.second;
+        if(code <= OppCodes::unchecked_div) {
+            uint8_t no_args_byte;
+            read_byte(&no_args_byte);
+            no_args = no_args_byte;
+        }
+        apply_unchecked(primitive.first, no_args);
     } else if(code == OppCodes::unbind) {
-        if(ENVT->prev == nullptr) {
+        if(frame_bases.empty()) {
             std::cout << "Trying to unbind at top level" << std::endl;
             exit(1);
         } else {
-            ENVT = ENVT->prev;
+            release_frames(frame_bases.size() - 1, frame_bases.back());
         }
     } else {
         std::cout << "Unknown instruction " << (int) code << " At position " << std::hex << (int)(file.tellg()) << std::endl;
@@ -362,10 +613,400 @@ bool VM::fetch_execute(void)
     return true;
 }
 
+std::shared_ptr<ScmObj>& VM::register_at(uint8_t index)
+{
+    return slot_stack[frame_bases.back() + index];
+}
+
+void VM::read_register_values(void)
+{
+    // A count byte and the registers, their values go in register_values in the same order
+    uint8_t no_registers;
+    uint8_t indices[256];
+    read_byte(&no_registers);
+    file.read(reinterpret_cast<char*>(indices), no_registers);
+    check_file();
+    register_values.resize(no_registers);
+    for(uint8_t i = 0; i < no_registers; i++) {
+        register_values[i] = register_at(indices[i]);
+    }
+}
+
+void VM::run_register_primitive(uint8_t opp)
+{
+    // The unchecked operations on two numbers are the most common ones, they are run on the registers directly
+    if(opp >= OppCodes::unchecked_add && register_values.size() == 2) {
+        double a = std::static_pointer_cast<ScmInt>(register_values[0])->val;
+        double b = std::static_pointer_cast<ScmInt>(register_values[1])->val;
+        if(opp == OppCodes::unchecked_add) {
+            VALUE = std::make_shared<ScmInt>(a + b);
+        } else if(opp == OppCodes::unchecked_sub) {
+            VALUE = std::make_shared<ScmInt>(a - b);
+        } else if(opp == OppCodes::unchecked_mul) {
+            VALUE = std::make_shared<ScmInt>(a * b);
+        } else if(opp == OppCodes::unchecked_div) {
+            VALUE = std::make_shared<ScmInt>(a / b);
+        } else if(opp == OppCodes::unchecked_mod) {
+            VALUE = std::make_shared<ScmInt>(int(a) % int(b));
+        } else {
+            bool ans = opp == OppCodes::unchecked_num_eq ? a == b : opp == OppCodes::unchecked_lt ? a < b :
+                       opp == OppCodes::unchecked_gt ? a > b : opp == OppCodes::unchecked_le ? a <= b : a >= b;
+            VALUE = constants[ans ? Defaults::boolean_true : Defaults::boolean_false];
+        }
+        return;
+    }
+    // The other primitives take their arguments on the stack with the first one on top, the result is put in VALUE
+    for(size_t i = register_values.size(); i > 0; i--) {
+        STACK->push(register_values[i - 1]);
+    }
+    if(opp >= OppCodes::unchecked_add) {
+        apply_unchecked(primitives[opp - OppCodes::unchecked_add].first, register_values.size());
+    } else {
+        apply_primitive(primitives[opp - OppCodes::prim_add].first, register_values.size());
+    }
+}
+
+void VM::register_call(std::shared_ptr<ScmObj> procedure, bool tail, uint8_t destination)
+{
+    // The arguments are in register_values
+    std::shared_ptr<ScmClosure> closure = std::dynamic_pointer_cast<ScmClosure>(procedure);
+    if(closure == nullptr) {
+        std::cout << "Trying to apply a non procedure" << std::endl;
+        exit(1);
+    }
+    if(!closure->built_in) {
+        enter_registers(closure->closure_env, closure->porc_address, tail, destination);
+        return;
+    }
+    for(size_t i = register_values.size(); i > 0; i--) {
+        STACK->push(register_values[i - 1]);
+    }
+    VALUE = closure;
+    run_builtin(closure);
+    // The stack based code gets a new stack for every call, the arguments a built in does not use are dropped
+    while(!STACK->empty()) {
+        STACK->pop();
+    }
+    if(tail) {
+        register_return(VALUE);
+    } else {
+        register_at(destination) = VALUE;
+    }
+}
+
+void VM::enter_registers(std::shared_ptr<ScmEnv> closure_env, uint32_t procedure_address, bool tail, uint8_t destination)
+{
+    // A call in tail position releases the frame of the procedure making it, the other calls save a continuation
+    // that returns to the next instruction. The new frame is the captured variables and the arguments, reg_enter
+    // makes room for the other registers
+    if(tail) {
+        if(CONT != nullptr) {
+            release_frames(CONT->no_frames, CONT->no_slots);
+        }
+    } else {
+        CONT = std::make_shared<ScmCont>(static_cast<uint32_t>(file.tellg()), ENVT, STACK, CONT, frame_bases.size(), slot_stack.size());
+        CONT->result_register = destination;
+    }
+    ENVT = closure_env;
+    push_frame(closure_env);
+    slot_stack.insert(slot_stack.end(), register_values.begin(), register_values.end());
+    file.seekg(procedure_address);
+    check_file();
+}
+
+void VM::register_return(std::shared_ptr<ScmObj> value)
+{
+    if(CONT == nullptr) {
+        std::cout << "Trying to pop an empty continuation chain" << std::endl;
+        exit(1);
+    }
+    uint32_t destination = CONT->result_register;
+    pop_continuation();
+    register_at(destination) = value;
+    VALUE = value;
+}
+
+bool VM::fetch_execute_registers(void)
+{
+    // The register based instructions, the programs compiled to them use no other instruction that changes
+    // VALUE, the stack or the frames
+    uint8_t code;
+    read_byte(&code);
+    if(counting) {
+        opp_counts[code]++;
+        pair_counts[prev_code * 256 + code]++;
+        prev_code = code;
+    }
+    if(code == OppCodes::reg_prim) {
+        uint8_t opp, destination;
+        read_byte(&opp);
+        read_byte(&destination);
+        read_register_values();
+        run_register_primitive(opp);
+        register_at(destination) = VALUE;
+    } else if(code == OppCodes::reg_const) {
+        uint8_t destination;
+        uint32_t uid;
+        read_byte(&destination);
+        read_4_bytes(&uid);
+        if(uid >= constants.size()) {
+            std::cout << "Unbound constant with uid " << uid << std::endl;
+            exit(1);
+        }
+        register_at(destination) = constants[uid];
+    } else if(code == OppCodes::reg_move) {
+        uint8_t destination, source;
+        read_byte(&destination);
+        read_byte(&source);
+        register_at(destination) = register_at(source);
+    } else if(code == OppCodes::reg_branch_if_not) {
+        uint32_t branch_address;
+        uint8_t test;
+        read_4_bytes(&branch_address);
+        read_byte(&test);
+        read_register_values();
+        run_register_primitive(test);
+        if(VALUE == constants[Defaults::boolean_false]) {
+            file.seekg(branch_address);
+            check_file();
+        }
+    } else if(code == OppCodes::reg_branch_false || code == OppCodes::reg_branch_true) {
+        uint32_t branch_address;
+        uint8_t index;
+        read_4_bytes(&branch_address);
+        read_byte(&index);
+        if((register_at(index) == constants[Defaults::boolean_false]) == (code == OppCodes::reg_branch_false)) {
+            file.seekg(branch_address);
+            check_file();
+        }
+    } else if(code == OppCodes::reg_ret) {
+        uint8_t index;
+        read_byte(&index);
+        register_return(register_at(index));
+    } else if(code == OppCodes::reg_call_direct || code == OppCodes::reg_tail_call_direct) {
+        uint32_t index, procedure_address;
+        uint8_t destination = 0;
+        read_4_bytes(&index);
+        read_4_bytes(&procedure_address);
+        if(code == OppCodes::reg_call_direct) {
+            read_byte(&destination);
+        }
+        read_register_values();
+        // A call to a lambda defined at the top level that is never set!, so the closure is not needed
+        if(globals[index] == nullptr) {
+            std::cout << "Unbound variable " << global_names[index] << std::endl;
+            exit(1);
+        }
+        enter_registers(top_level_env, procedure_address, code == OppCodes::reg_tail_call_direct, destination);
+    } else if(code == OppCodes::reg_call_global || code == OppCodes::reg_tail_call_global) {
+        uint32_t index;
+        uint8_t destination = 0;
+        read_4_bytes(&index);
+        if(code == OppCodes::reg_call_global) {
+            read_byte(&destination);
+        }
+        read_register_values();
+        if(globals[index] == nullptr) {
+            std::cout << "Unbound variable " << global_names[index] << std::endl;
+            exit(1);
+        }
+        register_call(globals[index], code == OppCodes::reg_tail_call_global, destination);
+    } else if(code == OppCodes::reg_call || code == OppCodes::reg_tail_call) {
+        uint8_t procedure, destination = 0;
+        read_byte(&procedure);
+        if(code == OppCodes::reg_call) {
+            read_byte(&destination);
+        }
+        read_register_values();
+        register_call(register_at(procedure), code == OppCodes::reg_tail_call, destination);
+    } else if(code == OppCodes::reg_enter) {
+        uint32_t frame_size, no_parameters;
+        read_4_bytes(&frame_size);
+        read_4_bytes(&no_parameters);
+        // The main instructions get the first frame
+        if(frame_bases.empty()) {
+            frame_bases.push_back(slot_stack.size());
+        }
+        if(slot_stack.size() - frame_bases.back() != no_parameters) {
+            std::cout << "Wrong number of arguments, the procedure takes " << no_parameters - ENVT->slots.size() << std::endl;
+            exit(1);
+        }
+        slot_stack.resize(frame_bases.back() + frame_size);
+    } else if(code == OppCodes::reg_loop) {
+        uint32_t branch_address;
+        uint8_t base;
+        read_4_bytes(&branch_address);
+        read_byte(&base);
+        read_register_values();
+        // A self tail call, all the arguments are read before any of them replaces a variable
+        for(size_t i = 0; i < register_values.size(); i++) {
+            register_at(base + i) = register_values[i];
+        }
+        file.seekg(branch_address);
+        check_file();
+    } else if(code == OppCodes::branch) {
+        uint32_t branch_address;
+        read_4_bytes(&branch_address);
+        file.seekg(branch_address);
+        check_file();
+    } else if(code == OppCodes::reg_global_get) {
+        uint8_t destination;
+        uint32_t index;
+        read_byte(&destination);
+        read_4_bytes(&index);
+        if(globals[index] == nullptr) {
+            std::cout << "Unbound variable " << global_names[index] << std::endl;
+            exit(1);
+        }
+        register_at(destination) = globals[index];
+    } else if(code == OppCodes::reg_global_set) {
+        uint8_t source;
+        uint32_t index;
+        read_byte(&source);
+        read_4_bytes(&index);
+        if(globals[index] == nullptr) {
+            std::cout << "Unable to set " << global_names[index] << " could not find value" << std::endl;
+            exit(1);
+        }
+        globals[index] = register_at(source);
+    } else if(code == OppCodes::reg_global_define) {
+        uint8_t source;
+        uint32_t index;
+        read_byte(&source);
+        read_4_bytes(&index);
+        if(globals[index] != nullptr) {
+            std::cout << "Unable to define " << global_names[index] << " , value already exists" << std::endl;
+            exit(1);
+        }
+        globals[index] = register_at(source);
+    } else if(code == OppCodes::reg_box) {
+        uint8_t index;
+        read_byte(&index);
+        auto& slot = register_at(index);
+        slot = std::make_shared<ScmBox>(slot);
+    } else if(code == OppCodes::reg_unbox) {
+        uint8_t destination, box;
+        read_byte(&destination);
+        read_byte(&box);
+        register_at(destination) = std::static_pointer_cast<ScmBox>(register_at(box))->val;
+    } else if(code == OppCodes::reg_set_box) {
+        uint8_t box, source;
+        read_byte(&box);
+        read_byte(&source);
+        std::static_pointer_cast<ScmBox>(register_at(box))->val = register_at(source);
+    } else if(code == OppCodes::reg_closure) {
+        uint32_t closure_address;
+        uint8_t destination;
+        read_4_bytes(&closure_address);
+        read_byte(&destination);
+        read_register_values();
+        // A closure that captures nothing only needs the top level environment
+        auto closure_env = top_level_env;
+        if(!register_values.empty()) {
+            closure_env = std::make_shared<ScmEnv>(nullptr, register_values.size());
+            std::copy(register_values.begin(), register_values.end(), closure_env->slots.begin());
+        }
+        register_at(destination) = std::make_shared<ScmClosure>(false, BuiltInFunctions::not_built_in, closure_address, closure_env);
+    } else if(code == OppCodes::ext) {
+        return false;
+    } else if(code == OppCodes::label || code == OppCodes::opp_null) {
+        // Nothing to do
+    } else if(code == OppCodes::proc_end) {
+        std::cout << "Reached proc end at " << (int) file.tellg() << std::endl;
+        exit(1);
+    } else {
+        std::cout << "Not a register instruction " << (int) code << " At position " << std::hex << (int)(file.tellg()) << std::endl;
+        exit(1);
+    }
+    return true;
+}
+
+void VM::print_stats(void)
+{
+    auto name = [this](uint8_t code) {
+        return code < opp_names.size() ? opp_names[code] : std::to_string((int) code);
+    };
+    uint64_t total = 0;
+    std::vector<std::pair<uint64_t, uint32_t> > opps, pairs;
+    for(uint32_t i = 0; i < opp_counts.size(); i++) {
+        total += opp_counts[i];
+        if(opp_counts[i] != 0) {
+            opps.push_back({opp_counts[i], i});
+        }
+    }
+    for(uint32_t i = 0; i < pair_counts.size(); i++) {
+        if(pair_counts[i] != 0) {
+            pairs.push_back({pair_counts[i], i});
+        }
+    }
+    std::sort(opps.rbegin(), opps.rend());
+    std::sort(pairs.rbegin(), pairs.rend());
+    std::cerr << "executed " << total << " instructions" << std::endl;
+    for(auto& opp : opps) {
+        std::cerr << "opp " << name(opp.second) << " " << opp.first << std::endl;
+    }
+    // The pairs executed most often are the candidates for superinstructions
+    for(size_t i = 0; i < pairs.size() && i < 20; i++) {
+        std::cerr << "pair " << name(pairs[i].second / 256) << " " << name(pairs[i].second % 256) << " " << pairs[i].first << std::endl;
+    }
+}
+
+void VM::write_profile(void)
+{
+    if(procedure_ids.empty() && branch_ids.empty() && call_ids.empty()) {
+        std::cerr << "The program has no profile points, compile it with -P to profile it" << std::endl;
+    }
+    // The compiler can copy an expression, the counts of the points with the same id are added up
+    std::map<uint32_t, uint64_t> procedures;
+    for(auto& count : procedure_calls) {
+        auto point = procedure_ids.find(count.first);
+        if(point != procedure_ids.end()) {
+            procedures[point->second] += count.second;
+        }
+    }
+    std::map<uint32_t, std::pair<uint64_t, uint64_t>> branches;
+    for(auto& count : branch_counts) {
+        auto point = branch_ids.find(count.first);
+        if(point != branch_ids.end()) {
+            branches[point->second].first += count.second.first;
+            branches[point->second].second += count.second.second;
+        }
+    }
+    // The target of a call is the id of the procedure, - for the built ins and the procedures without one
+    std::map<uint32_t, std::map<std::string, uint64_t>> calls;
+    for(auto& site : call_targets) {
+        auto point = call_ids.find(site.first);
+        if(point == call_ids.end()) {
+            continue;
+        }
+        for(auto& target : site.second) {
+            auto procedure = procedure_ids.find(target.first);
+            std::string target_id = procedure != procedure_ids.end() ? std::to_string(procedure->second) : "-";
+            calls[point->second][target_id] += target.second;
+        }
+    }
+    std::ofstream out(profile_path);
+    if(!out) {
+        std::cerr << "Unable to write the profile to " << profile_path << std::endl;
+        return;
+    }
+    for(auto& procedure : procedures) {
+        out << "procedure " << procedure.first << " " << procedure.second << "\n";
+    }
+    for(auto& branch : branches) {
+        out << "branch " << branch.first << " " << branch.second.first << " " << branch.second.second << "\n";
+    }
+    for(auto& site : calls) {
+        for(auto& target : site.second) {
+            out << "call " << site.first << " " << target.first << " " << target.second << "\n";
+        }
+    }
+}
+
 int main(int argc, char** argv)
 {
     if(argc < 2) {
-        std::cout << "Usage: vm <compiled_file_name>" << std::endl;
+        std::cout << "Usage: vm <compiled_file_name> [-d to debug | -s to count the executed instructions] [-p <profile_file> to write a profile]" << std::endl;
         return -1;
     }
     std::ifstream file(argv[1], std::ios::binary);
@@ -375,16 +1016,28 @@ int main(int argc, char** argv)
     }
     
     bool debugging = false;
-    if(argc == 3) {
-        if(std::string(argv[2]) == std::string("-d")) {
+    bool counting = false;
+    std::string profile_path;
+    for(int i = 2; i < argc; i++) {
+        if(std::string(argv[i]) == std::string("-d")) {
             debugging = true;
+        } else if(std::string(argv[i]) == std::string("-s")) {
+            counting = true;
+        } else if(std::string(argv[i]) == std::string("-p") && i + 1 < argc) {
+            profile_path = argv[++i];
         }
     }
     
-    VM virtual_machine = VM(file, debugging);
+    VM virtual_machine = VM(file, debugging, counting, profile_path);
 
     if(!debugging) {
         virtual_machine.run();
+        if(counting) {
+            virtual_machine.print_stats();
+        }
+        if(!profile_path.empty()) {
+            virtual_machine.write_profile();
+        }
         exit(0);
     } 
 
@@ -416,7 +1069,7 @@ int main(int argc, char** argv)
         }
         if (event == Event::Character(' ')) {
             virtual_machine.clear_out();
-            if(!virtual_machine.fetch_execute()) {
+            if(!virtual_machine.step()) {
                 screen.ExitLoopClosure()();
                 return true;
             }
@@ -7,22 +7,29 @@
 #include <ftxui/component/screen_interactive.hpp>
 #include <chrono>
 #include <ctime>
+#include <vector>
+#include <map>
 
 
 class VM
 {
     public:
-    VM(std::ifstream& source, bool interactive);
+    VM(std::ifstream& source, bool interactive, bool counting = false, std::string profile_path = "");
     void run(void);
+    void print_stats(void);
+    void write_profile(void);
     
     void clear_out(void);
+    bool step(void);
     bool fetch_execute(void);
+    bool fetch_execute_registers(void);
     ftxui::Element draw_stack(void);
     ftxui::Element draw_stack(std::shared_ptr<scm_stack> stck);
     ftxui::Element draw_value_register(void);
     ftxui::Element draw_instructions(void);
     ftxui::Element draw_environment(void);
     ftxui::Element draw_prev_environment(void);
+    ftxui::Element draw_frame(size_t depth);
     ftxui::Element draw_current_out(void);
     ftxui::Element draw_conts(void);
 
@@ -33,17 +40,54 @@ class VM
     std::shared_ptr<ScmEnv> ENVT;
     std::shared_ptr<ScmCont> CONT;
     std::shared_ptr<scm_stack> STACK;
+    // The frames of the lambdas and lets being run. Closures copy the variables they capture, so no frame
+    // outlives its unbind or the return of its procedure and the slots of all of them are kept in one vector.
+    // frame_bases has the index of the first slot of every frame, innermost last
+    std::vector<std::shared_ptr<ScmObj>> slot_stack;
+    std::vector<uint32_t> frame_bases;
+    // Programs compiled to register based instructions start with a reg_enter. Their registers are the slots of
+    // the innermost frame, every procedure has a single one. register_values is where the values of the registers
+    // an instruction reads are copied to before it writes any of them
+    bool registers = false;
+    std::vector<std::shared_ptr<ScmObj>> register_values;
 
     bool interactive;
+    // When counting, the number of times every OppCode and every pair of OppCodes run one after the other was
+    // executed, indexed by the OppCode and by previous * 256 + next
+    bool counting = false;
+    uint8_t prev_code = OppCodes::opp_null;
+    std::vector<uint64_t> opp_counts;
+    std::vector<uint64_t> pair_counts;
+    // When profiling, the id of every profile point by its address, one map for each of the ProfileKinds, and
+    // the number of times they were reached: the calls to every procedure, the times the test of every if was
+    // true and false, and the calls every call site made to every procedure. The built ins are called as
+    // no_procedure. Written to profile_path by write_profile, keyed by the ids
+    bool profiling = false;
+    std::string profile_path;
+    std::unordered_map<uint32_t, uint32_t> procedure_ids;
+    std::unordered_map<uint32_t, uint32_t> branch_ids;
+    std::unordered_map<uint32_t, uint32_t> call_ids;
+    std::unordered_map<uint32_t, uint64_t> procedure_calls;
+    std::unordered_map<uint32_t, std::pair<uint64_t, uint64_t>> branch_counts;
+    std::unordered_map<uint32_t, std::unordered_map<uint32_t, uint64_t>> call_targets;
+    static const uint32_t no_procedure = UINT32_MAX;
     std::ifstream& file;
     std::streampos file_size;
     std::shared_ptr<ScmEnv> top_level_env;
     std::shared_ptr<ScmCont> top_level_cont;
-    std::unordered_map<uint32_t, std::shared_ptr<ScmObj>> constants;
+    // Indexed by the constant uid, the defaults come first
+    std::vector<std::shared_ptr<ScmObj>> constants;
+    // Indexed by the global index the compiler gave the variable, nullptr until it is defined
+    std::vector<std::shared_ptr<ScmObj>> globals;
+    std::vector<std::string> global_names;
     std::string cur_out;
 
     void vm_init(void);
     void init_constants(void);
+    void init_globals(void);
+    void read_profile_table(uint32_t table_address);
+    void profile_call(uint32_t call_address, uint32_t procedure_address);
+    void profile_branch(uint32_t branch_address);
     void check_file(void);
     void read_byte(uint8_t* dest);
     void read_4_bytes(uint32_t* dest);
@@ -53,10 +97,63 @@ class VM
     void push_continuation(uint32_t resume_loc);
     void is_stack_size(int size, std::string func_name);
     void apply_builtin(std::shared_ptr<ScmClosure> closure);
+    void run_builtin(std::shared_ptr<ScmClosure> closure);
+    void apply_primitive(BuiltInFunctions func, uint32_t no_args);
+    std::shared_ptr<ScmInt> pop_number(BuiltInFunctions func);
+    void apply_unchecked(BuiltInFunctions func, uint32_t no_args);
+    double pop_unchecked(void);
 
     std::string read_string();
     bool print_instruction(std::string& out);
-    std::shared_ptr<ScmObj> lookup_var(std::string variable);
+    std::shared_ptr<ScmObj>& slot_at(uint32_t depth, uint32_t index);
+    void push_frame(std::shared_ptr<ScmEnv> closure_env);
+    void release_frames(uint32_t no_frames, uint32_t no_slots);
+    std::shared_ptr<ScmObj>& register_at(uint8_t index);
+    void read_register_values(void);
+    void run_register_primitive(uint8_t opp);
+    void register_call(std::shared_ptr<ScmObj> procedure, bool tail, uint8_t destination);
+    void enter_registers(std::shared_ptr<ScmEnv> closure_env, uint32_t procedure_address, bool tail, uint8_t destination);
+    void register_return(std::shared_ptr<ScmObj> value);
+
+    // The built in run by every primitive operation, in the order of their OppCodes starting from prim_add, and
+    // the number of arguments it takes. The arithmetic ones get the number of arguments from the instruction
+    std::vector<std::pair<BuiltInFunctions, uint8_t>> primitives {
+        {BuiltInFunctions::addition, 0},
+        {BuiltInFunctions::subtraction, 0},
+        {BuiltInFunctions::multiplication, 0},
+        {BuiltInFunctions::division, 0},
+        {BuiltInFunctions::modulo, 2},
+        {BuiltInFunctions::num_equal, 2},
+        {BuiltInFunctions::num_less, 2},
+        {BuiltInFunctions::num_greater, 2},
+        {BuiltInFunctions::num_less_equal, 2},
+        {BuiltInFunctions::num_greater_equal, 2},
+        {BuiltInFunctions::car, 1},
+        {BuiltInFunctions::cdr, 1},
+        {BuiltInFunctions::cons, 2},
+        {BuiltInFunctions::eq, 2},
+        {BuiltInFunctions::is_number, 1},
+        {BuiltInFunctions::is_string, 1},
+        {BuiltInFunctions::is_pair, 1},
+        {BuiltInFunctions::is_symbol, 1},
+    };
+
+    // The names of the OppCodes in the order of their values, for the instruction counts
+    std::vector<std::string> opp_names {
+        "opp_null", "lookup", "load_const", "bind", "apply", "ret", "save_continuation", "if_false_branch",
+        "if_true_branch", "branch", "push", "make_closure", "set", "define", "ext", "data_start", "data_end",
+        "label", "proc_end", "const_data", "unbind", "data_offset", "lookup_local", "set_local", "global_get",
+        "global_set", "global_define", "global_names", "prim_add", "prim_sub", "prim_mul", "prim_div", "prim_mod",
+        "prim_num_eq", "prim_lt", "prim_gt", "prim_le", "prim_ge", "prim_car", "prim_cdr", "prim_cons", "prim_eq",
+        "prim_is_number", "prim_is_string", "prim_is_pair", "prim_is_symbol", "rebind", "call_global", "call_direct",
+        "box_slot", "lookup_boxed", "set_boxed", "unchecked_add", "unchecked_sub", "unchecked_mul", "unchecked_div",
+        "unchecked_mod", "unchecked_num_eq", "unchecked_lt", "unchecked_gt", "unchecked_le", "unchecked_ge",
+        "lookup_push", "const_push", "lookup_apply", "rebind_branch", "branch_if_not", "profile_point", "profile_table",
+        "reg_enter", "reg_const", "reg_move", "reg_global_get", "reg_global_set", "reg_global_define", "reg_box",
+        "reg_unbox", "reg_set_box", "reg_prim", "reg_branch_false", "reg_branch_true", "reg_branch_if_not", "reg_loop",
+        "reg_call", "reg_tail_call", "reg_call_global", "reg_tail_call_global", "reg_call_direct", "reg_tail_call_direct",
+        "reg_ret", "reg_closure"
+    };
 
     // update this to use the constexpr vectory or array
     std::unordered_map<BuiltInFunctions, std::string> built_in {
@@ -31,30 +31,56 @@ bool VM::print_instruction(std::string& out)
     } else if(code == OppCodes::opp_null) {
         // Nothing to do
         out = "null_opp";
-    } else if (code == OppCodes::lookup) {
-        auto var = read_string();
-        check_file();
-        out =  "lookup " + var;
-    } else if (code == OppCodes::load_const) {
+    } else if (code == OppCodes::global_get || code == OppCodes::global_set || code == OppCodes::global_define) {
+        uint32_t index;
+        read_4_bytes(&index);
+        std::string name = index < global_names.size() ? global_names[index] : std::to_string(index);
+        if(code == OppCodes::global_get) {
+            out = "global_get " + name;
+        } else if(code == OppCodes::global_set) {
+            out = "global_set " + name;
+        } else {
+            out = "global_define " + name;
+        }
+    } else if (code == OppCodes::lookup_local || code == OppCodes::set_local || code == OppCodes::lookup_push || code == OppCodes::lookup_apply) {
+        uint32_t depth, index;
+        read_4_bytes(&depth);
+        read_4_bytes(&index);
+        out = opp_names[code] + " " + std::to_string(depth) + " " + std::to_string(index);
+    } else if (code == OppCodes::lookup_boxed || code == OppCodes::set_boxed) {
+        uint32_t depth, index;
+        read_4_bytes(&depth);
+        read_4_bytes(&index);
+        out = std::string(code == OppCodes::lookup_boxed ? "lookup_boxed " : "set_boxed ") + std::to_string(depth) + " " + std::to_string(index);
+    } else if (code == OppCodes::box_slot) {
+        uint8_t index;
+        read_byte(&index);
+        out = "box_slot " + std::to_string(index);
+    } else if (code == OppCodes::load_const || code == OppCodes::const_push) {
         uint32_t uid;
         read_4_bytes(&uid);
         check_file();
-        out = (std::string("load_const ") + std::string("<") + std::to_string(uid) + std::string(">"));
+        out = (opp_names[code] + std::string(" <") + std::to_string(uid) + std::string(">"));
     } else if (code == OppCodes::bind) {
         std::string temp = "bind ";
         uint8_t no_vars;
         read_byte(&no_vars);
         check_file();
         temp += std::to_string(no_vars);
-        temp += " ";
-        for(auto i = 0; i < no_vars; i++) {
-            auto var_str = read_string();
-            check_file();
-            temp += var_str + " ";
-        }
         out = temp;
+    } else if (code == OppCodes::rebind) {
+        uint8_t no_vars;
+        read_byte(&no_vars);
+        out = "rebind " + std::to_string(no_vars);
     } else if (code == OppCodes::apply) {
         out =  "apply";
+    } else if (code == OppCodes::call_direct) {
+        uint32_t index, procedure_address;
+        read_4_bytes(&index);
+        read_4_bytes(&procedure_address);
+        std::stringstream stream;
+        stream << "0x" << std::hex << std::uppercase << procedure_address;
+        out = "call_direct " + global_names[index] + " " + stream.str();
     } else if (code == OppCodes::ret) {
         out = "ret";
     } else if (code == OppCodes::save_continuation) {
@@ -82,28 +108,146 @@ bool VM::print_instruction(std::string& out)
         std::stringstream stream;
         stream << "0x" << std::hex << std::uppercase << branch_address;
         out = "branch " + stream.str();
+    } else if (code == OppCodes::rebind_branch) {
+        uint32_t branch_address;
+        uint8_t no_vars;
+        read_4_bytes(&branch_address);
+        read_byte(&no_vars);
+        std::stringstream stream;
+        stream << "0x" << std::hex << std::uppercase << branch_address;
+        out = "rebind_branch " + std::to_string(no_vars) + " " + stream.str();
+    } else if (code == OppCodes::branch_if_not) {
+        uint32_t branch_address;
+        uint8_t test;
+        read_4_bytes(&branch_address);
+        read_byte(&test);
+        std::stringstream stream;
+        stream << "0x" << std::hex << std::uppercase << branch_address;
+        // The listing of the test is the one of a primitive, like "unchecked <"
+        auto primitive = test >= OppCodes::unchecked_add ? "unchecked " + built_in.find(primitives[test - OppCodes::unchecked_add].first)->second
+                                                         : built_in.find(primitives[test - OppCodes::prim_add].first)->second;
+        out = "branch_if_not " + primitive + " " + stream.str();
     } else if (code == OppCodes::push) {
         out = "push";
     } else if (code == OppCodes::make_closure) {
-        uint32_t branch_address;
+        uint32_t branch_address, no_captured;
         read_4_bytes(&branch_address);
+        read_4_bytes(&no_captured);
         std::stringstream stream;
         stream << "0x" << std::hex << std::uppercase << branch_address;
-        out = "make_closure " + stream.str();
-    } else if (code == OppCodes::set) {
-        std::string var = read_string();
-        out = "set " + var;
-    } else if (code == OppCodes::define) {
-        std::string var = read_string();
-        out = "define " + var;
+        out = "make_closure " + stream.str() + " " + std::to_string(no_captured);
+    } else if (code >= OppCodes::prim_add && code <= OppCodes::prim_is_symbol) {
+        out = built_in.find(primitives[code - OppCodes::prim_add].first)->second;
+        if(code <= OppCodes::prim_div) {
+            uint8_t no_args;
+            read_byte(&no_args);
+            out += " " + std::to_string(no_args);
+        }
+    } else if (code >= OppCodes::unchecked_add && code <= OppCodes::unchecked_ge) {
+        out = "unchecked " + built_in.find(primitives[code - OppCodes::unchecked_add].first)->second;
+        if(code <= OppCodes::unchecked_div) {
+            uint8_t no_args;
+            read_byte(&no_args);
+            out += " " + std::to_string(no_args);
+        }
     } else if (code == OppCodes::label) {
         out = "label";
     } else if (code == OppCodes::proc_end) {
         out = "proc_end";
         return false;
-    } else if (code == OppCodes::data_start || code == OppCodes::data_end || code == OppCodes::const_data) {
+    } else if (code == OppCodes::data_start || code == OppCodes::data_end || code == OppCodes::const_data || code == OppCodes::data_offset || code == OppCodes::global_names || code == OppCodes::profile_table) {
         out = "!!data_instruction!!";
         return false;
+    } else if(code >= OppCodes::reg_enter && code <= OppCodes::reg_closure) {
+        // The register instructions are listed as their name and their input, the registers as r<index>
+        auto hex = [](uint32_t address) {
+            std::stringstream stream;
+            stream << "0x" << std::hex << std::uppercase << address;
+            return stream.str();
+        };
+        auto reg = [this](void) {
+            uint8_t index;
+            read_byte(&index);
+            return " r" + std::to_string(index);
+        };
+        auto word = [this](void) {
+            uint32_t value;
+            read_4_bytes(&value);
+            return value;
+        };
+        auto reg_list = [this, &reg](void) {
+            uint8_t no_registers;
+            read_byte(&no_registers);
+            std::string list = " [";
+            for(uint8_t i = 0; i < no_registers; i++) {
+                list += reg();
+            }
+            return list + " ]";
+        };
+        auto global = [this, &word](void) {
+            uint32_t index = word();
+            return " " + (index < global_names.size() ? global_names[index] : std::to_string(index));
+        };
+        auto primitive = [this](void) {
+            uint8_t test;
+            read_byte(&test);
+            return test >= OppCodes::unchecked_add ? " unchecked " + built_in.find(primitives[test - OppCodes::unchecked_add].first)->second
+                                                   : " " + built_in.find(primitives[test - OppCodes::prim_add].first)->second;
+        };
+        out = opp_names[code];
+        if(code == OppCodes::reg_enter) {
+            uint32_t frame_size = word();
+            out += " " + std::to_string(frame_size) + " " + std::to_string(word());
+        } else if(code == OppCodes::reg_const) {
+            out += reg();
+            out += " <" + std::to_string(word()) + ">";
+        } else if(code == OppCodes::reg_move || code == OppCodes::reg_unbox || code == OppCodes::reg_set_box) {
+            out += reg();
+            out += reg();
+        } else if(code == OppCodes::reg_global_get || code == OppCodes::reg_global_set || code == OppCodes::reg_global_define) {
+            out += reg();
+            out += global();
+        } else if(code == OppCodes::reg_box || code == OppCodes::reg_ret) {
+            out += reg();
+        } else if(code == OppCodes::reg_prim) {
+            out += primitive();
+            out += reg();
+            out += reg_list();
+        } else if(code == OppCodes::reg_branch_false || code == OppCodes::reg_branch_true) {
+            std::string address = hex(word());
+            out += reg() + " " + address;
+        } else if(code == OppCodes::reg_branch_if_not) {
+            std::string address = hex(word());
+            out += primitive();
+            out += reg_list() + " " + address;
+        } else if(code == OppCodes::reg_loop) {
+            std::string address = hex(word());
+            out += reg();
+            out += reg_list() + " " + address;
+        } else if(code == OppCodes::reg_call || code == OppCodes::reg_tail_call) {
+            out += reg();
+            if(code == OppCodes::reg_call) {
+                out += reg();
+            }
+            out += reg_list();
+        } else if(code == OppCodes::reg_call_global || code == OppCodes::reg_tail_call_global) {
+            out += global();
+            if(code == OppCodes::reg_call_global) {
+                out += reg();
+            }
+            out += reg_list();
+        } else if(code == OppCodes::reg_call_direct || code == OppCodes::reg_tail_call_direct) {
+            out += global();
+            out += " " + hex(word());
+            if(code == OppCodes::reg_call_direct) {
+                out += reg();
+            }
+            out += reg_list();
+        } else {
+            out += " " + hex(word());
+            out += reg();
+            out += reg_list();
+        }
     } else if(code == OppCodes::unbind) {
         out = "unbind";
     } else {
@@ -154,7 +298,7 @@ ftxui::Element VM::draw_stack(std::shared_ptr<scm_stack> stck)
     return ftxui::vbox(r);
 }
 
-ftxui::Element VM::draw_environment(void)
+ftxui::Element VM::draw_frame(size_t depth)
 {
     auto is_built_in = [](const std::pair<std::string, std::shared_ptr<ScmObj> >& p) {
         auto c = std::dynamic_pointer_cast<ScmClosure>(p.second);
@@ -165,39 +309,28 @@ ftxui::Element VM::draw_environment(void)
     };
     ftxui::Elements vars;
     ftxui::Elements values;
-    for(const auto& i: *(ENVT->map)) {
-        if(!is_built_in(i)) {
-            vars.push_back(ftxui::text(i.first));
-            values.push_back(ftxui::text(i.second->to_str()));
+    if(depth < frame_bases.size()) {
+        // The frames of lambdas and lets only know the slots of their variables
+        size_t base = frame_bases[frame_bases.size() - 1 - depth];
+        size_t end = depth == 0 ? slot_stack.size() : frame_bases[frame_bases.size() - depth];
+        for(size_t i = base; i < end; i++) {
+            vars.push_back(ftxui::text("slot " + std::to_string(i - base)));
+            // The registers of register based code are empty until they are set
+            values.push_back(ftxui::text(slot_stack[i] != nullptr ? slot_stack[i]->to_str() : ""));
             values.push_back(ftxui::separatorLight() | ftxui::dim);
             vars.push_back(ftxui::separatorLight() | ftxui::dim);
         }
+        return ftxui::hbox({ftxui::vbox(vars) | ftxui::flex,
+                            ftxui::vbox(values)}) | ftxui::flex;
     }
-    return ftxui::hbox({ftxui::vbox(vars) | ftxui::flex,
-                        ftxui::vbox(values)}) | ftxui::flex;
-}
-
-ftxui::Element VM::draw_prev_environment(void)
-{
-    auto is_built_in = [](const std::pair<std::string, std::shared_ptr<ScmObj> >& p) {
-        auto c = std::dynamic_pointer_cast<ScmClosure>(p.second);
-        if(c) {
-            return c->built_in;
-        }
-        return false;
-    };
-    auto prev_env = ENVT;
-    if(ENVT->prev) {
-        prev_env = ENVT->prev;
-    } else {
+    if(depth > frame_bases.size()) {
         return ftxui::hbox();
     }
-    ftxui::Elements vars;
-    ftxui::Elements values;
-    for(const auto& i: *(prev_env->map)) {
-        if(!is_built_in(i)) {
-            vars.push_back(ftxui::text(i.first));
-            values.push_back(ftxui::text(i.second->to_str()));
+    // Below the frames is the top level, its variables are kept in the global slots
+    for(size_t i = 0; i < globals.size(); i++) {
+        if(globals[i] != nullptr && !is_built_in({global_names[i], globals[i]})) {
+            vars.push_back(ftxui::text(global_names[i]));
+            values.push_back(ftxui::text(globals[i]->to_str()));
             values.push_back(ftxui::separatorLight() | ftxui::dim);
             vars.push_back(ftxui::separatorLight() | ftxui::dim);
         }
@@ -206,6 +339,16 @@ ftxui::Element VM::draw_prev_environment(void)
                         ftxui::vbox(values)}) | ftxui::flex;
 }
 
+ftxui::Element VM::draw_environment(void)
+{
+    return draw_frame(0);
+}
+
+ftxui::Element VM::draw_prev_environment(void)
+{
+    return draw_frame(1);
+}
+
 ftxui::Element VM::draw_instructions()
 {
     auto backup = file.tellg();